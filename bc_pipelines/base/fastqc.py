@@ -1,4 +1,5 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import decimal
 import io
 from pathlib import Path
@@ -7,12 +8,20 @@ import numpy as np
 import pandas as pd
 from bc_report.info import AnalysisInfo
 from bc_report import create_logger
+from bc_report.metrics import Metric
+from bc_report.preflight import ExpectedInput
 from .report import BaseStage
 
 D = decimal.Decimal
 logger = create_logger(__name__)
 
 
+FastQCPage = namedtuple('FastQCPage', [
+    'number', 'name', 'start', 'stop', 'conditions', 'status_counts',
+])
+"""Page of the sources of IDs in [start, stop)."""
+
+
 class OverSeq:
     def __init__(self, seq, count, percentage, possible_source):
         self.seq = seq
@@ -21,6 +30,14 @@ class OverSeq:
         self.possible_source = possible_source
 
 
+def read_fastqc_data(fastqc_zip_pth: Path) -> str:
+    """Read the fastqc_data.txt inside the FastQC zip file."""
+    # Zip files inside a job archive are read from the member file
+    with fastqc_zip_pth.open('rb') as f, zipfile.ZipFile(f, 'r') as zipf:
+        fastqc_data_pth = '{}/fastqc_data.txt'.format(fastqc_zip_pth.stem)
+        return zipf.read(fastqc_data_pth).decode('utf8')
+
+
 def parse_fastqc_data(data_f):
     qc_info = OrderedDict()
     qc_data = {}
@@ -40,7 +57,9 @@ def parse_fastqc_data(data_f):
 
 class FastQCStage(BaseStage):
     template_entrances = ['base/fastqc.html']
+    page_template = 'base/fastqc_page.html'
     result_folder_name = 'fastqc'
+    input_patterns = ['*/*_fastqc.zip']
 
     MODULES = OrderedDict([
         ('Basic Statistics', None),
@@ -62,6 +81,13 @@ class FastQCStage(BaseStage):
         'warn': 'fa-exclamation',
     }
 
+    STATUS_TO_VALUE = {'pass': 0, 'warn': 1, 'fail': 2}
+
+    # Sources per page of the detailed QC tables and charts
+    PAGE_SIZE = 100
+    # Number of pages rendered concurrently
+    RENDER_WORKERS = 4
+
     def accepted_data_sources(self, data_sources) -> OrderedDict:
         filtered_sources = OrderedDict()
         for source_name, source in data_sources.items():
@@ -69,18 +95,33 @@ class FastQCStage(BaseStage):
                 filtered_sources[Path(source_name)] = source
         return filtered_sources
 
+    def expected_inputs(self, analysis_info: AnalysisInfo):
+        """FastQC zip file of each source, with its fastqc_data.txt."""
+        result_root = self._locate_result_folder()
+        return [
+            ExpectedInput(
+                result_root.joinpath(
+                    source_p.stem, '{}_fastqc.zip'.format(source_p.stem)
+                ),
+                members=['{}_fastqc/fastqc_data.txt'.format(source_p.stem)],
+            )
+            for source_p in self.accepted_data_sources(
+                analysis_info.data_sources
+            )
+        ]
+
     def parse_per_base_quality(self, data_info, source_p, qc_data):
         perbase_q = qc_data['Per base sequence quality']
         df = (
             pd.DataFrame(perbase_q[1:], columns=perbase_q[0])
                 .assign(**{
                     # '#Base': lambda x: x['#Base'].astype(np.int),
-                    'Mean': lambda x: x['Mean'].astype(np.float),
+                    'Mean': lambda x: x['Mean'].astype(np.float64),
                 })
         )
         data_info['per_base_quality'].append({
             'name': source_p.stem,
-            'data': list(df['Mean'].values),
+            'data': df['Mean'].values,
             'pointStart': 1,
         })
 
@@ -92,18 +133,21 @@ class FastQCStage(BaseStage):
         accepted_sources = self.accepted_data_sources(
             analysis_info.data_sources
         )
-        for source_p, source in accepted_sources.items():
-            fastqc_zip_pth = Path(
-                result_root,
+        fastqc_zip_pths = [
+            result_root.joinpath(
                 source_p.stem, '{}_fastqc.zip'.format(source_p.stem)
             )
+            for source_p in accepted_sources
+        ]
+        # Zip files are read ahead concurrently, and parsed in order
+        for source_p, (fastqc_zip_pth, fastqc_data) in zip(
+            accepted_sources,
+            self.prefetch(fastqc_zip_pths, read_fastqc_data)
+        ):
             logger.debug('Parsing FastQC zip file %s' % fastqc_zip_pth.as_posix())
-            with zipfile.ZipFile(fastqc_zip_pth.as_posix(), 'r') as zipf:
-                fastqc_data_pth = '{}/fastqc_data.txt'.format(fastqc_zip_pth.stem)
-                with io.TextIOWrapper(zipf.open(fastqc_data_pth), encoding='utf8') as f:
-                    qc_info, qc_data = parse_fastqc_data(f)
-                    data_info['qc_info'][source_p.name] = qc_info
-                    data_info['qc_data'][source_p.name] = qc_data
+            qc_info, qc_data = parse_fastqc_data(io.StringIO(fastqc_data))
+            data_info['qc_info'][source_p.name] = qc_info
+            data_info['qc_data'][source_p.name] = qc_data
 
         # Parse FastQC per base quality
         data_info['per_base_quality'] = []
@@ -138,6 +182,136 @@ class FastQCStage(BaseStage):
             }
         return data_info
 
+    def summarize(self, data_info):
+        return {'base_stat': data_info['base_stat']}
+
+    def metrics(self, data_info):
+        """Basic statistics, module statuses, and per base quality.
+
+        Module statuses are also valued 0, 1, and 2 for pass, warn, and
+        fail, so they can be charted.
+        """
+        for source, base_stat in data_info['base_stat'].items():
+            for name in ['Total Sequences', '%GC']:
+                if name in base_stat:
+                    yield Metric(source, name, float(base_stat[name]), None)
+            for module, status in data_info['qc_info'][source].items():
+                yield Metric(
+                    source, 'Status: {}'.format(module),
+                    self.STATUS_TO_VALUE.get(status), status
+                )
+        # Series are in the same source order as the base statistics
+        for source, series in zip(
+            data_info['base_stat'], data_info['per_base_quality']
+        ):
+            mean_quality = series['data']
+            if not len(mean_quality):
+                continue
+            yield Metric(
+                source, 'Per base quality mean',
+                float(mean_quality.mean()), None
+            )
+            yield Metric(
+                source, 'Per base quality min',
+                float(mean_quality.min()), None
+            )
+
+    def page_ranges(self):
+        """Number, file name, start, and stop of the source pages."""
+        num_sources = len(self.report.analysis_info.index.source_names)
+        return [
+            (
+                number, 'fastqc_{:03d}.html'.format(number),
+                start, min(start + self.PAGE_SIZE, num_sources),
+            )
+            for number, start in enumerate(
+                range(0, num_sources, self.PAGE_SIZE), 1
+            )
+        ]
+
+    def page_names(self):
+        return super().page_names() + [
+            name for _, name, _, _ in self.page_ranges()
+        ]
+
+    def paginate(self, data_info):
+        """Split the sources into pages of at most :py:attr:`PAGE_SIZE`.
+
+        Sources are paged in their table order, which is grouped by
+        condition and sample.
+        """
+        index = self.report.analysis_info.index
+        pages = []
+        for number, name, start, stop in self.page_ranges():
+            sources = index.source_names[start:stop]
+            pages.append(FastQCPage(
+                number=number,
+                name=name,
+                start=start,
+                stop=stop,
+                conditions=list(OrderedDict.fromkeys(
+                    index.condition_names[
+                        index.sample_condition[index.source_sample[i]]
+                    ]
+                    for i in range(start, stop)
+                )),
+                status_counts=Counter(
+                    status for source in sources
+                    for status in data_info['qc_info'][source].values()
+                ),
+            ))
+        return pages
+
+    def module_status_counts(self, data_info):
+        """Count the sources of each status by module."""
+        counts = OrderedDict(
+            (module, Counter()) for module in self.MODULES
+        )
+        for qc_info in data_info['qc_info'].values():
+            for module, module_counts in counts.items():
+                module_counts[qc_info.get(module, 'NA')] += 1
+        return counts
+
+    def render(self, data_info, report_root):
+        """Render the overview page and the pages of the sources.
+
+        The overview only counts the module statuses, so every page stays
+        small however many sources there are. Pages are rendered
+        concurrently, and in memory only the requested ones.
+        """
+        pages = self.paginate(data_info)
+        data_info = dict(
+            data_info, pages=pages,
+            module_status_counts=self.module_status_counts(data_info),
+        )
+        super().render(data_info, report_root)
+
+        per_base_quality = dict(
+            zip(data_info['base_stat'], data_info['per_base_quality'])
+        )
+        tpl = self._env.get_template(self.page_template)
+        index = self.report.analysis_info.index
+
+        def render_page(page):
+            context = self.get_context_data(data_info)
+            context.update({
+                'page': page,
+                'rows': list(index.source_rows(page.start, page.stop)),
+                'per_base_quality': [
+                    per_base_quality[source]
+                    for source in index.source_names[page.start:page.stop]
+                    if source in per_base_quality
+                ],
+            })
+            page_pth = report_root / page.name
+            logger.debug('writing template to %s' % page_pth.as_posix())
+            self.report.writer.write_text(page_pth, tpl.render(context))
+
+        pages = [page for page in pages if self.is_page_requested(page.name)]
+        with ThreadPoolExecutor(self.RENDER_WORKERS) as executor:
+            # Consume the results to raise the rendering errors
+            list(executor.map(render_page, pages))
+
     def get_context_data(self, data_info):
         context = super().get_context_data(data_info)
         context.update({
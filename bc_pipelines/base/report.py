@@ -12,6 +12,7 @@ class BaseStage(Stage):
 
 class BaseSummaryHomeStage(SummaryStage):
     template_entrances = ['base/index.html']
+    depends_on = []
     template_find_paths = [
         here / 'templates',
     ]
@@ -0,0 +1,169 @@
+/* Lazily draw Highcharts charts from exported chart data files.
+ *
+ * Chart data are written as separate JSON files by Stage.export_data. A chart
+ * is drawn only when its element becomes visible, and each data file is
+ * fetched at most once however many charts share it.
+ *
+ *     ChartData.lazyChart('#chart-id', 'data/charts/<digest>.json',
+ *         function (data) { return {series: data}; });
+ *
+ * Reports generated with binary series write the numeric arrays to a
+ * sidecar buffer of little-endian values, and the JSON file is
+ *
+ *     {"$buffer": "<digest>.bin", "$data": <data>}
+ *
+ * where each array is {"$array": "float32", "offset": 0, "shape": [n]}. The
+ * buffer is fetched along and the arrays are restored before the data are
+ * passed on, so charts are drawn the same from either form.
+ */
+var ChartData = (function ($) {
+    var requests = {};
+    var TYPED_ARRAYS = {
+        float32: typeof Float32Array !== 'undefined' && Float32Array,
+        int32: typeof Int32Array !== 'undefined' && Int32Array,
+        float64: typeof Float64Array !== 'undefined' && Float64Array
+    };
+    var DATA_VIEW_GETTERS = {
+        float32: 'getFloat32',
+        int32: 'getInt32',
+        float64: 'getFloat64'
+    };
+    var littleEndian = typeof Uint16Array !== 'undefined' &&
+        new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+    // View the values of an array descriptor as a typed array
+    function typedArray(desc, buffer) {
+        var Type = TYPED_ARRAYS[desc.$array];
+        var length = 1;
+        for (var i = 0; i < desc.shape.length; i++) {
+            length *= desc.shape[i];
+        }
+        if (littleEndian) {
+            return new Type(buffer, desc.offset, length);
+        }
+        var view = new DataView(buffer, desc.offset);
+        var getter = DATA_VIEW_GETTERS[desc.$array];
+        var values = new Type(length);
+        for (var j = 0; j < length; j++) {
+            values[j] = view[getter](j * Type.BYTES_PER_ELEMENT, true);
+        }
+        return values;
+    }
+
+    // Highcharts 4 copies non-Array objects key by key, so the typed arrays
+    // are handed over as plain (nested) arrays
+    function toArray(values, shape, dim, start) {
+        var size = shape[dim];
+        var result = new Array(size);
+        var i;
+        if (dim === shape.length - 1) {
+            for (i = 0; i < size; i++) {
+                result[i] = values[start + i];
+            }
+            return result;
+        }
+        var stride = 1;
+        for (i = dim + 1; i < shape.length; i++) {
+            stride *= shape[i];
+        }
+        for (i = 0; i < size; i++) {
+            result[i] = toArray(values, shape, dim + 1, start + i * stride);
+        }
+        return result;
+    }
+
+    // Restore the arrays of the data from the buffer
+    function unpack(data, buffer) {
+        if (data === null || typeof data !== 'object') {
+            return data;
+        }
+        if (data.hasOwnProperty('$array')) {
+            return toArray(typedArray(data, buffer), data.shape, 0, 0);
+        }
+        for (var key in data) {
+            if (data.hasOwnProperty(key)) {
+                data[key] = unpack(data[key], buffer);
+            }
+        }
+        return data;
+    }
+
+    function fetchBuffer(url) {
+        var deferred = $.Deferred();
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', url);
+        xhr.responseType = 'arraybuffer';
+        xhr.onload = function () {
+            if (xhr.status === 200 || (xhr.status === 0 && xhr.response)) {
+                deferred.resolve(xhr.response);
+            } else {
+                deferred.reject(xhr);
+            }
+        };
+        xhr.onerror = function () {
+            deferred.reject(xhr);
+        };
+        xhr.send();
+        return deferred.promise();
+    }
+
+    function fetch(url) {
+        if (!requests.hasOwnProperty(url)) {
+            requests[url] = $.getJSON(url).then(function (data) {
+                if (data === null || !data.hasOwnProperty('$buffer')) {
+                    return data;
+                }
+                var bufferUrl = url.replace(/[^\/]*$/, data.$buffer);
+                return fetchBuffer(bufferUrl).then(function (buffer) {
+                    return unpack(data.$data, buffer);
+                });
+            });
+        }
+        return requests[url];
+    }
+
+    function whenVisible(el, callback) {
+        if (!('IntersectionObserver' in window)) {
+            callback();
+            return;
+        }
+        var observer = new IntersectionObserver(function (entries) {
+            $.each(entries, function (i, entry) {
+                if (entry.isIntersecting) {
+                    observer.disconnect();
+                    callback();
+                    return false;
+                }
+            });
+        }, {rootMargin: '200px'});
+        observer.observe(el);
+    }
+
+    function lazyChart(selector, url, buildOptions) {
+        $(selector).each(function () {
+            var $el = $(this);
+            whenVisible(this, function () {
+                fetch(url).done(function (data) {
+                    $el.highcharts(buildOptions(data));
+                });
+            });
+        });
+    }
+
+    // Reflow the drawn charts, skipping those not fetched yet
+    function reflow(selector, context) {
+        $(selector, context).each(function () {
+            var chart = $(this).highcharts();
+            if (chart) {
+                chart.reflow();
+            }
+        });
+    }
+
+    return {
+        fetch: fetch,
+        unpack: unpack,
+        lazyChart: lazyChart,
+        reflow: reflow
+    };
+})(jQuery);
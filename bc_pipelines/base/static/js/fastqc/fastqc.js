@@ -1,77 +1,79 @@
 $(function () {
-    $('#chart-qc-perbase').highcharts({
-        chart: {
-            type: 'spline',
-            zoomType: 'xy'
-        },
-        title: {
-            text: 'Per base quality'
-        },
-        subtitle: {},
-        xAxis: {
-            min: 1,
-            tickInterval: 2,
-            alternateGridColor: 'rgba(210, 210, 210, .4)'
-        },
-        yAxis: {
+    ChartData.lazyChart('#chart-qc-perbase', qc_perbase_data_url, function (qc_perbase_data) {
+        return {
+            chart: {
+                type: 'spline',
+                zoomType: 'xy'
+            },
             title: {
-                text: 'Quality'
+                text: 'Per base quality'
             },
-            min: 0,
-            plotBands: [
-                {
-                    // Bad
-                    from: 0,
-                    to: 20,
-                    color: 'rgba(230, 175, 175, .7)'
-                },
-                {
-                    // Not good
-                    from: 20,
-                    to: 28,
-                    color: 'rgba(230, 215, 175, .7)'
-                },
-                {
-                    // Good
-                    from: 28,
-                    to: 60,
-                    color: 'rgba(175, 230, 175, .7)'
-                },
-            ]
-        },
-        tooltip: {
-            headerFormat: '<b>{series.name}</b><br>',
-            pointFormat: 'Mean Qual. = {point.y:.2f} at base {point.x}'
-        },
-        legend: {
-            layout: 'vertical',
-            align: 'right',
-            verticalAlign: 'middle',
-            borderWidth: 0
-        },
-        plotOptions: {
-            spline: {
-                lineWidth: 4,
-                states: {
-                    hover: {
-                        lineWidth: 5
-                    }
-                },
-                marker: {
-                    enabled: false
+            subtitle: {},
+            xAxis: {
+                min: 1,
+                tickInterval: 2,
+                alternateGridColor: 'rgba(210, 210, 210, .4)'
+            },
+            yAxis: {
+                title: {
+                    text: 'Quality'
                 },
-                animation: false
-            }
-        },
-        navigation: {
-            menuItemStyle: {
-                fontSize: '1em'
-            }
-        },
-        credits: {
-            text: "Generated by BioCloud Report",
-            href: "http://biocloud.tw"
-        },
-        series: qc_perbase_data
+                min: 0,
+                plotBands: [
+                    {
+                        // Bad
+                        from: 0,
+                        to: 20,
+                        color: 'rgba(230, 175, 175, .7)'
+                    },
+                    {
+                        // Not good
+                        from: 20,
+                        to: 28,
+                        color: 'rgba(230, 215, 175, .7)'
+                    },
+                    {
+                        // Good
+                        from: 28,
+                        to: 60,
+                        color: 'rgba(175, 230, 175, .7)'
+                    },
+                ]
+            },
+            tooltip: {
+                headerFormat: '<b>{series.name}</b><br>',
+                pointFormat: 'Mean Qual. = {point.y:.2f} at base {point.x}'
+            },
+            legend: {
+                layout: 'vertical',
+                align: 'right',
+                verticalAlign: 'middle',
+                borderWidth: 0
+            },
+            plotOptions: {
+                spline: {
+                    lineWidth: 4,
+                    states: {
+                        hover: {
+                            lineWidth: 5
+                        }
+                    },
+                    marker: {
+                        enabled: false
+                    },
+                    animation: false
+                }
+            },
+            navigation: {
+                menuItemStyle: {
+                    fontSize: '1em'
+                }
+            },
+            credits: {
+                text: "Generated by BioCloud Report",
+                href: "http://biocloud.tw"
+            },
+            series: qc_perbase_data
+        };
     });
-});
\ No newline at end of file
+});
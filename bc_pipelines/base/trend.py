@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import numpy as np
+from bc_report import create_logger
+from bc_report.metrics import MetricsStore
+from .report import BaseReport, BaseStage
+
+logger = create_logger(__name__)
+
+
+def trend_series(points):
+    """Column-oriented chart data of the trend points."""
+    return {
+        'time': np.array(
+            [int(p.run_time * 1000) for p in points], dtype=np.int64
+        ),
+        'job': [p.job_path for p in points],
+        'num_samples': np.array(
+            [p.num_samples for p in points], dtype=np.int64
+        ),
+        'mean': np.array([p.mean for p in points], dtype=np.float64),
+        'min': np.array([p.min for p in points], dtype=np.float64),
+        'max': np.array([p.max for p in points], dtype=np.float64),
+    }
+
+
+class TrendStage(BaseStage):
+    template_entrances = ['base/trend.html']
+
+    def parse(self, analysis_info):
+        store = self.report.store
+        data_info = {
+            'num_runs': store.num_runs(),
+            'trends': OrderedDict(),
+        }
+        for stage_name, metric in store.metric_names():
+            data_info['trends'].setdefault(stage_name, OrderedDict())[
+                metric
+            ] = trend_series(store.trend(stage_name, metric))
+        return data_info
+
+    def copy_static(self, report_root):
+        # The trends are not of a single job, so no result is embedded
+        pass
+
+
+class TrendReport(BaseReport):
+    """Trends of the QC metrics over all the runs of the metrics store.
+
+    Unlike other reports, it is not of a job but of the store.
+    """
+
+    stage_classes = [TrendStage]
+
+    def __init__(
+        self, store: MetricsStore, asset_mode='development',
+        binary_series=False
+    ):
+        logger.debug('New trend report of {!s}'.format(store.db_path))
+        self.store = store
+        # Nothing is cached of the trends, which are read from the store
+        self._setup(
+            None, None, asset_mode=asset_mode, binary_series=binary_series
+        )
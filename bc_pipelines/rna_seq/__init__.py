@@ -1,4 +1,6 @@
+from collections import OrderedDict
 from pathlib import Path
+from seaborn.palettes import husl_palette
 from bc_report.report import Stage
 from ..base.report import BaseSummaryHomeStage
 
@@ -10,3 +12,16 @@ class RNASeqStageMixin(Stage):
         here / 'templates',
         *BaseSummaryHomeStage.template_find_paths,
     ]
+
+
+def condition_colors(conditions, alpha=1.0, **palette_kws):
+    """Map each condition to a distinct CSS rgba() color string."""
+    palette_kws.setdefault('s', 0.6)
+    return OrderedDict(
+        (condition, 'rgba({:d}, {:d}, {:d}, {})'.format(
+            *[int(c * 255) for c in color], alpha
+        ))
+        for condition, color in zip(
+            conditions, husl_palette(len(conditions), **palette_kws)
+        )
+    )
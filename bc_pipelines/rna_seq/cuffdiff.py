@@ -1,21 +1,542 @@
+from collections import OrderedDict
+import heapq
+import json
 from pathlib import Path
+import tempfile
+import numpy as np
+import pandas as pd
 from bc_report.info import AnalysisInfo
 from bc_report import create_logger
+from bc_report.preflight import ExpectedInput
+from bc_report.utils import tojson
 from ..base.report import BaseStage
-from . import RNASeqStageMixin
+from . import RNASeqStageMixin, condition_colors
+from .cufflinks import read_tracking_ids
+from .expression import (
+    log_fpkm, blockwise_correlation, spearman_correlation, truncated_pca,
+)
 
 logger = create_logger(__name__)
 
+# Typed columns of Cuffdiff's *_exp.diff
+DIFF_DTYPES = OrderedDict([
+    ('test_id', str),
+    ('gene_id', str),
+    ('gene', str),
+    ('locus', str),
+    ('sample_1', str),
+    ('sample_2', str),
+    ('status', str),
+    ('value_1', np.float64),
+    ('value_2', np.float64),
+    ('log2(fold_change)', np.float64),
+    ('test_stat', np.float64),
+    ('p_value', np.float64),
+    ('q_value', np.float64),
+    ('significant', str),
+])
+
+
+def iter_diff_chunks(diff_pth: Path, columns=None, chunksize=100000):
+    """Stream Cuffdiff's differential test result in chunks of DataFrame.
+
+    Only the given columns are parsed. The ``significant`` column is
+    converted to bool.
+    """
+    if columns is None:
+        columns = list(DIFF_DTYPES)
+    with diff_pth.open('rb') as f:
+        reader = pd.read_csv(
+            f, sep='\t',
+            usecols=columns,
+            dtype={col: DIFF_DTYPES[col] for col in columns},
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            if 'significant' in chunk:
+                chunk['significant'] = chunk['significant'] == 'yes'
+            yield chunk
+
+
+# Columns of the differential test table in the report
+DIFF_TABLE_COLUMNS = [
+    'test_id', 'gene_id', 'gene', 'locus', 'sample_1', 'sample_2', 'status',
+    'value_1', 'value_2', 'log2(fold_change)', 'p_value', 'q_value',
+    'significant',
+]
+
+
+def jsonable_column(values):
+    """Convert a column to JSON values; NaN to null and inf to string."""
+    if values.dtype.kind == 'O':
+        out = values.copy()
+        out[pd.isnull(values)] = None
+        return out.tolist()
+    if values.dtype.kind != 'f':
+        return values.tolist()
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    out[np.isposinf(values)] = 'Infinity'
+    out[np.isneginf(values)] = '-Infinity'
+    return out.tolist()
+
+
+def rank_diff_tests(df):
+    """Ranking key of the tests: ascending q-value, descending |log2FC|.
+
+    Tests without q-value are ranked last.
+    """
+    q_key = df['q_value'].fillna(np.inf).values
+    lfc_key = -np.abs(df['log2(fold_change)'].fillna(0).values)
+    return q_key, lfc_key
+
+
+def read_replicates(read_groups_pth: Path):
+    """Read the (condition, replicate number) of Cuffdiff's read groups."""
+    with read_groups_pth.open('rb') as f:
+        read_groups = pd.read_csv(
+            f, sep='\t',
+            usecols=['condition', 'replicate_num'],
+            dtype={'condition': str, 'replicate_num': np.int64},
+        )
+    return list(zip(read_groups['condition'], read_groups['replicate_num']))
+
+
+def read_replicate_matrix(
+    tracking_pth: Path, replicates, gene_index: pd.Index, chunksize=500000
+):
+    """Read the long-format *.read_group_tracking into a dense matrix.
+
+    The matrix is float32 of shape (num replicates, num genes). The file is
+    streamed by chunks, each placed into the matrix by its tracking IDs and
+    (condition, replicate).
+    """
+    replicate_index = pd.MultiIndex.from_tuples(replicates)
+    matrix = np.zeros((len(replicates), len(gene_index)), dtype=np.float32)
+    with tracking_pth.open('rb') as f:
+        reader = pd.read_csv(
+            f, sep='\t',
+            usecols=['tracking_id', 'condition', 'replicate', 'FPKM'],
+            dtype={
+                'tracking_id': str, 'condition': str,
+                'replicate': np.int64, 'FPKM': np.float32,
+            },
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            gene_ix = gene_index.get_indexer(chunk['tracking_id'])
+            rep_ix = replicate_index.get_indexer(pd.MultiIndex.from_arrays(
+                [chunk['condition'], chunk['replicate']]
+            ))
+            valid = (gene_ix >= 0) & (rep_ix >= 0)
+            matrix[rep_ix[valid], gene_ix[valid]] = (
+                chunk['FPKM'].values[valid]
+            )
+    return matrix
+
+
+def iter_sorted_run(run_pth: Path):
+    """Iterate the (q key, log2FC key, row) records of a sorted run."""
+    with run_pth.open() as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class DensityGrid:
+    """2-D histogram of fixed bins that is accumulated chunk by chunk.
+
+    Values out of range are clipped into the border bins and NaNs are
+    dropped, so every test is counted exactly once.
+    """
+
+    def __init__(self, x_range, y_range, bins=(80, 60)):
+        self.x_edges = np.linspace(x_range[0], x_range[1], bins[0] + 1)
+        self.y_edges = np.linspace(y_range[0], y_range[1], bins[1] + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x = np.clip(x[valid], self.x_edges[0], self.x_edges[-1])
+        y = np.clip(y[valid], self.y_edges[0], self.y_edges[-1])
+        counts, _, _ = np.histogram2d(x, y, bins=[self.x_edges, self.y_edges])
+        self.counts += counts.astype(np.int64)
+
+    def nonzero_bins(self):
+        """Return the bin centers and counts of all the non-empty bins."""
+        x_ix, y_ix = np.nonzero(self.counts)
+        x_centers = (self.x_edges[:-1] + self.x_edges[1:]) / 2
+        y_centers = (self.y_edges[:-1] + self.y_edges[1:]) / 2
+        return x_centers[x_ix], y_centers[y_ix], self.counts[x_ix, y_ix]
+
 
 class CuffdiffStage(RNASeqStageMixin, BaseStage):
     template_entrances = ['rna_seq/cuffdiff.html']
     result_folder_name = 'cuffdiff'
+    input_patterns = [
+        'gene_exp.diff', 'isoform_exp.diff',
+        'genes.fpkm_tracking', 'genes.read_group_tracking',
+    ]
+    data_dirs = ['data/cuffdiff']
+
+    # Differential tests to plot. Key: name of *_exp.diff; value: display
+    DIFF_TYPES = OrderedDict([
+        ('gene', 'Gene'),
+        ('isoform', 'Isoform'),
+    ])
+    # Fixed plotting ranges so the grids can be filled by chunks
+    LOG2_FC_RANGE = (-10, 10)
+    NEG_LOG10_P_RANGE = (0, 10)
+    LOG2_MEAN_FPKM_RANGE = (0, 20)
+    # Number of the top hits listed directly in the page
+    TOP_HITS = 20
+    # Number of tests per JSON shard of the full table
+    DIFF_TABLE_SHARD_SIZE = 500
+
+    def expected_inputs(self, analysis_info: AnalysisInfo):
+        result_dir = self._locate_result_folder()
+        filenames = [
+            '{}_exp.diff'.format(diff_type) for diff_type in self.DIFF_TYPES
+        ] + [
+            'read_groups.info', 'genes.fpkm_tracking',
+            'genes.read_group_tracking',
+        ]
+        return [ExpectedInput(result_dir / f) for f in filenames]
 
     def parse(self, analysis_info: AnalysisInfo):
         data_info = super().parse(analysis_info)
         data_info['raw_output'] = self.collect_raw_output(analysis_info)
+        data_info['diff_density'] = OrderedDict()
+        for diff_type in self.DIFF_TYPES:
+            logger.info(
+                'Binning Cuffdiff {} differential tests'.format(diff_type)
+            )
+            data_info['diff_density'][diff_type] = self.parse_diff_density(
+                self._locate_result_folder() / '{}_exp.diff'.format(diff_type)
+            )
+        logger.info('Computing Cuffdiff replicate correlation and PCA')
+        data_info['replicate_stat'] = self.parse_replicate_stat(analysis_info)
+        data_info['diff_table'] = OrderedDict()
+        for diff_type in self.DIFF_TYPES:
+            logger.info(
+                'Ranking Cuffdiff {} differential tests'.format(diff_type)
+            )
+            data_info['diff_table'][diff_type] = self.parse_diff_table(
+                self._locate_result_folder() / '{}_exp.diff'.format(diff_type),
+                diff_type
+            )
         return data_info
 
+    def parse_replicate_stat(self, analysis_info: AnalysisInfo):
+        """Correlate and project the replicates by their gene expression.
+
+        The Cuffdiff conditions are matched to the analysis conditions by
+        name, or else by their order. Replicates are named by the samples
+        of the matched condition.
+        """
+        result_dir = self._locate_result_folder()
+        replicates = read_replicates(result_dir / 'read_groups.info')
+        gene_index = read_tracking_ids(result_dir / 'genes.fpkm_tracking')
+        matrix = read_replicate_matrix(
+            result_dir / 'genes.read_group_tracking', replicates, gene_index
+        )
+
+        # Name the replicates by the analysis conditions and samples
+        cuffdiff_conditions = list(OrderedDict.fromkeys(
+            condition for condition, _ in replicates
+        ))
+        analysis_conditions = list(analysis_info.conditions)
+        if all(c in analysis_info.conditions for c in cuffdiff_conditions):
+            condition_map = {c: c for c in cuffdiff_conditions}
+        else:
+            condition_map = dict(zip(cuffdiff_conditions, analysis_conditions))
+            logger.warning(
+                'Cuffdiff conditions {} do not match the analysis conditions '
+                'by name, matched by their order to {}'.format(
+                    ', '.join(cuffdiff_conditions),
+                    ', '.join(analysis_conditions[:len(cuffdiff_conditions)]),
+                )
+            )
+        replicate_groups = OrderedDict()
+        replicate_names = []
+        for cuffdiff_condition, replicate_num in replicates:
+            condition = condition_map.get(
+                cuffdiff_condition, cuffdiff_condition
+            )
+            samples = list(analysis_info.conditions.get(condition, []))
+            if replicate_num < len(samples):
+                name = samples[replicate_num]
+            else:
+                name = '{}_{}'.format(cuffdiff_condition, replicate_num)
+            replicate_groups.setdefault(condition, []).append(name)
+            replicate_names.append(name)
+
+        log_expr = log_fpkm(matrix)
+        pca_scores, pca_explained = truncated_pca(log_expr)
+        return {
+            'replicates': replicate_names,
+            'replicate_groups': replicate_groups,
+            'num_genes': len(gene_index),
+            'pearson': blockwise_correlation(log_expr.T, transform=np.asarray),
+            'spearman': spearman_correlation(matrix.T),
+            'pca_scores': pca_scores,
+            'pca_explained': pca_explained,
+        }
+
+    def parse_diff_table(self, diff_pth: Path, diff_type):
+        """Rank the tests by their q-value and |log2FC|.
+
+        The top hits are kept by a bounded heap. Each chunk is also sorted and
+        spilled as a run to a temporary folder under the cache folder, so the
+        full ranking can be merged later with bounded memory. The folder is
+        removed once the returned table is dropped.
+        """
+        run_root = self.report.cache_root / 'cuffdiff'
+        if not run_root.exists():
+            run_root.mkdir(parents=True)
+        run_dir = tempfile.TemporaryDirectory(
+            prefix='{}.'.format(diff_type), dir=run_root.as_posix()
+        )
+
+        # Min-heap of (-q key, -log2FC key, -seq, row); the root is the
+        # worst of the current top hits
+        top_hits = []
+        run_pths = []
+        num_tests = 0
+        for chunk_ix, chunk in enumerate(iter_diff_chunks(
+            diff_pth, columns=DIFF_TABLE_COLUMNS
+        )):
+            q_key, lfc_key = rank_diff_tests(chunk)
+            order = np.lexsort((lfc_key, q_key))
+            rows = list(zip(*[
+                jsonable_column(chunk[col].values[order])
+                for col in DIFF_TABLE_COLUMNS
+            ]))
+            q_key, lfc_key = q_key[order].tolist(), lfc_key[order].tolist()
+
+            # Only the chunk's own top hits can enter the heap
+            for i in range(min(self.TOP_HITS, len(rows))):
+                item = (-q_key[i], -lfc_key[i], -(num_tests + i), rows[i])
+                if len(top_hits) < self.TOP_HITS:
+                    heapq.heappush(top_hits, item)
+                elif item > top_hits[0]:
+                    heapq.heapreplace(top_hits, item)
+                else:
+                    break
+
+            run_pth = Path(run_dir.name, 'run-{:05d}.jsonl'.format(chunk_ix))
+            with run_pth.open('w') as f:
+                for record in zip(q_key, lfc_key, rows):
+                    f.write(json.dumps(record))
+                    f.write('\n')
+            run_pths.append(run_pth)
+            num_tests += len(rows)
+
+        return {
+            'num_tests': num_tests,
+            'top_hits': [
+                dict(zip(DIFF_TABLE_COLUMNS, item[-1]))
+                for item in sorted(top_hits, reverse=True)
+            ],
+            'sorted_runs': run_pths,
+            'run_dir': run_dir,
+        }
+
+    def write_diff_table_shards(self, diff_type, diff_table, report_root):
+        """Merge the sorted runs and write the ranking as JSON shards.
+
+        The shards are written under ``data/cuffdiff/<diff_type>/``, along
+        with an ``index.json`` describing the columns and the shards.
+        """
+        shard_dir = Path('data', 'cuffdiff', diff_type)
+        shard_size = self.DIFF_TABLE_SHARD_SIZE
+        merged = heapq.merge(
+            *[iter_sorted_run(pth) for pth in diff_table['sorted_runs']],
+            key=lambda record: (record[0], record[1])
+        )
+        shard_names = []
+        shard_rows = []
+        for _, _, row in merged:
+            shard_rows.append(row)
+            if len(shard_rows) == shard_size:
+                shard_names.append(self._write_diff_table_shard(
+                    report_root, shard_dir, len(shard_names), shard_rows
+                ))
+                shard_rows = []
+        if shard_rows or not shard_names:
+            shard_names.append(self._write_diff_table_shard(
+                report_root, shard_dir, len(shard_names), shard_rows
+            ))
+        self.write_report_file(report_root, shard_dir / 'index.json', tojson({
+            'columns': DIFF_TABLE_COLUMNS,
+            'num_rows': diff_table['num_tests'],
+            'shard_size': shard_size,
+            'shards': shard_names,
+        }))
+        return (shard_dir / 'index.json').as_posix()
+
+    def _write_diff_table_shard(self, report_root, shard_dir, shard_ix, rows):
+        shard_name = 'shard-{:05d}.json'.format(shard_ix)
+        self.write_report_file(
+            report_root, shard_dir / shard_name,
+            tojson(rows, separators=(',', ':'))
+        )
+        return shard_name
+
+    def render(self, data_info, report_root):
+        data_info = dict(data_info, diff_table_index=OrderedDict(
+            (diff_type, self.write_diff_table_shards(
+                diff_type, diff_table, report_root
+            ))
+            for diff_type, diff_table in data_info['diff_table'].items()
+        ))
+        super().render(data_info, report_root)
+
+    def parse_diff_density(self, diff_pth: Path):
+        """Bin the tests of each comparison for volcano and MA plots."""
+        comparisons = OrderedDict()
+        for chunk in iter_diff_chunks(diff_pth, columns=[
+            'sample_1', 'sample_2', 'value_1', 'value_2',
+            'log2(fold_change)', 'p_value', 'significant',
+        ]):
+            for (sample_1, sample_2), df in chunk.groupby(
+                ['sample_1', 'sample_2'], sort=False
+            ):
+                key = (sample_1, sample_2)
+                if key not in comparisons:
+                    comparisons[key] = {
+                        'num_tests': 0,
+                        'num_significant': 0,
+                        'volcano': DensityGrid(
+                            self.LOG2_FC_RANGE, self.NEG_LOG10_P_RANGE),
+                        'volcano_significant': DensityGrid(
+                            self.LOG2_FC_RANGE, self.NEG_LOG10_P_RANGE),
+                        'ma': DensityGrid(
+                            self.LOG2_MEAN_FPKM_RANGE, self.LOG2_FC_RANGE),
+                        'ma_significant': DensityGrid(
+                            self.LOG2_MEAN_FPKM_RANGE, self.LOG2_FC_RANGE),
+                    }
+                comp = comparisons[key]
+                log2_fc = df['log2(fold_change)'].values
+                with np.errstate(divide='ignore'):
+                    neg_log10_p = -np.log10(df['p_value'].values)
+                log2_mean = (
+                    np.log2(df['value_1'].values + 1) +
+                    np.log2(df['value_2'].values + 1)
+                ) / 2
+                significant = df['significant'].values
+                comp['num_tests'] += len(df)
+                comp['num_significant'] += int(significant.sum())
+                comp['volcano'].add(log2_fc, neg_log10_p)
+                comp['ma'].add(log2_mean, log2_fc)
+                comp['volcano_significant'].add(
+                    log2_fc[significant], neg_log10_p[significant])
+                comp['ma_significant'].add(
+                    log2_mean[significant], log2_fc[significant])
+        return comparisons
+
+    @staticmethod
+    def density_series(grid: DensityGrid, significant_grid: DensityGrid):
+        """Convert the grids to scatter series of the bins by density tiers."""
+        x, y, counts = grid.nonzero_bins()
+        tiers = np.floor(np.log10(counts)).astype(int)
+        series = []
+        for tier in np.unique(tiers):
+            in_tier = tiers == tier
+            series.append({
+                'name': '{:,d}+ tests'.format(10 ** int(tier)),
+                'data': np.round(
+                    np.column_stack([x[in_tier], y[in_tier]]), 3
+                ).tolist(),
+                'color': 'rgba(70, 70, 70, {:.2f})'.format(
+                    min(0.15 + 0.2 * tier, 0.95)
+                ),
+            })
+        sig_x, sig_y, _ = significant_grid.nonzero_bins()
+        series.append({
+            'name': 'significant',
+            'data': np.round(np.column_stack([sig_x, sig_y]), 3).tolist(),
+            'color': 'rgba(215, 48, 39, 0.6)',
+        })
+        return series
+
+    def summarize(self, data_info):
+        return {
+            'num_significant': OrderedDict(
+                (diff_type, OrderedDict(
+                    (samples, (comp['num_tests'], comp['num_significant']))
+                    for samples, comp in comparisons.items()
+                ))
+                for diff_type, comparisons in data_info['diff_density'].items()
+            ),
+        }
+
+    def get_context_data(self, data_info):
+        context = super().get_context_data(data_info)
+        diff_plots = []
+        for diff_type, diff_display in self.DIFF_TYPES.items():
+            comparisons = data_info['diff_density'][diff_type]
+            for i, ((sample_1, sample_2), comp) in enumerate(
+                comparisons.items()
+            ):
+                diff_plots.append({
+                    'id': '{}-{}'.format(diff_type, i),
+                    'title': '{}: {} vs {}'.format(
+                        diff_display, sample_1, sample_2
+                    ),
+                    'num_tests': comp['num_tests'],
+                    'num_significant': comp['num_significant'],
+                    'volcano': self.export_data(self.density_series(
+                        comp['volcano'], comp['volcano_significant'])),
+                    'ma': self.export_data(self.density_series(
+                        comp['ma'], comp['ma_significant'])),
+                })
+        context['diff_plots'] = diff_plots
+        context['replicate_plot'] = self.replicate_plot_data(
+            data_info['replicate_stat']
+        )
+        context['DIFF_TYPES'] = self.DIFF_TYPES
+        context['diff_table_index'] = data_info['diff_table_index']
+        return context
+
+    def replicate_plot_data(self, replicate_stat):
+        """Prepare the correlation heatmaps and the PCA scatter series."""
+        replicates = replicate_stat['replicates']
+        plot_data = {}
+        for method in ['pearson', 'spearman']:
+            corr = replicate_stat[method]
+            corr_min = min(float(corr.min()), 0.99)
+            plot_data[method] = {
+                'values': OrderedDict(zip(replicates, corr.tolist())),
+                'heat': OrderedDict(zip(
+                    replicates, ((corr - corr_min) / (1 - corr_min)).tolist()
+                )),
+            }
+
+        scores = np.round(replicate_stat['pca_scores'], 4)
+        if scores.shape[1] < 2:
+            scores = np.hstack([scores, np.zeros((len(replicates), 1))])
+        replicate_ix = {name: i for i, name in enumerate(replicates)}
+        colors = condition_colors(replicate_stat['replicate_groups'], l=0.6)
+        plot_data['pca_series'] = [
+            {
+                'name': condition,
+                'color': colors[condition],
+                'data': [
+                    {
+                        'name': name,
+                        'x': float(scores[replicate_ix[name], 0]),
+                        'y': float(scores[replicate_ix[name], 1]),
+                    }
+                    for name in names
+                ],
+            }
+            for condition, names in replicate_stat['replicate_groups'].items()
+        ]
+        plot_data['pca_explained'] = replicate_stat['pca_explained'].tolist()
+        return plot_data
+
     def collect_raw_output(self, analysis_info: AnalysisInfo):
         """Render the link to the raw output files"""
         raw_output_filenames = [
@@ -50,12 +571,4 @@ class CuffdiffStage(RNASeqStageMixin, BaseStage):
             'var_model.info',
             'run_cuffdiff.log',
         ]
-        actual_output_dir = self._locate_result_folder().name
-        raw_output_links = {
-            filename: '../result/{output_dir}/{filename}'.format(
-                output_dir=actual_output_dir,
-                filename=filename
-            )
-            for filename in raw_output_filenames
-        }
-        return raw_output_links
+        return self.collect_raw_output_links(raw_output_filenames)['']
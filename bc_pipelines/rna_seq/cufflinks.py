@@ -1,21 +1,254 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
 from pathlib import Path
+import tempfile
+import numpy as np
+import pandas as pd
 from bc_report.info import AnalysisInfo
 from bc_report import create_logger
+from bc_report.preflight import ExpectedInput
 from ..base.report import BaseStage
-from . import RNASeqStageMixin
+from . import RNASeqStageMixin, condition_colors
+from .expression import (
+    log_fpkm,
+    blockwise_correlation, blockwise_row_stats, truncated_pca,
+)
 
 logger = create_logger(__name__)
 
 
+def read_tracking_ids(tracking_pth: Path) -> pd.Index:
+    """Read only the unique tracking IDs of a Cufflinks *.fpkm_tracking file.
+
+    IDs appear more than once for genes of several loci.
+    """
+    with tracking_pth.open('rb') as f:
+        return pd.Index(pd.read_csv(
+            f, sep='\t',
+            usecols=['tracking_id'], dtype={'tracking_id': str},
+        )['tracking_id'].unique())
+
+
+def fill_fpkm_column(
+    matrix, row_index: pd.Index, col_ix, tracking_pth: Path, chunksize
+):
+    """Fill one column of the expression matrix by a *.fpkm_tracking file.
+
+    The file is read by chunks of rows and each chunk is placed to the
+    matrix rows by its tracking IDs. The FPKM of the rows of the same ID,
+    one per locus, are summed, so the column must be zero-filled.
+    """
+    with tracking_pth.open('rb') as f:
+        reader = pd.read_csv(
+            f, sep='\t',
+            usecols=['tracking_id', 'FPKM'],
+            dtype={'tracking_id': str, 'FPKM': np.float32},
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            fpkm = chunk.groupby('tracking_id', sort=False)['FPKM'].sum()
+            row_ix = row_index.get_indexer(fpkm.index)
+            matrix[row_ix, col_ix] += fpkm.values
+
+
+def load_expression_matrix(matrix_info):
+    """Open the expression matrix built by CufflinksStage read-only.
+
+    Returns
+    -------
+    Tuple of ``(matrix, tracking_ids)``, where matrix is a memory-mapped
+    float32 array of shape (num tracking IDs, num samples).
+    """
+    matrix = np.load(matrix_info['matrix_path'].as_posix(), mmap_mode='r')
+    with matrix_info['index_path'].open() as f:
+        tracking_ids = f.read().splitlines()
+    return matrix, tracking_ids
+
+
 class CufflinksStage(RNASeqStageMixin, BaseStage):
     template_entrances = ['rna_seq/cufflinks.html']
     result_folder_name = 'cufflinks'
+    input_patterns = ['*/genes.fpkm_tracking', '*/isoforms.fpkm_tracking']
+
+    # Expression matrices to build. Key: matrix name; value: tracking file
+    EXPRESSION_MATRICES = OrderedDict([
+        ('genes', 'genes.fpkm_tracking'),
+        ('isoforms', 'isoforms.fpkm_tracking'),
+    ])
+    MATRIX_IO_WORKERS = 4
+    MATRIX_CHUNKSIZE = 200000
+    # Number of the most variable genes used by PCA
+    PCA_NUM_GENES = 500
+    # Number of the most variable genes listed in the report
+    TOP_VARIABLE_GENES = 20
+
+    def expected_inputs(self, analysis_info: AnalysisInfo):
+        """Tracking files of the expression matrices of each sample."""
+        result_dir = self._locate_result_folder()
+        return [
+            ExpectedInput(result_dir / sample / tracking_filename)
+            for sample in analysis_info.samples
+            for tracking_filename in self.EXPRESSION_MATRICES.values()
+        ]
 
     def parse(self, analysis_info: AnalysisInfo):
         data_info = super().parse(analysis_info)
         data_info['raw_output'] = self.collect_raw_output(analysis_info)
+        data_info['expression'] = OrderedDict()
+        for name, tracking_filename in self.EXPRESSION_MATRICES.items():
+            logger.info('Building {} expression matrix'.format(name))
+            data_info['expression'][name] = self.build_expression_matrix(
+                analysis_info, name, tracking_filename
+            )
+        logger.info('Summarizing gene expression across samples')
+        data_info['expression_summary'] = self.summarize_expression(
+            data_info['expression']['genes']
+        )
         return data_info
 
+    def build_expression_matrix(
+        self, analysis_info: AnalysisInfo, name, tracking_filename
+    ):
+        """Build a memory-mapped tracking ID x sample FPKM matrix.
+
+        The row index is the union of the tracking IDs of all samples. The
+        samples are read in parallel, each of them by chunks of rows. IDs
+        missing in a sample have FPKM 0.
+        """
+        result_dir = self._locate_result_folder()
+        samples = list(analysis_info.samples)
+        tracking_pths = [
+            result_dir / sample / tracking_filename for sample in samples
+        ]
+        with ThreadPoolExecutor(self.MATRIX_IO_WORKERS) as executor:
+            row_index = None
+            for sample_ids in executor.map(read_tracking_ids, tracking_pths):
+                if row_index is None:
+                    row_index = sample_ids
+                else:
+                    row_index = row_index.union(sample_ids, sort=False)
+
+            matrix_dir = self.report.cache_root / 'cufflinks'
+            if not matrix_dir.exists():
+                matrix_dir.mkdir(parents=True)
+            matrix_pth = matrix_dir / '{}.fpkm.npy'.format(name)
+            index_pth = matrix_dir / '{}.tracking_ids.txt'.format(name)
+            # Build under a temporary name, so the matrix another report
+            # of the job has mapped is replaced only when complete
+            tmp_fd, tmp_matrix_pth = tempfile.mkstemp(
+                suffix='.tmp', prefix=matrix_pth.name + '.',
+                dir=matrix_dir.as_posix(),
+            )
+            os.close(tmp_fd)
+            try:
+                matrix = np.lib.format.open_memmap(
+                    tmp_matrix_pth, mode='w+',
+                    dtype=np.float32, shape=(len(row_index), len(samples)),
+                )
+                matrix[:] = 0
+                fill_column = partial(
+                    fill_fpkm_column, matrix, row_index,
+                    chunksize=self.MATRIX_CHUNKSIZE,
+                )
+                list(executor.map(
+                    fill_column, range(len(tracking_pths)), tracking_pths
+                ))
+                matrix.flush()
+                del matrix, fill_column
+            except BaseException:
+                os.unlink(tmp_matrix_pth)
+                raise
+        os.replace(tmp_matrix_pth, matrix_pth.as_posix())
+
+        tmp_index_pth = Path(tmp_matrix_pth).with_suffix('.ids.tmp')
+        with tmp_index_pth.open('w') as f:
+            f.write('\n'.join(row_index))
+            f.write('\n')
+        os.replace(tmp_index_pth.as_posix(), index_pth.as_posix())
+        return {
+            'matrix_path': matrix_pth,
+            'index_path': index_pth,
+            'samples': samples,
+            'num_rows': len(row_index),
+        }
+
+    def summarize_expression(self, matrix_info):
+        """Compute sample correlation, PCA, and the most variable genes."""
+        matrix, tracking_ids = load_expression_matrix(matrix_info)
+        samples = matrix_info['samples']
+        corr = blockwise_correlation(matrix)
+        mean, var = blockwise_row_stats(matrix)
+        top_ix = np.argsort(var)[::-1][:self.PCA_NUM_GENES]
+        top_ix.sort()  # sequential reads on the memory-mapped matrix
+        pca_scores, pca_explained = truncated_pca(log_fpkm(matrix[top_ix]).T)
+        top_ix = top_ix[np.argsort(var[top_ix])[::-1]]
+
+        return {
+            'samples': samples,
+            'correlation': corr,
+            'pca_scores': pca_scores,
+            'pca_explained': pca_explained,
+            'pca_num_genes': len(top_ix),
+            'top_variable_genes': [
+                {
+                    'tracking_id': tracking_ids[ix],
+                    'mean': float(mean[ix]),
+                    'variance': float(var[ix]),
+                    'fpkm': matrix[ix].tolist(),
+                }
+                for ix in top_ix[:self.TOP_VARIABLE_GENES]
+            ],
+        }
+
+    def summarize(self, data_info):
+        # Matrices stay in the cache folder, only their locations are kept
+        return {'expression': data_info['expression']}
+
+    def get_context_data(self, data_info):
+        context = super().get_context_data(data_info)
+        analysis_info = self.report.analysis_info
+        summary = data_info['expression_summary']
+        samples = summary['samples']
+
+        # Correlation heatmap shaded from the lowest correlation to 1
+        corr = summary['correlation']
+        corr_min = min(float(corr.min()), 0.99)
+        context['correlation'] = {
+            'values': OrderedDict(zip(samples, corr.tolist())),
+            'heat': OrderedDict(zip(
+                samples, ((corr - corr_min) / (1 - corr_min)).tolist()
+            )),
+        }
+
+        # PCA scatter series colored by condition
+        scores = np.round(summary['pca_scores'], 4)
+        if scores.shape[1] < 2:
+            scores = np.hstack([scores, np.zeros((len(samples), 1))])
+        sample_ix = {sample: i for i, sample in enumerate(samples)}
+        pca_series = []
+        for condition, color in condition_colors(
+            analysis_info.conditions, l=0.6
+        ).items():
+            pca_series.append({
+                'name': condition,
+                'color': color,
+                'data': [
+                    {
+                        'name': sample,
+                        'x': float(scores[sample_ix[sample], 0]),
+                        'y': float(scores[sample_ix[sample], 1]),
+                    }
+                    for sample in analysis_info.conditions[condition]
+                ],
+            })
+        context['pca'] = {
+            'series': pca_series,
+            'explained': summary['pca_explained'].tolist(),
+        }
+        return context
+
     def collect_raw_output(self, analysis_info: AnalysisInfo):
         """Render the link to the raw output files"""
         raw_output_filenames = [
@@ -25,16 +258,6 @@ class CufflinksStage(RNASeqStageMixin, BaseStage):
             'skipped.gtf',
             'transcripts.gtf',
         ]
-        actual_output_dir = self._locate_result_folder().name
-        raw_output_links = {}
-        for sample in analysis_info.samples:
-            raw_output_links[sample] = {
-                filename: '../result/{output_dir}/{sample}/{filename}'.format(
-                    output_dir=actual_output_dir,
-                    sample=sample,
-                    filename=filename
-                )
-                for filename in raw_output_filenames
-                }
-
-        return raw_output_links
+        return self.collect_raw_output_links(
+            raw_output_filenames, subfolders=list(analysis_info.samples)
+        )
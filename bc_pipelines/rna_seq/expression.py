@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+
+def log_fpkm(fpkm):
+    """Log transform FPKM values by ``log2(FPKM + 1)``."""
+    return np.log2(np.asarray(fpkm, dtype=np.float64) + 1)
+
+
+def blockwise_row_stats(matrix, transform=log_fpkm, block_rows=65536):
+    """Compute the mean and variance of each row of a tall matrix.
+
+    The matrix is read by blocks of rows, so a memory-mapped matrix is never
+    loaded entirely.
+    """
+    num_rows = matrix.shape[0]
+    mean = np.empty(num_rows, dtype=np.float64)
+    var = np.empty(num_rows, dtype=np.float64)
+    for start in range(0, num_rows, block_rows):
+        block = transform(matrix[start:start + block_rows])
+        mean[start:start + block_rows] = block.mean(axis=1)
+        var[start:start + block_rows] = block.var(axis=1)
+    return mean, var
+
+
+def blockwise_correlation(matrix, transform=log_fpkm, block_rows=65536):
+    """Pearson correlation between the columns of a tall matrix.
+
+    Sums and cross products of the columns are accumulated block by block
+    of rows, so a memory-mapped matrix is never loaded entirely.
+    """
+    num_rows, num_cols = matrix.shape
+    col_sum = np.zeros(num_cols, dtype=np.float64)
+    cross = np.zeros((num_cols, num_cols), dtype=np.float64)
+    for start in range(0, num_rows, block_rows):
+        block = transform(matrix[start:start + block_rows])
+        col_sum += block.sum(axis=0)
+        cross += block.T @ block
+    col_mean = col_sum / num_rows
+    cov = cross / num_rows - np.outer(col_mean, col_mean)
+    std = np.sqrt(np.maximum(np.diag(cov), 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.outer(std, std)
+    return np.clip(np.nan_to_num(corr), -1, 1)
+
+
+def spearman_correlation(matrix):
+    """Spearman correlation between the columns of a matrix.
+
+    Each column is ranked (ties get the average rank) and the Pearson
+    correlation of the ranks is returned.
+    """
+    ranks = pd.DataFrame(matrix).rank(axis=0).values
+    return blockwise_correlation(ranks, transform=np.asarray)
+
+
+def truncated_pca(data, n_components=2):
+    """PCA of the rows of the data with only the leading components.
+
+    Rows are observations (samples) and columns are features (genes). The
+    eigendecomposition is done on the small Gram matrix of the rows, which
+    is cheap when there are far fewer samples than genes.
+
+    Returns
+    -------
+    Tuple of ``(scores, explained_variance_ratio)``, where scores are
+    of shape (num_rows, n_components).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    centered = data - data.mean(axis=0)
+    gram = centered @ centered.T
+    eigvals, eigvecs = np.linalg.eigh(gram)
+    # eigh returns the eigenvalues in ascending order
+    order = np.argsort(eigvals)[::-1][:n_components]
+    eigvals = np.maximum(eigvals[order], 0)
+    scores = eigvecs[:, order] * np.sqrt(eigvals)
+    total_var = np.trace(gram)
+    if total_var > 0:
+        explained = eigvals / total_var
+    else:
+        explained = np.zeros_like(eigvals)
+    return scores, explained
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+from bc_report import create_logger
+from bc_report.report import SummaryStage
+from bc_report.utils import tojson
+from . import RNASeqStageMixin
+from .cuffdiff import CuffdiffStage, iter_diff_chunks, jsonable_column
+from .cufflinks import load_expression_matrix
+
+logger = create_logger(__name__)
+
+
+def prefix_key(prefix: str):
+    """File-safe name of a search prefix, hex of its UTF-8 bytes."""
+    return prefix.encode('utf8').hex()
+
+
+class GeneSearchStage(RNASeqStageMixin, SummaryStage):
+    """Emit a static search index of the genes for the report's search box.
+
+    Genes are ordered by their ID and written as JSON shards of fixed size,
+    each gene holding its per-sample FPKM and differential tests. The
+    lowercase gene IDs and short names are grouped by their first
+    characters into prefix files, which point to the shard and row offset
+    of the gene. The browser fetches only the prefix file and the shards of
+    the matched genes.
+    """
+    template_entrances = []
+    depends_on = ['CufflinksStage', 'CuffdiffStage']
+
+    SEARCH_DIR = 'data/search'
+    data_dirs = [SEARCH_DIR]
+    SHARD_SIZE = 1000
+    PREFIX_LENGTH = 2
+
+    def render(self, data_info, report_root):
+        cuffdiff_dir = next(
+            stage for stage in self.report.all_stages
+            if isinstance(stage, CuffdiffStage)
+        )._locate_result_folder()
+
+        with (cuffdiff_dir / 'genes.fpkm_tracking').open('rb') as f:
+            genes = pd.read_csv(
+                f, sep='\t',
+                usecols=['tracking_id', 'gene_short_name', 'locus'],
+                dtype=str,
+            ).sort_values('tracking_id')
+        gene_ids = genes['tracking_id'].tolist()
+        gene_names = jsonable_column(genes['gene_short_name'].values)
+        gene_loci = genes['locus'].tolist()
+
+        logger.info('Collecting per-sample expression for gene search')
+        matrix, tracking_ids = load_expression_matrix(
+            data_info['CufflinksStage']['expression']['genes']
+        )
+        matrix_row_ix = pd.Index(tracking_ids).get_indexer(gene_ids)
+
+        logger.info('Collecting differential tests for gene search')
+        gene_tests = {}
+        for chunk in iter_diff_chunks(cuffdiff_dir / 'gene_exp.diff', columns=[
+            'gene_id', 'sample_1', 'sample_2',
+            'log2(fold_change)', 'p_value', 'q_value', 'significant',
+        ]):
+            for gene_id, *test in zip(*[
+                jsonable_column(chunk[col].values) for col in chunk.columns
+            ]):
+                gene_tests.setdefault(gene_id, []).append(test)
+
+        search_dir = report_root / self.SEARCH_DIR
+        shard_names = []
+        prefixes = {}
+        for shard_start in range(0, len(gene_ids), self.SHARD_SIZE):
+            shard_ix = len(shard_names)
+            shard_slice = slice(shard_start, shard_start + self.SHARD_SIZE)
+            row_ix = matrix_row_ix[shard_slice]
+            fpkm = np.where(
+                (row_ix >= 0)[:, None],
+                matrix[np.maximum(row_ix, 0)].astype(np.float64), np.nan
+            )
+            shard = []
+            for offset, (gene_id, name, locus, gene_fpkm) in enumerate(zip(
+                gene_ids[shard_slice], gene_names[shard_slice],
+                gene_loci[shard_slice], fpkm
+            )):
+                shard.append([
+                    gene_id, name, locus,
+                    jsonable_column(np.round(gene_fpkm, 4)),
+                    gene_tests.get(gene_id, []),
+                ])
+                keys = {gene_id.lower()}
+                if name and name != '-':
+                    keys.update(n.lower() for n in name.split(','))
+                for key in keys:
+                    prefixes.setdefault(key[:self.PREFIX_LENGTH], []).append(
+                        (key, shard_ix, offset)
+                    )
+            shard_name = 'genes-{:05d}.json'.format(shard_ix)
+            self.write_report_file(
+                search_dir, shard_name, tojson(shard, separators=(',', ':'))
+            )
+            shard_names.append(shard_name)
+
+        for prefix, entries in prefixes.items():
+            self.write_report_file(
+                search_dir, 'prefix/{}.json'.format(prefix_key(prefix)),
+                tojson(sorted(entries), separators=(',', ':'))
+            )
+        self.write_report_file(search_dir, 'index.json', tojson({
+            'prefix_length': self.PREFIX_LENGTH,
+            'prefixes': sorted(prefix_key(p) for p in prefixes),
+            'shards': shard_names,
+            'samples': (
+                data_info['CufflinksStage']['expression']['genes']['samples']
+            ),
+            'gene_fields': ['gene_id', 'gene', 'locus', 'fpkm', 'tests'],
+            'test_fields': [
+                'sample_1', 'sample_2',
+                'log2(fold_change)', 'p_value', 'q_value', 'significant',
+            ],
+        }))
@@ -5,10 +5,12 @@ from . import RNASeqStageMixin, here
 from .star import STARStage
 from .cufflinks import CufflinksStage
 from .cuffdiff import CuffdiffStage
+from .gene_search import GeneSearchStage
 
 
 class RNASeqFastQCStage(RNASeqStageMixin, FastQCStage):
     template_entrances = ['rna_seq/fastqc.html']
+    page_template = 'rna_seq/fastqc_page.html'
 
 
 class RNASeqSummaryHomeStage(RNASeqStageMixin, BaseSummaryHomeStage):
@@ -22,6 +24,7 @@ class RNASeqReport(BaseReport):
         STARStage,
         CufflinksStage,
         CuffdiffStage,
+        GeneSearchStage,
     ]
     static_roots = [
         here / 'static',
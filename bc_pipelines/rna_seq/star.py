@@ -1,17 +1,71 @@
 import ast
+from collections import Counter, OrderedDict
 from datetime import datetime
+import gzip
+import os
 from pathlib import Path
+import struct
+import numpy as np
 from seaborn.palettes import husl_palette
 from bc_report.info import AnalysisInfo
 from bc_report import create_logger
+from bc_report.metrics import Metric
+from bc_report.preflight import ExpectedInput
+from bc_report.utils import read_bytes
 from ..base.report import BaseStage
 from . import RNASeqStageMixin
 
 logger = create_logger(__name__)
 
+# The pseudo-bin in BAM index storing the per-reference read counts
+BAI_PSEUDO_BIN = 37450
 
-def parse_star_log(log_str: str):
-    """Parse STAR's Log.final.out format"""
+# Columns of STAR's Log.progress.out after the time stamp
+PROGRESS_LOG_DTYPE = np.dtype([
+    ('time', 'datetime64[s]'),
+    ('speed', 'f4'),                # million reads per hour
+    ('num_read', 'i8'),
+    ('read_length', 'f4'),
+    ('mapped_unique', 'f4'),
+    ('mapped_length', 'f4'),
+    ('mismatch_rate', 'f4'),
+    ('mapped_multi', 'f4'),
+    ('mapped_multi_plus', 'f4'),
+    ('unmapped_mismatch', 'f4'),
+    ('unmapped_short', 'f4'),
+    ('unmapped_other', 'f4'),
+])
+# Bytes at the file beginning to tell if the log has been rewritten
+PROGRESS_LOG_HEAD_SIZE = 256
+
+
+def date_star_time(time_str: str, written: datetime) -> datetime:
+    """Date the time stamp of STAR's logs, which has no year.
+
+    The latest year placing the time not after ``written``, the time the log
+    was last written, is taken. Feb 29 is dated to the last leap year.
+    """
+    for year in range(written.year, written.year - 8, -1):
+        try:
+            time = datetime.strptime(
+                '{} {}'.format(year, time_str), '%Y %b %d %H:%M:%S'
+            )
+        except ValueError:
+            # Feb 29 of a common year
+            continue
+        if time <= written:
+            return time
+    raise ValueError('Cannot date time stamp {!r}'.format(time_str))
+
+
+def parse_star_log(log_str: str, written: datetime = None):
+    """Parse STAR's Log.final.out format
+
+    The time stamps are dated by :py:func:`date_star_time` against
+    ``written``, the modified time of the log, or now if not given.
+    """
+    if written is None:
+        written = datetime.now()
     align_stat = dict(
         tuple(l.strip().split(' |\t', 1))
         for l in log_str.splitlines()
@@ -28,9 +82,7 @@ def parse_star_log(log_str: str):
             'Finished on',
         ]:
             # Convert to datetime
-            align_stat[metric_key] = datetime.strptime(
-                metric_val, '%b %d %H:%M:%S'
-            )
+            align_stat[metric_key] = date_star_time(metric_val, written)
         else:
             # Convert to int or float from str
             #
@@ -56,9 +108,192 @@ def parse_star_log(log_str: str):
     return align_stat
 
 
+def parse_star_progress_log(log_str: str, start: datetime) -> np.ndarray:
+    """Parse the progress records of STAR's Log.progress.out format.
+
+    Header lines and the trailing ``ALL DONE!`` are skipped. Percentages are
+    converted to fractions. The log has no year, so the records are dated
+    from the year of ``start``, the job start or the last record read, and
+    the year is advanced whenever the month wraps around.
+    """
+    records = []
+    year, month = start.year, start.month
+    for line in log_str.splitlines():
+        cols = line.split()
+        if len(cols) != len(PROGRESS_LOG_DTYPE) + 2 or not cols[0].isalpha():
+            continue
+        try:
+            record_month = datetime.strptime(cols[0], '%b').month
+            if record_month < month:
+                year += 1
+            time = datetime.strptime(
+                '{} {}'.format(year, ' '.join(cols[:3])),
+                '%Y %b %d %H:%M:%S'
+            )
+        except ValueError:
+            continue
+        month = record_month
+        values = [
+            float(v[:-1]) / 100 if v.endswith('%') else float(v)
+            for v in cols[3:]
+        ]
+        records.append((time, *values))
+    return np.array(records, dtype=PROGRESS_LOG_DTYPE)
+
+
+def read_star_progress_log(
+    log_pth: Path, cache_pth: Path, start: datetime
+) -> np.ndarray:
+    """Read STAR's Log.progress.out incrementally.
+
+    The parsed records and the read offset are cached in a ``.npz`` file.
+    Next time only the lines appended since the last read are parsed. The
+    log is parsed again from the beginning if it has been truncated or
+    rewritten, which is detected by its size and leading bytes, or if the
+    job start, which dates the records, has changed.
+    """
+    start_stamp = np.datetime64(start, 's')
+    with log_pth.open('rb') as f:
+        head = f.read(PROGRESS_LOG_HEAD_SIZE)
+        records = np.empty(0, dtype=PROGRESS_LOG_DTYPE)
+        offset = 0
+        if cache_pth.exists():
+            with np.load(cache_pth.as_posix()) as cache:
+                cache_valid = (
+                    'start' in cache.files and
+                    cache['start'] == start_stamp and
+                    bytes(cache['head']) == head[:len(cache['head'])] and
+                    int(cache['offset']) <= log_pth.stat().st_size
+                )
+                if cache_valid:
+                    records = cache['records']
+                    offset = int(cache['offset'])
+                else:
+                    logger.debug(
+                        'Progress log {!s} has been rewritten'.format(log_pth)
+                    )
+        f.seek(offset)
+        new_bytes = f.read()
+
+    # Only consume the complete lines; the last one may be still written
+    complete_end = new_bytes.rfind(b'\n') + 1
+    if complete_end:
+        new_records = parse_star_progress_log(
+            new_bytes[:complete_end].decode('utf8'),
+            records['time'][-1].astype(datetime) if len(records) else start
+        )
+        records = np.concatenate([records, new_records])
+        offset += complete_end
+        tmp_pth = cache_pth.with_name(cache_pth.name + '.tmp')
+        with tmp_pth.open('wb') as f:
+            np.savez(
+                f, records=records, offset=np.int64(offset),
+                head=np.frombuffer(head, dtype=np.uint8), start=start_stamp,
+            )
+        os.replace(tmp_pth.as_posix(), cache_pth.as_posix())
+    return records
+
+
+def read_bam_references(bam_pth: Path):
+    """Read the reference names and lengths from the BAM header.
+
+    Only the first few BGZF blocks holding the header are decompressed,
+    the alignment records are never read.
+    """
+    with bam_pth.open('rb') as bam_f, \
+            gzip.GzipFile(fileobj=bam_f, mode='rb') as f:
+        magic, l_text = struct.unpack('<4si', f.read(8))
+        if magic != b'BAM\x01':
+            raise ValueError('{!s} is not a valid BAM file'.format(bam_pth))
+        f.read(l_text)  # SAM header text
+        n_ref, = struct.unpack('<i', f.read(4))
+        references = []
+        for _ in range(n_ref):
+            l_name, = struct.unpack('<i', f.read(4))
+            name = f.read(l_name)[:-1].decode('ascii')  # strip NUL
+            l_ref, = struct.unpack('<i', f.read(4))
+            references.append((name, l_ref))
+    return references
+
+
+def read_bam_index(bam_pth: Path):
+    """Read the BAM references and the raw bytes of its index (.bai)."""
+    return (
+        read_bam_references(bam_pth),
+        read_bytes(bam_pth.with_name(bam_pth.name + '.bai')),
+    )
+
+
+def try_read_bam_index(bam_pth: Path):
+    """:py:func:`read_bam_index`, or ``None`` with a warning if the BAM file
+    or its index is missing or unreadable."""
+    try:
+        return read_bam_index(bam_pth)
+    except (OSError, EOFError, ValueError, struct.error) as e:
+        logger.warning(
+            'Cannot read BAM file {!s} or its index: {}'.format(bam_pth, e)
+        )
+        return None
+
+
+def parse_bam_index(bai_bytes: bytes):
+    """Parse the per-reference read counts from BAM index (.bai).
+
+    Samtools stores the number of mapped and unmapped reads of each
+    reference in the second chunk of its pseudo-bin. All other bins and
+    the linear index are skipped without decoding.
+
+    Returns
+    -------
+    Tuple of ``(mapped, unmapped, n_no_coor)``, where ``mapped`` and
+    ``unmapped`` are int64 arrays of the reference length, and
+    ``n_no_coor`` is the number of unplaced unmapped reads.
+    """
+    if bai_bytes[:4] != b'BAI\x01':
+        raise ValueError('Not a valid BAM index')
+    unpack_from = struct.unpack_from
+    n_ref, = unpack_from('<i', bai_bytes, 4)
+    mapped = np.zeros(n_ref, dtype=np.int64)
+    unmapped = np.zeros(n_ref, dtype=np.int64)
+    offset = 8
+    for ref_ix in range(n_ref):
+        n_bin, = unpack_from('<i', bai_bytes, offset)
+        offset += 4
+        for _ in range(n_bin):
+            bin_id, n_chunk = unpack_from('<Ii', bai_bytes, offset)
+            offset += 8
+            if bin_id == BAI_PSEUDO_BIN:
+                # chunks: (unmapped_beg, unmapped_end), (n_mapped, n_unmapped)
+                mapped[ref_ix], unmapped[ref_ix] = unpack_from(
+                    '<QQ', bai_bytes, offset + 16
+                )
+            offset += 16 * n_chunk
+        n_intv, = unpack_from('<i', bai_bytes, offset)
+        offset += 4 + 8 * n_intv
+    # Optional trailing count of reads without coordinate
+    if len(bai_bytes) >= offset + 8:
+        n_no_coor, = unpack_from('<Q', bai_bytes, offset)
+    else:
+        n_no_coor = 0
+    return mapped, unmapped, n_no_coor
+
+
+def robust_zscore(values):
+    """Compute the median/MAD based z-score of the given values."""
+    values = np.asarray(values, dtype=np.float64)
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * 1.4826
+    if mad == 0:
+        return np.zeros_like(values)
+    return (values - median) / mad
+
+
 class STARStage(RNASeqStageMixin, BaseStage):
     template_entrances = ['rna_seq/star.html']
     result_folder_name = 'STAR'
+    input_patterns = [
+        '*/Log.final.out', '*/Log.progress.out', '*/*.bam', '*/*.bam.bai',
+    ]
 
     NUM_READ_METRICS = [
         'Number of input reads',
@@ -81,21 +316,228 @@ class STARStage(RNASeqStageMixin, BaseStage):
         '% of chimeric reads',
     ]
 
+    # Reference names of mitochondria and chromosome Y across genome builds
+    CHROM_M_NAMES = ['chrM', 'chrMT', 'MT', 'M']
+    CHROM_Y_NAMES = ['chrY', 'Y']
+    # References of lower cohort-mean fraction are merged into "others"
+    MIN_CHROM_FRACTION = 0.001
+    # Samples whose chrM or chrY fraction exceed the robust z-score are flagged
+    CHROM_FRACTION_OUTLIER_Z = 3.5
+
+    # Files of each sample read by parse, besides the optional progress log
+    # and BAM files
+    SAMPLE_INPUTS = ['Log.final.out']
+
+    def expected_inputs(self, analysis_info: AnalysisInfo):
+        result_dir = self._locate_result_folder()
+        return [
+            ExpectedInput(result_dir.joinpath(sample, filename))
+            for sample in analysis_info.samples
+            for filename in self.SAMPLE_INPUTS
+        ]
+
     def parse(self, analysis_info: AnalysisInfo):
         data_info = super().parse(analysis_info)
 
         logger.info('Parsing STAR alignment statistics from log file')
         align_stat = {}
         result_dir = self._locate_result_folder()
-        for sample in analysis_info.samples:
-            with result_dir.joinpath(sample, 'Log.final.out').open() as f:
-                align_stat[sample] = parse_star_log(f.read())
+        log_pths = [
+            result_dir.joinpath(sample, 'Log.final.out')
+            for sample in analysis_info.samples
+        ]
+        for sample, (log_pth, log_bytes) in zip(
+            analysis_info.samples, self.prefetch(log_pths, read_bytes)
+        ):
+            align_stat[sample] = parse_star_log(
+                log_bytes.decode('utf8'),
+                datetime.fromtimestamp(log_pth.stat().st_mtime),
+            )
         data_info['align_stat'] = align_stat
 
+        logger.info('Parsing STAR alignment progress from log file')
+        data_info['progress'] = self.parse_progress(analysis_info, align_stat)
+
+        logger.info('Reading per-chromosome read counts from BAM indices')
+        data_info['chrom_stat'] = self.parse_chrom_stat(analysis_info)
+
         logger.info('Generating raw output file links')
         data_info['raw_output'] = self.collect_raw_output(analysis_info)
         return data_info
 
+    def parse_progress(self, analysis_info: AnalysisInfo, align_stat):
+        """Read the alignment progress records of all samples.
+
+        The records are dated from the job start in the sample's alignment
+        statistics. Samples without Log.progress.out are left out of the
+        progress charts.
+        """
+        result_dir = self._locate_result_folder()
+        cache_dir = self.report.cache_root / 'star_progress'
+        if not cache_dir.exists():
+            cache_dir.mkdir(parents=True)
+        progress = {}
+        for sample in analysis_info.samples:
+            log_pth = result_dir.joinpath(sample, 'Log.progress.out')
+            try:
+                progress[sample] = read_star_progress_log(
+                    log_pth, cache_dir / '{}.npz'.format(sample),
+                    align_stat[sample]['Started job on'],
+                )
+            except FileNotFoundError:
+                logger.warning(
+                    'Progress log {!s} is missing, skip sample {} in the '
+                    'progress charts'.format(log_pth, sample)
+                )
+        return progress
+
+    def parse_chrom_stat(self, analysis_info: AnalysisInfo):
+        """Collect the per-chromosome mapped reads of all samples.
+
+        Samples whose BAM file or index cannot be read, or which are aligned
+        to other references than most samples, are skipped with a warning.
+        """
+        sample_indices = self.read_bam_indices(analysis_info)
+        if not sample_indices:
+            return None
+        references, samples = self.majority_references(sample_indices)
+        mapped = np.vstack([sample_indices[sample][1] for sample in samples])
+        fractions = mapped / np.maximum(mapped.sum(axis=1, keepdims=True), 1)
+
+        # Keep the major references, chrM and chrY, and merge the rest
+        major = (
+            (fractions.mean(axis=0) >= self.MIN_CHROM_FRACTION) |
+            np.isin(references, self.CHROM_M_NAMES + self.CHROM_Y_NAMES)
+        )
+        major_refs = [ref for ref, keep in zip(references, major) if keep]
+        major_fractions = fractions[:, major]
+        if not major.all():
+            major_refs.append('others')
+            major_fractions = np.hstack([
+                major_fractions,
+                fractions[:, ~major].sum(axis=1, keepdims=True),
+            ])
+
+        # Scale each column separately so the small references are visible
+        col_max = np.maximum(major_fractions.max(axis=0), 1e-12)
+        return {
+            'references': major_refs,
+            'num_mapped': {
+                sample: int(total) for sample, total in
+                zip(samples, mapped.sum(axis=1))
+            },
+            'fractions': {
+                sample: row.tolist() for sample, row in
+                zip(samples, major_fractions)
+            },
+            'heat': {
+                sample: row.tolist() for sample, row in
+                zip(samples, major_fractions / col_max)
+            },
+            'flags': self.flag_chrom_outliers(samples, references, fractions),
+        }
+
+    def read_bam_indices(self, analysis_info: AnalysisInfo):
+        """Read the references and per-reference mapped reads of the samples.
+
+        Returns
+        -------
+        OrderedDict of sample to the tuple of its reference names and mapped
+        read counts. Samples of unreadable or inconsistent BAM files and
+        indices are left out with a warning.
+        """
+        result_dir = self._locate_result_folder()
+        sample_indices = OrderedDict()
+        bam_pths = [
+            result_dir.joinpath(sample, 'Aligned.sortedByCoord.out.bam')
+            for sample in analysis_info.samples
+        ]
+        for sample, (bam_pth, bam_index) in zip(
+            analysis_info.samples, self.prefetch(bam_pths, try_read_bam_index)
+        ):
+            if bam_index is None:
+                continue
+            bam_refs, bai_bytes = bam_index
+            try:
+                mapped, _, _ = parse_bam_index(bai_bytes)
+            except (ValueError, struct.error) as e:
+                logger.warning(
+                    'Cannot parse the index of BAM file {!s}: {}'
+                    .format(bam_pth, e)
+                )
+                continue
+            if len(mapped) != len(bam_refs):
+                logger.warning(
+                    'Index of BAM file {!s} does not match its references'
+                    .format(bam_pth)
+                )
+                continue
+            sample_indices[sample] = (
+                tuple(name for name, _ in bam_refs), mapped
+            )
+        return sample_indices
+
+    @staticmethod
+    def majority_references(sample_indices):
+        """The reference names most samples are aligned to, and the samples.
+
+        Samples aligned to other references are left out with a warning.
+        """
+        references = Counter(
+            refs for refs, _ in sample_indices.values()
+        ).most_common(1)[0][0]
+        samples = []
+        for sample, (refs, _) in sample_indices.items():
+            if refs == references:
+                samples.append(sample)
+            else:
+                logger.warning(
+                    'Sample {} is aligned to different references, skip it '
+                    'in the per-chromosome reads'.format(sample)
+                )
+        return list(references), samples
+
+    def flag_chrom_outliers(self, samples, references, fractions):
+        """Flag the samples of unusual chrM or chrY fractions.
+
+        Returns
+        -------
+        Dict of the flagged samples to their list of flags.
+        """
+        flags = {sample: [] for sample in samples}
+        for chrom_label, chrom_names in [
+            ('chrM', self.CHROM_M_NAMES),
+            ('chrY', self.CHROM_Y_NAMES),
+        ]:
+            ref_ix = [
+                i for i, ref in enumerate(references) if ref in chrom_names
+            ]
+            if not ref_ix:
+                continue
+            chrom_fraction = fractions[:, ref_ix].sum(axis=1)
+            zscores = robust_zscore(chrom_fraction)
+            for sample, frac, z in zip(samples, chrom_fraction, zscores):
+                if abs(z) > self.CHROM_FRACTION_OUTLIER_Z:
+                    flags[sample].append({
+                        'chrom': chrom_label,
+                        'fraction': float(frac),
+                        'zscore': float(z),
+                    })
+        return {
+            sample: sample_flags
+            for sample, sample_flags in flags.items() if sample_flags
+        }
+
+    def summarize(self, data_info):
+        return {'align_stat': data_info['align_stat']}
+
+    def metrics(self, data_info):
+        """Numeric alignment statistics of Log.final.out."""
+        for sample, align_stat in data_info['align_stat'].items():
+            for name, value in align_stat.items():
+                if isinstance(value, (int, float)):
+                    yield Metric(sample, name, float(value), None)
+
     def get_context_data(self, data_info):
         context = super().get_context_data(data_info)
         context['NUM_READ_METRICS'] = self.NUM_READ_METRICS
@@ -120,22 +562,23 @@ class STARStage(RNASeqStageMixin, BaseStage):
         ):
             plot_num_read_data.append({
                 'name': metric_display,
-                'data': [
+                'data': np.array([
                     data_info['align_stat'][sample][metric]
                     for sample in analysis_info.samples
-                ],
+                ]),
             })
 
         # Compute the color for condition plot bands
+        index = analysis_info.index
         condition_bands = []
-        condition_counter = 0
-        for (condition, samples), color in zip(
-            analysis_info.conditions.items(),
-            husl_palette(len(analysis_info.conditions), l=0.8, s=0.6),
-        ):
+        for condition_id, (condition, color) in enumerate(zip(
+            index.condition_names,
+            husl_palette(len(index.condition_names), l=0.8, s=0.6),
+        )):
+            samples = index.samples_of(condition_id)
             condition_bands.append({
-                'from': condition_counter - 0.5,
-                'to': condition_counter + len(samples) - 0.5,
+                'from': samples.start - 0.5,
+                'to': samples.stop - 0.5,
                 'color': 'rgba({:d}, {:d}, {:d}, 0.4)'.format(
                     *[int(c * 255) for c in color]
                 ),
@@ -145,12 +588,36 @@ class STARStage(RNASeqStageMixin, BaseStage):
                     'x': -5,
                 }
             })
-            condition_counter += len(samples)
+
+        # Alignment speed and mapping rate over the elapsed hours
+        plot_speed_data, plot_mapping_rate_data = [], []
+        for sample, records in data_info['progress'].items():
+            if not len(records):
+                continue
+            elapsed_hours = np.round(
+                (records['time'] - records['time'][0]) /
+                np.timedelta64(1, 'h'),
+                3
+            )
+            plot_speed_data.append({
+                'name': sample,
+                'data': np.column_stack([
+                    elapsed_hours, np.round(records['speed'], 2)
+                ]),
+            })
+            plot_mapping_rate_data.append({
+                'name': sample,
+                'data': np.column_stack([
+                    elapsed_hours, np.round(records['mapped_unique'] * 100, 2)
+                ]),
+            })
 
         context['plot'] = {
             'condition_bands': condition_bands,
             'data': {
                 'num_read': plot_num_read_data,
+                'progress_speed': plot_speed_data,
+                'progress_mapping_rate': plot_mapping_rate_data,
             }
         }
         return context
@@ -165,16 +632,6 @@ class STARStage(RNASeqStageMixin, BaseStage):
             'Log.progress.out',
             'SJ.out.tab',   # high confidence collapsed splice junction
         ]
-        actual_output_dir = self._locate_result_folder().name
-        raw_output_links = {}
-        for sample in analysis_info.samples:
-            raw_output_links[sample] = {
-                filename: '../result/{output_dir}/{sample}/{filename}'.format(
-                    output_dir=actual_output_dir,
-                    sample=sample,
-                    filename=filename
-                )
-                for filename in raw_output_filenames
-            }
-
-        return raw_output_links
+        return self.collect_raw_output_links(
+            raw_output_filenames, subfolders=list(analysis_info.samples)
+        )
@@ -0,0 +1,172 @@
+/* Page through the sharded Cuffdiff differential test tables.
+ *
+ * Each .diff-table element points to its index.json by the data-index
+ * attribute. Only the shard of the current page is fetched, so the browser
+ * never parses the whole table. Sorting and filtering apply to the rows of
+ * the current page, which are already ranked by q-value and |log2FC|.
+ */
+$(function () {
+    var NUMERIC_COLUMNS = [
+        'value_1', 'value_2', 'log2(fold_change)', 'p_value', 'q_value'
+    ];
+
+    function toNumber(val) {
+        return val === null ? NaN : Number(val);
+    }
+
+    function formatCell(col, val) {
+        if (val === null) {
+            return 'NA';
+        }
+        if (col === 'significant') {
+            return val ? 'yes' : 'no';
+        }
+        if (NUMERIC_COLUMNS.indexOf(col) >= 0) {
+            var num = toNumber(val);
+            if (!isFinite(num)) {
+                return String(num);
+            }
+            return (col === 'p_value' || col === 'q_value') ?
+                num.toExponential(2) : num.toFixed(3);
+        }
+        return String(val);
+    }
+
+    function DiffTable($el) {
+        this.$el = $el;
+        this.indexUrl = $el.data('index');
+        this.baseUrl = this.indexUrl.replace(/[^\/]*$/, '');
+        this.shards = {};
+        this.page = 0;
+        this.sortCol = null;
+        this.sortAsc = true;
+        this.filterText = '';
+        this.significantOnly = false;
+        this.build();
+        $.getJSON(this.indexUrl, $.proxy(function (index) {
+            this.index = index;
+            this.renderHead();
+            this.loadPage(0);
+        }, this));
+    }
+
+    DiffTable.prototype.build = function () {
+        var self = this;
+        this.$controls = $(
+            '<div class="form-inline">' +
+            '<input type="text" class="form-control input-sm diff-table-filter" placeholder="Filter gene or test ID"> ' +
+            '<label class="checkbox-inline"><input type="checkbox" class="diff-table-significant"> significant only</label> ' +
+            '<button class="btn btn-default btn-sm diff-table-prev">&laquo; Prev</button> ' +
+            '<span class="diff-table-page"></span> ' +
+            '<button class="btn btn-default btn-sm diff-table-next">Next &raquo;</button>' +
+            '</div>'
+        );
+        this.$table = $(
+            '<table class="table table-condensed table-striped">' +
+            '<thead></thead><tbody></tbody></table>'
+        );
+        this.$el.append(this.$controls, $('<div class="table-responsive">').append(this.$table));
+        $('.diff-table-filter', this.$controls).on('input', function () {
+            self.filterText = $(this).val().toLowerCase();
+            self.renderBody();
+        });
+        $('.diff-table-significant', this.$controls).on('change', function () {
+            self.significantOnly = $(this).is(':checked');
+            self.renderBody();
+        });
+        $('.diff-table-prev', this.$controls).click(function () {
+            self.loadPage(self.page - 1);
+        });
+        $('.diff-table-next', this.$controls).click(function () {
+            self.loadPage(self.page + 1);
+        });
+    };
+
+    DiffTable.prototype.renderHead = function () {
+        var self = this;
+        var $tr = $('<tr>');
+        $.each(this.index.columns, function (i, col) {
+            $('<th>').text(col).css('cursor', 'pointer').click(function () {
+                self.sortAsc = self.sortCol === i ? !self.sortAsc : true;
+                self.sortCol = i;
+                self.renderBody();
+            }).appendTo($tr);
+        });
+        $('thead', this.$table).empty().append($tr);
+    };
+
+    DiffTable.prototype.loadPage = function (page) {
+        var numPages = this.index.shards.length;
+        if (page < 0 || page >= numPages) {
+            return;
+        }
+        this.page = page;
+        $('.diff-table-page', this.$controls).text(
+            'Page ' + (page + 1) + ' of ' + numPages +
+            ' (' + this.index.num_rows + ' tests)'
+        );
+        if (this.shards[page]) {
+            this.renderBody();
+            return;
+        }
+        $.getJSON(this.baseUrl + this.index.shards[page], $.proxy(function (rows) {
+            this.shards[page] = rows;
+            if (this.page === page) {
+                this.renderBody();
+            }
+        }, this));
+    };
+
+    DiffTable.prototype.renderBody = function () {
+        var self = this;
+        var columns = this.index.columns;
+        var testCol = columns.indexOf('test_id');
+        var geneCol = columns.indexOf('gene');
+        var sigCol = columns.indexOf('significant');
+        var rows = $.grep(this.shards[this.page] || [], function (row) {
+            if (self.significantOnly && !row[sigCol]) {
+                return false;
+            }
+            if (!self.filterText) {
+                return true;
+            }
+            return (
+                String(row[testCol]).toLowerCase().indexOf(self.filterText) >= 0 ||
+                String(row[geneCol]).toLowerCase().indexOf(self.filterText) >= 0
+            );
+        });
+        if (this.sortCol !== null) {
+            var col = this.sortCol;
+            var numeric = NUMERIC_COLUMNS.indexOf(columns[col]) >= 0;
+            var sign = this.sortAsc ? 1 : -1;
+            rows.sort(function (a, b) {
+                var x = numeric ? toNumber(a[col]) : String(a[col]);
+                var y = numeric ? toNumber(b[col]) : String(b[col]);
+                if (x === y || (x !== x && y !== y)) {
+                    return 0;
+                }
+                // NaN always goes last
+                if (x !== x) {
+                    return 1;
+                }
+                if (y !== y) {
+                    return -1;
+                }
+                return x < y ? -sign : sign;
+            });
+        }
+        var html = [];
+        $.each(rows, function (i, row) {
+            html.push('<tr>');
+            $.each(columns, function (j, colName) {
+                html.push($('<td>').text(formatCell(colName, row[j]))[0].outerHTML);
+            });
+            html.push('</tr>');
+        });
+        $('tbody', this.$table).html(html.join(''));
+    };
+
+    $('.diff-table').each(function () {
+        new DiffTable($(this));
+    });
+});
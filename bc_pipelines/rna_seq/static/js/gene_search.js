@@ -0,0 +1,155 @@
+/* Search genes through the static index emitted with the report.
+ *
+ * The index (data/search/index.json) lists the prefix files and the gene
+ * shards. Typing fetches the prefix file of the query's first characters,
+ * matches the gene IDs and names starting with the query, and then fetches
+ * only the shards holding the matched genes. Everything fetched is cached,
+ * failed requests are retried by the next query.
+ *
+ * Written without jQuery since the nav is rendered before it is loaded.
+ */
+document.addEventListener('DOMContentLoaded', function () {
+    var MAX_RESULTS = 10;
+    var container = document.querySelector('.gene-search');
+    if (!container) {
+        return;
+    }
+    var input = container.querySelector('input');
+    var results = container.querySelector('.gene-search-results');
+    var baseUrl = container.getAttribute('data-index').replace(/[^\/]*$/, '');
+    var cache = {};
+    var index = null;
+
+    function fetchJSON(url) {
+        if (!cache[url]) {
+            cache[url] = new Promise(function (resolve, reject) {
+                var xhr = new XMLHttpRequest();
+                xhr.open('GET', url);
+                xhr.onload = function () {
+                    if (xhr.status >= 200 && xhr.status < 300 || xhr.status === 0) {
+                        try {
+                            resolve(JSON.parse(xhr.responseText));
+                            return;
+                        } catch (e) {}
+                    }
+                    delete cache[url];
+                    reject(new Error('Cannot load ' + url));
+                };
+                xhr.onerror = function () {
+                    delete cache[url];
+                    reject(new Error('Cannot load ' + url));
+                };
+                xhr.send();
+            });
+        }
+        return cache[url];
+    }
+
+    function showMessage(text, cls) {
+        results.innerHTML = '<p class="' + cls + '">' + escapeHtml(text) + '</p>';
+    }
+
+    function hexKey(prefix) {
+        var bytes = unescape(encodeURIComponent(prefix));
+        var hex = '';
+        for (var i = 0; i < bytes.length; i++) {
+            hex += ('0' + bytes.charCodeAt(i).toString(16)).slice(-2);
+        }
+        return hex;
+    }
+
+    function formatNumber(val, digits) {
+        if (val === null) {
+            return 'NA';
+        }
+        var num = Number(val);
+        return isFinite(num) ? num.toPrecision(digits) : String(num);
+    }
+
+    function escapeHtml(text) {
+        var div = document.createElement('div');
+        div.textContent = text === null ? '' : String(text);
+        return div.innerHTML;
+    }
+
+    function renderGene(gene) {
+        var html = [
+            '<div class="gene-search-result">',
+            '<strong>' + escapeHtml(gene[0]) + '</strong> ',
+            escapeHtml(gene[1] || ''), '<br><small>', escapeHtml(gene[2]), '</small>',
+            '<table class="table table-condensed"><tbody>'
+        ];
+        index.samples.forEach(function (sample, i) {
+            html.push(
+                '<tr><td>' + escapeHtml(sample) + '</td><td>' +
+                formatNumber(gene[3][i], 3) + ' FPKM</td></tr>'
+            );
+        });
+        gene[4].forEach(function (test) {
+            html.push(
+                '<tr' + (test[5] ? ' class="danger"' : '') + '><td>' +
+                escapeHtml(test[0]) + ' vs ' + escapeHtml(test[1]) + '</td><td>' +
+                'log2FC ' + formatNumber(test[2], 3) +
+                ', q ' + formatNumber(test[4], 2) + '</td></tr>'
+            );
+        });
+        html.push('</tbody></table></div>');
+        return html.join('');
+    }
+
+    function search(query) {
+        query = query.trim().toLowerCase();
+        if (!query) {
+            results.innerHTML = '';
+            return;
+        }
+        // Shorter queries only match the genes named that short
+        var notFound = query.length < index.prefix_length ?
+            'Type at least ' + index.prefix_length + ' characters' :
+            'No gene found';
+        var prefix = hexKey(query.slice(0, index.prefix_length));
+        if (index.prefixes.indexOf(prefix) < 0) {
+            showMessage(notFound, 'text-muted');
+            return;
+        }
+        fetchJSON(baseUrl + 'prefix/' + prefix + '.json').then(function (entries) {
+            var matched = [];
+            var seen = {};
+            for (var i = 0; i < entries.length && matched.length < MAX_RESULTS; i++) {
+                var loc = entries[i][1] + ':' + entries[i][2];
+                if (entries[i][0].indexOf(query) === 0 && !seen[loc]) {
+                    seen[loc] = true;
+                    matched.push(entries[i]);
+                }
+            }
+            return Promise.all(matched.map(function (entry) {
+                return fetchJSON(baseUrl + index.shards[entry[1]]).then(function (shard) {
+                    return shard[entry[2]];
+                });
+            }));
+        }).then(function (genes) {
+            if (input.value.trim().toLowerCase() !== query) {
+                return;  // a newer query is running
+            }
+            if (genes.length) {
+                results.innerHTML = genes.map(renderGene).join('');
+            } else {
+                showMessage(notFound, 'text-muted');
+            }
+        }).catch(function (error) {
+            if (input.value.trim().toLowerCase() === query) {
+                showMessage('Gene search failed: ' + error.message, 'text-danger');
+            }
+        });
+    }
+
+    fetchJSON(baseUrl + 'index.json').then(function (data) {
+        index = data;
+        input.addEventListener('input', function () {
+            search(input.value);
+        });
+    }).catch(function (error) {
+        input.disabled = true;
+        showMessage('Gene search is unavailable: ' + error.message, 'text-danger');
+    });
+});
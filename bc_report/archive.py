@@ -0,0 +1,440 @@
+"""Read job results in place from tar and zip archives.
+
+:py:func:`open_result_root` turns a job folder or a job archive into the
+result root the report reads from. Members of an uncompressed tar or a zip
+archive are read in place through :py:class:`ArchivePath`, which provides
+the subset of the :py:class:`pathlib.Path` interface the stages use.
+Compressed tar archives cannot be read randomly, so they are extracted once
+to a local folder under the cache.
+"""
+from collections import namedtuple
+import fnmatch
+import io
+import os
+from pathlib import Path, PurePosixPath
+import pickle
+import posixpath
+import shutil
+import stat as stat_mod
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from . import create_logger
+from .utils import get_cache_dir, path_digest
+
+logger = create_logger(__name__)
+
+# Archives of these suffixes are read in place
+INDEXED_ARCHIVE_SUFFIXES = ['.tar', '.zip']
+# Archives of these suffixes are extracted to the cache first
+EXTRACTED_ARCHIVE_SUFFIXES = ['.tar.gz', '.tgz', '.tar.bz2', '.tar.xz']
+
+Member = namedtuple('Member', ['offset', 'size', 'mtime', 'compressed'])
+"""Archive member at the data ``offset`` of the archive file, of ``size``
+bytes. Compressed zip members have offset ``None``."""
+
+MemberStat = namedtuple(
+    'MemberStat', ['st_mode', 'st_size', 'st_mtime', 'st_mtime_ns']
+)
+
+
+class FileSection(io.RawIOBase):
+    """Seekable read-only file of a byte range in another file."""
+
+    def __init__(self, pth, offset, size):
+        super().__init__()
+        self._f = open(str(pth), 'rb')
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(pos, 0)
+        return self._pos
+
+    def readinto(self, b):
+        n = max(min(len(b), self._size - self._pos), 0)
+        if n == 0:
+            return 0
+        self._f.seek(self._offset + self._pos)
+        data = self._f.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+class ArchiveIndex:
+    """Member table of a tar or zip archive.
+
+    The table of a tar archive is built by one pass over the member headers
+    and cached by the archive's modified time and size, so later runs open
+    members without scanning the archive again.
+    """
+
+    def __init__(self, archive_pth: Path):
+        self.archive_pth = archive_pth
+        self.is_zip = archive_pth.suffix == '.zip'
+        self._zip_local = threading.local()
+        archive_stat = archive_pth.stat()
+        self.mtime = archive_stat.st_mtime
+        self.members = self.load_members(
+            (archive_stat.st_mtime_ns, archive_stat.st_size)
+        )
+        self.children = {'': set()}
+        for name in self.members:
+            parts = name.split('/')
+            for i in range(len(parts)):
+                parent = '/'.join(parts[:i])
+                self.children.setdefault(parent, set()).add(parts[i])
+                self.children.setdefault('/'.join(parts[:i + 1]), set())
+        # Files have no children
+        for name in self.members:
+            if not self.children[name]:
+                del self.children[name]
+
+    def load_members(self, cache_key):
+        cache_pth = get_cache_dir(
+            'archives', path_digest(self.archive_pth)
+        ) / 'members.pickle'
+        try:
+            with cache_pth.open('rb') as f:
+                cached_key, members = pickle.load(f)
+            if cached_key == cache_key:
+                return members
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Truncated, corrupted, or written by an incompatible version
+            logger.warning(
+                'Cannot read archive index cache {:s}, index the archive '
+                'again: {!r}'.format(cache_pth.as_posix(), e)
+            )
+        logger.info('Indexing members of {!s}'.format(self.archive_pth))
+        if self.is_zip:
+            members = self.read_zip_members()
+        else:
+            members = self.read_tar_members()
+
+        # Write aside and replace, so readers never see a partial index
+        tmp_pth = None
+        try:
+            tmp_fd, tmp_pth = tempfile.mkstemp(
+                suffix='.tmp', prefix=cache_pth.name + '.',
+                dir=cache_pth.parent.as_posix(),
+            )
+            with os.fdopen(tmp_fd, 'wb') as f:
+                pickle.dump((cache_key, members), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_pth, cache_pth.as_posix())
+        except OSError as e:
+            logger.warning(
+                'Cannot write archive index cache {:s}: {!r}'
+                .format(cache_pth.as_posix(), e)
+            )
+            if tmp_pth is not None and os.path.exists(tmp_pth):
+                os.unlink(tmp_pth)
+        return members
+
+    def read_tar_members(self):
+        members = {}
+        with tarfile.open(str(self.archive_pth), 'r:') as tar:
+            for info in tar:
+                if info.isfile():
+                    members[posixpath.normpath(info.name)] = Member(
+                        info.offset_data, info.size, info.mtime, False
+                    )
+        return members
+
+    def read_zip_members(self):
+        members = {}
+        with zipfile.ZipFile(str(self.archive_pth)) as zipf, \
+                self.archive_pth.open('rb') as f:
+            for info in zipf.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                offset = None
+                if info.compress_type == zipfile.ZIP_STORED:
+                    # Data follows the local header of variable length
+                    f.seek(info.header_offset + 26)
+                    name_len, extra_len = struct.unpack('<HH', f.read(4))
+                    offset = info.header_offset + 30 + name_len + extra_len
+                members[posixpath.normpath(info.filename)] = Member(
+                    offset, info.file_size,
+                    zipfile_mtime(info), offset is None
+                )
+        return members
+
+    def open(self, name):
+        """Open the member as a seekable binary file."""
+        member = self.members[name]
+        if not member.compressed:
+            return io.BufferedReader(
+                FileSection(self.archive_pth, member.offset, member.size)
+            )
+        # ZipFile objects are not shared across threads
+        zipf = getattr(self._zip_local, 'zipf', None)
+        if zipf is None:
+            zipf = self._zip_local.zipf = zipfile.ZipFile(
+                str(self.archive_pth)
+            )
+        member_f = zipf.open(name)
+        if member_f.seekable():
+            return member_f
+        with member_f:
+            return io.BytesIO(member_f.read())
+
+
+def zipfile_mtime(info):
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+class ArchivePath:
+    """Path of a member or a folder inside an archive.
+
+    Supports the :py:class:`pathlib.Path` methods the stages use to locate
+    and read result files, such as ``/``, ``iterdir``, ``glob``, ``stat``,
+    and ``open``.
+    """
+
+    __slots__ = ['index', 'parts']
+
+    def __init__(self, index: ArchiveIndex, parts=()):
+        self.index = index
+        self.parts = tuple(parts)
+
+    @property
+    def member_name(self):
+        return '/'.join(self.parts)
+
+    def __truediv__(self, other):
+        if isinstance(other, ArchivePath):
+            return other
+        if isinstance(other, Path) and other.is_absolute():
+            return other
+        parts = list(self.parts)
+        for part in PurePosixPath(str(other)).parts:
+            if part == '..':
+                parts = parts[:-1]
+            elif part != '.':
+                parts.append(part)
+        return ArchivePath(self.index, parts)
+
+    def joinpath(self, *others):
+        pth = self
+        for other in others:
+            pth = pth / other
+        return pth
+
+    @property
+    def name(self):
+        return self.parts[-1] if self.parts else ''
+
+    @property
+    def suffix(self):
+        return PurePosixPath(self.name).suffix
+
+    @property
+    def stem(self):
+        return PurePosixPath(self.name).stem
+
+    @property
+    def parent(self):
+        return ArchivePath(self.index, self.parts[:-1])
+
+    def with_name(self, name):
+        return ArchivePath(self.index, self.parts[:-1] + (name,))
+
+    def relative_to(self, other):
+        if other.parts != self.parts[:len(other.parts)]:
+            raise ValueError('{} is not under {}'.format(self, other))
+        return PurePosixPath(*self.parts[len(other.parts):])
+
+    def as_posix(self):
+        return posixpath.join(
+            self.index.archive_pth.as_posix(), self.member_name
+        )
+
+    def resolve(self):
+        return self
+
+    def __str__(self):
+        return self.as_posix()
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.as_posix())
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ArchivePath) and
+            self.index is other.index and self.parts == other.parts
+        )
+
+    def __lt__(self, other):
+        return self.parts < other.parts
+
+    def __hash__(self):
+        return hash((id(self.index), self.parts))
+
+    def exists(self):
+        return self.is_file() or self.is_dir()
+
+    def is_file(self):
+        return self.member_name in self.index.members
+
+    def is_dir(self):
+        return self.member_name in self.index.children
+
+    def iterdir(self):
+        if not self.is_dir():
+            raise FileNotFoundError(self.as_posix())
+        for child in sorted(self.index.children[self.member_name]):
+            yield self / child
+
+    def glob(self, pattern):
+        """Glob the members, where ``**`` matches any folder depth."""
+        matched = {self}
+        for part in PurePosixPath(pattern).parts:
+            found = set()
+            for pth in matched:
+                if not pth.is_dir():
+                    continue
+                if part == '**':
+                    found.update(pth._walk_dirs())
+                else:
+                    found.update(
+                        pth / name
+                        for name in self.index.children[pth.member_name]
+                        if fnmatch.fnmatchcase(name, part)
+                    )
+            matched = found
+        yield from sorted(matched)
+
+    def _walk_dirs(self):
+        yield self
+        for child in self.iterdir():
+            if child.is_dir():
+                yield from child._walk_dirs()
+
+    def stat(self):
+        member = self.index.members.get(self.member_name)
+        if member is None:
+            if self.is_dir():
+                return MemberStat(
+                    stat_mod.S_IFDIR | 0o755, 0, self.index.mtime,
+                    int(self.index.mtime * 1e9)
+                )
+            raise FileNotFoundError(self.as_posix())
+        return MemberStat(
+            stat_mod.S_IFREG | 0o644, member.size, member.mtime,
+            int(member.mtime * 1e9)
+        )
+
+    def open(self, mode='r', encoding=None, errors=None, newline=None):
+        if mode not in ('r', 'rt', 'rb'):
+            raise ValueError('Archive members are read only')
+        if not self.is_file():
+            raise FileNotFoundError(self.as_posix())
+        f = self.index.open(self.member_name)
+        if mode == 'rb':
+            return f
+        return io.TextIOWrapper(
+            f, encoding=encoding, errors=errors, newline=newline
+        )
+
+    def read_bytes(self):
+        with self.open('rb') as f:
+            return f.read()
+
+    def read_text(self, encoding=None, errors=None):
+        with self.open(encoding=encoding, errors=errors) as f:
+            return f.read()
+
+
+def archive_suffix(pth: Path):
+    name = pth.name
+    for suffix in INDEXED_ARCHIVE_SUFFIXES + EXTRACTED_ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def extract_archive(archive_pth: Path) -> Path:
+    """Extract the compressed tar archive once to the cache folder."""
+    archive_stat = archive_pth.stat()
+    extract_dir = get_cache_dir('archives', path_digest(archive_pth))
+    done_pth = extract_dir / 'extracted'
+    stamp = '{} {}'.format(archive_stat.st_mtime_ns, archive_stat.st_size)
+    dest = extract_dir / 'root'
+    if done_pth.exists() and done_pth.read_text() == stamp:
+        return dest
+    logger.info(
+        'Extracting compressed archive {!s} to {!s}'.format(archive_pth, dest)
+    )
+    # Members of an earlier version of the archive must not linger
+    if done_pth.exists():
+        done_pth.unlink()
+    if dest.exists():
+        shutil.rmtree(dest.as_posix())
+    with tarfile.open(str(archive_pth), 'r:*') as tar:
+        for info in tar:
+            name = posixpath.normpath(info.name)
+            if name.startswith(('/', '..')):
+                raise ValueError(
+                    'Unsafe member {} in {!s}'.format(info.name, archive_pth)
+                )
+            if info.isfile() or info.isdir():
+                tar.extract(info, str(dest))
+    done_pth.write_text(stamp)
+    return dest
+
+
+def open_result_root(job_path):
+    """Open the job folder or archive as the result root.
+
+    An archive holding the job folder as its single top folder is opened at
+    that folder.
+    """
+    job_pth = Path(job_path).resolve()
+    if job_pth.is_dir():
+        return job_pth
+    suffix = archive_suffix(job_pth)
+    if suffix is None:
+        raise ValueError(
+            'Job result {!s} is neither a folder nor an archive of {}'.format(
+                job_pth,
+                INDEXED_ARCHIVE_SUFFIXES + EXTRACTED_ARCHIVE_SUFFIXES
+            )
+        )
+    if suffix in INDEXED_ARCHIVE_SUFFIXES:
+        root = ArchivePath(ArchiveIndex(job_pth))
+    else:
+        root = extract_archive(job_pth)
+    children = list(root.iterdir())
+    if len(children) == 1 and children[0].is_dir():
+        return children[0]
+    return root
+
+
+def is_local_path(pth):
+    """Whether the path is on the local file system, not in an archive."""
+    return not isinstance(pth, ArchivePath)
@@ -0,0 +1,145 @@
+"""Production build of the report static assets.
+
+Scripts of a bundle are concatenated into one file. Scripts and stylesheets
+are minified, renamed by their content hash, and accompanied by a
+precompressed ``.gz`` sibling. Minification requires the optional
+dependencies ``rjsmin`` and ``rcssmin``; without them the files are only
+concatenated and hashed.
+"""
+import gzip
+import hashlib
+import io
+from pathlib import Path
+from . import create_logger
+
+logger = create_logger(__name__)
+
+try:
+    from rjsmin import jsmin
+except ImportError:
+    jsmin = None
+
+try:
+    from rcssmin import cssmin
+except ImportError:
+    cssmin = None
+
+# Only these files are minified and hashed; others are copied as is
+MINIFIABLE_SUFFIXES = ['.js', '.css']
+
+
+def minify(text: str, suffix: str) -> str:
+    """Minify the JavaScript or CSS text if the minifier is available."""
+    if suffix == '.js' and jsmin is not None:
+        return jsmin(text)
+    if suffix == '.css' and cssmin is not None:
+        return cssmin(text)
+    return text
+
+
+def find_static_file(static_roots, rel_path):
+    """Find the static file that wins in the merged static folder.
+
+    Static roots are copied in order, so the last root having the file wins.
+    """
+    found = None
+    for root in static_roots:
+        pth = Path(root, rel_path)
+        if pth.is_file():
+            found = pth
+    if found is None:
+        raise ValueError(
+            'Static file {} not found in {}'.format(rel_path, static_roots)
+        )
+    return found
+
+
+def hashed_name(rel_path: str, content: bytes, length=10) -> str:
+    """Insert the content hash before the suffix of the path.
+
+    Examples
+    --------
+
+        >>> hashed_name('css/site.css', b'body {}')
+        'css/site.62368a1a29.css'
+
+    """
+    digest = hashlib.sha256(content).hexdigest()[:length]
+    pth = Path(rel_path)
+    return pth.with_name('{}.{}{}'.format(pth.stem, digest, pth.suffix)) \
+        .as_posix()
+
+
+def write_asset(writer, static_dir: Path, rel_path: str, content: bytes):
+    """Write the asset and its gzip compressed sibling."""
+    dest = static_dir / rel_path
+    writer.write_bytes(dest, content)
+    # mtime=0 keeps the compressed file reproducible
+    gz_content = io.BytesIO()
+    with gzip.GzipFile(
+        filename='', mode='wb', fileobj=gz_content, compresslevel=9, mtime=0
+    ) as f:
+        f.write(content)
+    writer.write_bytes(
+        dest.with_name(dest.name + '.gz'), gz_content.getvalue()
+    )
+
+
+def build_assets(static_roots, static_dir: Path, bundles, writer):
+    """Build the production assets under the report static folder.
+
+    Parameters
+    ----------
+    static_roots : list of path-like
+        Static folders of the report, in copy order.
+    static_dir : :py:class:`pathlib.Path`
+        Static folder of the report output.
+    bundles : dict
+        Bundle name to the list of the scripts it concatenates.
+    writer : :py:class:`bc_report.output.ReportWriter`
+        Writer of the report output.
+
+    Returns
+    -------
+    Tuple of ``(file_manifest, bundle_manifest)``. The file manifest maps
+    each original static path to its hashed path, and the bundle manifest
+    maps each bundle name to the hashed path of the bundle.
+    """
+    if jsmin is None or cssmin is None:
+        logger.warning(
+            "Minifying assets requires rjsmin and rcssmin, "
+            "try pip install rjsmin rcssmin"
+        )
+
+    file_manifest = {}
+    rel_paths = sorted({
+        pth.relative_to(root).as_posix()
+        for root in static_roots
+        for pth in Path(root).glob('**/*')
+        if pth.suffix in MINIFIABLE_SUFFIXES and pth.is_file()
+    })
+    for rel_path in rel_paths:
+        src = find_static_file(static_roots, rel_path)
+        with src.open(encoding='utf8') as f:
+            content = minify(f.read(), src.suffix).encode('utf8')
+        file_manifest[rel_path] = hashed_name(rel_path, content)
+        write_asset(writer, static_dir, file_manifest[rel_path], content)
+
+    bundle_manifest = {}
+    for bundle_name, bundle_files in bundles.items():
+        scripts = []
+        for rel_path in bundle_files:
+            with find_static_file(static_roots, rel_path).open(
+                encoding='utf8'
+            ) as f:
+                scripts.append(minify(f.read(), '.js'))
+        # Separate scripts by semicolons against missing trailing ones
+        content = '\n;\n'.join(scripts).encode('utf8')
+        bundle_path = hashed_name('bundles/{}.js'.format(bundle_name), content)
+        bundle_manifest[bundle_name] = bundle_path
+        write_asset(writer, static_dir, bundle_path, content)
+        logger.info(
+            'Bundle {} of {} scripts written to {}'
+            .format(bundle_name, len(bundle_files), bundle_path)
+        )
+    return file_manifest, bundle_manifest
@@ -1,22 +1,29 @@
+from datetime import datetime
 import importlib
 import logging
+import os
 from pathlib import Path
 import shutil
 import sys
 import click
 
 from . import create_logger
+from .metrics import MetricsStore, ingest_report
+from .output import archive_report_root, open_archive_writer
+from .preflight import preflight
+from .server import make_server
 
 logger = create_logger(__name__)
 
 CAVEAT_MESSAGE = '''\
 New output result is under {!s}.
 
-The folder can be downloaded and viewed locally.
-Quick remainder for serving current folder through http:
+The report pages load their chart data by HTTP requests, which browsers
+block for pages opened from the file system, so the report must be served.
+Quick remainder for serving the report and the job results through http:
 
-    $ python3 -m http.server
-    # Serving HTTP on 0.0.0.0 port 8000 ...
+    $ bc_report_serve REPORT_DIR JOB_DIR
+    # Serving report on http://127.0.0.1:8000/report/ ...
 '''
 
 
@@ -53,6 +60,173 @@ def create_log_format(log_time, color):
     return log_formatter
 
 
+def check_inputs(report, stages=None):
+    """Exit with all the problems of the stage inputs if any are found.
+
+    See :py:func:`bc_report.preflight.preflight`.
+    """
+    problems = preflight(report, stages)
+    if not problems:
+        return
+    for problem in problems:
+        if problem.path is None:
+            logger.error('{}: {}'.format(problem.stage, problem.message))
+        else:
+            logger.error('{}: {!s} {}'.format(
+                problem.stage, problem.path, problem.message
+            ))
+    sys.exit(
+        "Found {} problems of the job inputs, no report is generated "
+        "(skip the check by passing --no-preflight option)."
+        .format(len(problems))
+    )
+
+
+def update_report(
+    report_cls, job_dir_p, report_kwargs, out_dir_p, only, since,
+    check=True
+):
+    """Rebuild the selected stages in the existing output folder."""
+    if not out_dir_p.is_dir():
+        sys.exit(
+            "Output folder {!s} does not exist, generate the whole report "
+            "first.".format(out_dir_p)
+        )
+    report = report_cls(job_dir_p, **report_kwargs)
+    try:
+        if check:
+            _, parse = report.select_stages(only, since)
+            check_inputs(
+                report, [s for s in report.tool_stages if s in parse]
+            )
+        report.generate(out_dir_p, only=only, since=since)
+    except ValueError as e:
+        sys.exit(str(e))
+    logger.info("Job successfully end. Print message")
+    print(CAVEAT_MESSAGE.format(out_dir_p))
+    return report
+
+
+def generate_report_folder(
+    report_cls, job_dir_p, report_kwargs, out_dir_p, force, check=True
+):
+    """Generate the whole report in the output folder.
+
+    The inputs are checked before the output folder is touched.
+    """
+    report = report_cls(job_dir_p, **report_kwargs)
+    if check:
+        check_inputs(report)
+
+    if out_dir_p.exists():
+        if not force:
+            sys.exit(
+                "Cannot overwrite output folder (force overwriting by passing "
+                "--force option). Current operation has been aborted."
+            )
+        logger.warning(
+            "Report output folder {:s} has already existed! ..."
+            .format(out_dir_p.as_posix())
+        )
+        # remove the output folder completely
+        shutil.rmtree(out_dir_p.as_posix())
+    out_dir_p.mkdir(parents=True)
+
+    report.generate(out_dir_p)
+    logger.info("Job successfully end. Print message")
+    print(CAVEAT_MESSAGE.format(out_dir_p))
+    return report
+
+
+def generate_report_archive(
+    report_cls, job_dir_p, report_kwargs, archive_p, compress_level, force,
+    check=True
+):
+    """Generate the report straight into the archive.
+
+    The archive is only replaced once the generation succeeds.
+    """
+    try:
+        report_root = archive_report_root(archive_p)
+    except ValueError as e:
+        sys.exit(str(e))
+    report = report_cls(job_dir_p, **report_kwargs)
+    if check:
+        check_inputs(report)
+    if archive_p.exists():
+        if not force:
+            sys.exit(
+                "Cannot overwrite archive (force overwriting by passing "
+                "--force option). Current operation has been aborted."
+            )
+        logger.warning(
+            "Report archive {!s} has already existed! ...".format(archive_p)
+        )
+    if not archive_p.parent.exists():
+        archive_p.parent.mkdir(parents=True)
+
+    # Write to a temporary file next to the archive and only replace the
+    # archive once done, so a failed run keeps the existing archive
+    tmp_p = archive_p.with_name(
+        '.{}.{:d}.tmp'.format(archive_p.name, os.getpid())
+    )
+    try:
+        with open_archive_writer(
+            archive_p, compress_level, dest_pth=tmp_p
+        ) as writer:
+            report.generate(report_root, writer=writer)
+        os.replace(str(tmp_p), str(archive_p))
+    except BaseException:
+        logger.error(
+            "Report generation failed, removing unfinished archive {!s}"
+            .format(tmp_p)
+        )
+        if tmp_p.exists():
+            tmp_p.unlink()
+        raise
+
+    logger.info("Job successfully end. Print message")
+    print(CAVEAT_MESSAGE.format(
+        '{!s}, which extracts to folder {!s}'.format(archive_p, report_root)
+    ))
+    return report
+
+
+def import_report_class(pipeline):
+    """Import the report class by its full path."""
+    pipe_module_name, pipe_class_name = pipeline.rsplit('.', 1)
+    pipe_module = importlib.import_module(pipe_module_name)
+    return getattr(pipe_module, pipe_class_name)
+
+
+def ingest_metrics(report, metrics_db):
+    """Ingest the metrics of the generated report into the metrics store."""
+    with MetricsStore(metrics_db) as store:
+        ingest_report(report, store)
+
+
+SINCE_FORMATS = ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+
+def parse_since(ctx, param, value):
+    """Parse the --since value as a local date time or a POSIX timestamp."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in SINCE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    raise click.BadParameter(
+        'expect a POSIX timestamp or a date time in formats {}'
+        .format(', '.join(SINCE_FORMATS))
+    )
+
+
 ReadableAbsoluteFolderPath = click.Path(
     exists=True,
     dir_okay=True, file_okay=False,
@@ -60,6 +234,14 @@ ReadableAbsoluteFolderPath = click.Path(
     resolve_path=True
 )
 
+# Job folder, or the job archive read in place
+ReadableAbsoluteJobPath = click.Path(
+    exists=True,
+    dir_okay=True, file_okay=True,
+    readable=True,
+    resolve_path=True
+)
+
 
 @click.command(context_settings={
     'help_option_names': ['-h', '--help']
@@ -86,11 +268,66 @@ ReadableAbsoluteFolderPath = click.Path(
     help='Full path to the pipeline class',
     required=True,
 )
-@click.argument('job_dir', type=ReadableAbsoluteFolderPath)
+@click.option(
+    '--assets', 'asset_mode',
+    type=click.Choice(['development', 'production']), default='development',
+    help='Bundle, minify, and precompress static files in production',
+)
+@click.option(
+    '--archive', type=click.Path(dir_okay=False),
+    help='Write the report straight into a .tar.gz, .tar, or .zip archive '
+         'instead of the output folder',
+)
+@click.option(
+    '--compress-level', type=click.IntRange(0, 9), default=6,
+    show_default=True,
+    help='Compression level of the archive',
+)
+@click.option(
+    '--low-memory/--no-low-memory', default=False,
+    help='Render each stage right after parsing and keep only its summary',
+)
+@click.option(
+    '--io-workers', type=click.IntRange(1, None), metavar='N',
+    help='Number of input files read concurrently (default: 8)',
+)
+@click.option(
+    '--binary-series/--no-binary-series', default=False,
+    help='Export numeric chart series as binary float32/int32 buffers '
+         'instead of JSON number arrays',
+)
+@click.option(
+    '--fragment-cache/--no-fragment-cache', default=False,
+    help='Cache the rendered per-sample table rows across runs under the '
+         'cache folder',
+)
+@click.option(
+    '--preflight/--no-preflight', 'run_preflight', default=True,
+    help='Check the inputs of all stages before generating the report, '
+         'and abort with every problem found',
+)
+@click.option(
+    '--only', multiple=True, metavar='STAGE',
+    help='Rebuild only the stage, such as STARStage, and the stages '
+         'depending on it in the existing output folder (repeatable)',
+)
+@click.option(
+    '--since', callback=parse_since, metavar='TIME',
+    help='Rebuild only the stages whose input files are modified after '
+         'TIME, a POSIX timestamp or YYYY-MM-DD[THH:MM:SS], and the stages '
+         'depending on them in the existing output folder',
+)
+@click.option(
+    '--metrics-db', type=click.Path(dir_okay=False), metavar='DB',
+    help='Ingest the QC metrics of the job into the SQLite metrics store',
+)
+@click.argument('job_dir', type=ReadableAbsoluteJobPath)
 @click.argument('out_dir', type=click.Path(), default='./output')
 def generate_report_cli(
     pipeline, job_dir, out_dir,
-    verbose, log_time, color, force,
+    verbose, log_time, color, force, asset_mode, archive, compress_level,
+    only, since, low_memory, io_workers, binary_series, fragment_cache,
+    run_preflight, metrics_db,
 ):
     # Setup console logging
     console = logging.StreamHandler()
@@ -118,32 +355,160 @@ def generate_report_cli(
         'Importing pipeline report class {pipeline:s} ...'
         .format(pipeline=pipeline)
     )
-    pipe_module_name, pipe_class_name = pipeline.rsplit('.', 1)
-    pipe_module = importlib.import_module(pipe_module_name)
-    pipeline_report_cls = getattr(pipe_module, pipe_class_name)
+    pipeline_report_cls = import_report_class(pipeline)
+
+    job_dir_p = Path(job_dir)
+    report_kwargs = dict(
+        asset_mode=asset_mode, low_memory=low_memory, io_workers=io_workers,
+        binary_series=binary_series, fragment_cache=fragment_cache,
+    )
+    if only or since is not None:
+        if archive:
+            sys.exit("Cannot rebuild stages of an archive, use --only and "
+                     "--since with an output folder.")
+        report = update_report(
+            pipeline_report_cls, job_dir_p, report_kwargs, Path(out_dir),
+            only=list(only) or None, since=since, check=run_preflight
+        )
+    elif archive:
+        report = generate_report_archive(
+            pipeline_report_cls, job_dir_p, report_kwargs,
+            Path(archive), compress_level, force, check=run_preflight
+        )
+    else:
+        report = generate_report_folder(
+            pipeline_report_cls, job_dir_p, report_kwargs, Path(out_dir),
+            force, check=run_preflight
+        )
+    if metrics_db:
+        ingest_metrics(report, metrics_db)
+
+
+@click.command(context_settings={
+    'help_option_names': ['-h', '--help']
+})
+@click.option(
+    '-v', '--verbose', count=True,
+    help='Increase verbosity (noiser when more -v)',
+)
+@click.option(
+    '--host', default='127.0.0.1', show_default=True,
+    help='Address to listen on',
+)
+@click.option(
+    '--port', type=int, default=8000, show_default=True,
+    help='Port to listen on',
+)
+@click.argument('report_dir', type=ReadableAbsoluteFolderPath)
+@click.argument('job_dir', type=ReadableAbsoluteJobPath)
+def serve_report_cli(report_dir, job_dir, verbose, host, port):
+    """Serve the report under /report/ and the job results under /result/.
+
+    The job results are either a folder or a job archive.
+    """
+    console = logging.StreamHandler()
+    all_loggers = logging.getLogger()
+    all_loggers.addHandler(console)
+    all_loggers.setLevel(logging.INFO if verbose else logging.WARNING)
+    console.setFormatter(create_log_format(log_time=True, color=True))
 
-    # Processing the job and output folders
-    job_dir_p, out_dir_p = Path(job_dir), Path(out_dir)
+    try:
+        server = make_server(report_dir, job_dir, host, port)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(
+        'Serving report on http://{}:{}/report/ ... (Ctrl-C to stop)'
+        .format(host, server.server_address[1])
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@click.group(context_settings={
+    'help_option_names': ['-h', '--help']
+})
+@click.option(
+    '-v', '--verbose', count=True,
+    help='Increase verbosity (noiser when more -v)',
+)
+def metrics_cli(verbose):
+    """Collect the QC metrics of many runs and report their trends."""
+    console = logging.StreamHandler()
+    all_loggers = logging.getLogger()
+    all_loggers.addHandler(console)
+    all_loggers.setLevel(logging.INFO if verbose else logging.WARNING)
+    console.setFormatter(create_log_format(log_time=True, color=True))
+
+
+@metrics_cli.command('ingest')
+@click.option(
+    '-p', '--pipeline',
+    metavar='bc_pipelines.mypipeline.report.Report',
+    help='Full path to the pipeline class',
+    required=True,
+)
+@click.option(
+    '--db', 'metrics_db', type=click.Path(dir_okay=False), required=True,
+    help='SQLite metrics store, created if it does not exist',
+)
+@click.option(
+    '-f', '--force/--no-force', default=False,
+    help='Ingest the runs again even if unchanged',
+)
+@click.option(
+    '--low-memory/--no-low-memory', default=False,
+    help='Create the reports in low-memory mode, as the report '
+         'generation does',
+)
+@click.option(
+    '--io-workers', type=click.IntRange(1, None), metavar='N',
+    help='Number of input files read concurrently (default: 8)',
+)
+@click.argument('job_dirs', nargs=-1, type=ReadableAbsoluteJobPath)
+def ingest_metrics_cli(
+    pipeline, metrics_db, force, low_memory, io_workers, job_dirs
+):
+    """Ingest the QC metrics of the jobs, skipping unchanged ones."""
+    report_cls = import_report_class(pipeline)
+    num_ingested = 0
+    with MetricsStore(metrics_db) as store:
+        for job_dir in job_dirs:
+            report = report_cls(
+                Path(job_dir), low_memory=low_memory, io_workers=io_workers
+            )
+            num_ingested += ingest_report(report, store, force=force)
+    print('Ingested {} of {} jobs into {}'.format(
+        num_ingested, len(job_dirs), metrics_db
+    ))
+
+
+@metrics_cli.command('trend')
+@click.option(
+    '--db', 'metrics_db',
+    type=click.Path(exists=True, dir_okay=False), required=True,
+    help='SQLite metrics store',
+)
+@click.option(
+    '-f', '--force/--no-force', default=False,
+    help='Overwrite the output folder if it exists',
+)
+@click.argument('out_dir', type=click.Path(), default='./trend')
+def trend_report_cli(metrics_db, force, out_dir):
+    """Generate the report of the metric trends over all runs."""
+    from bc_pipelines.base.trend import TrendReport
+    out_dir_p = Path(out_dir)
     if out_dir_p.exists():
         if not force:
             sys.exit(
                 "Cannot overwrite output folder (force overwriting by passing "
                 "--force option). Current operation has been aborted."
             )
-        logger.warning(
-            "Report output folder {:s} has already existed! ..."
-            .format(out_dir_p.as_posix())
-        )
-        # remove the output folder completely
         shutil.rmtree(out_dir_p.as_posix())
-    # Create the output folder
     out_dir_p.mkdir(parents=True)
-
-    # Initiate the report class
-    report = pipeline_report_cls(job_dir_p)
-
-    # Generate the report
-    report.generate(out_dir_p)
-
-    logger.info("Job successfully end. Print message")
-    print(CAVEAT_MESSAGE.format(out_dir))
+    with MetricsStore(metrics_db) as store:
+        TrendReport(store).generate(out_dir_p)
+    print('QC trend report is at {!s}'.format(out_dir_p / 'trend.html'))
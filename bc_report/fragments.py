@@ -0,0 +1,162 @@
+"""Cache of rendered template fragments.
+
+Templates wrap repeated per-sample markup in a ``cache`` block keyed by the
+data it renders::
+
+    {% cache sample, data_info.align_stat[sample] %}
+        <th>{{ sample }}</th> ...
+    {% endcache %}
+
+The block is rendered once per distinct key data and template version, and
+spliced from the on-disk :py:class:`FragmentCache` afterwards. Blocks must
+be pure functions of their key data: side effects such as ``data_url``
+exports are skipped on cache hits, and values not in the key, such as loop
+variables, are not tracked.
+
+A hit costs a key digest and a file read, about as much as rendering a
+small table row again, see ``benchmarks/bench_fragment_cache.py``. So the
+cache is off unless reports are created with ``fragment_cache``, and pays
+off only for blocks costly to render.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import pickle
+import threading
+from jinja2 import nodes
+from jinja2.ext import Extension
+from . import __version__, create_logger
+
+logger = create_logger(__name__)
+
+
+class FragmentCache:
+    """On-disk LRU cache of rendered fragments, bounded by total size.
+
+    Fragments are files named by their keys. The recency is their modified
+    time, which is refreshed on every hit, so the LRU order survives across
+    runs.
+    """
+
+    def __init__(self, cache_dir, max_size=64 * 1024 ** 2):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        self._total_size = 0
+        if not self.cache_dir.exists():
+            self.cache_dir.mkdir(parents=True)
+        entries = sorted(
+            (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+            for entry in os.scandir(str(self.cache_dir))
+            if entry.is_file() and entry.name.endswith('.html')
+        )
+        for _, name, size in entries:
+            self._sizes[name[:-len('.html')]] = size
+            self._total_size += size
+
+    def _path(self, key):
+        return self.cache_dir / '{}.html'.format(key)
+
+    def get(self, key):
+        """Cached fragment of the key, or ``None``."""
+        pth = self._path(key)
+        try:
+            with pth.open('rb') as f:
+                fragment = f.read().decode('utf8')
+            os.utime(str(pth))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return fragment
+
+    def set(self, key, fragment):
+        content = fragment.encode('utf8')
+        if len(content) > self.max_size:
+            return
+        pth = self._path(key)
+        tmp_pth = pth.with_name('{}.{}.tmp'.format(
+            pth.name, threading.get_ident()
+        ))
+        with tmp_pth.open('wb') as f:
+            f.write(content)
+        os.replace(str(tmp_pth), str(pth))
+        with self._lock:
+            self._total_size += len(content) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(content)
+            while self._total_size > self.max_size:
+                evicted_key, size = self._sizes.popitem(last=False)
+                self._total_size -= size
+                try:
+                    self._path(evicted_key).unlink()
+                except FileNotFoundError:
+                    pass
+
+
+def digest_key_data(key_data):
+    """Digest of the key data by its pickle, or its repr if not picklable."""
+    try:
+        dumped = pickle.dumps(key_data, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        dumped = repr(key_data).encode('utf8')
+    return hashlib.sha1(dumped).digest()
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja2 ``{% cache key, ... %}...{% endcache %}`` block.
+
+    Fragments are stored in the cache returned by the environment's
+    ``get_fragment_cache``, or always rendered if it returns ``None``. The
+    template version is the digest of all templates the loader can find,
+    so editing any template, including the macros a block calls, renders
+    the blocks again.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(get_fragment_cache=lambda: None)
+        self._templates_digest = None
+
+    def templates_digest(self):
+        if self._templates_digest is None:
+            digest = hashlib.sha1(__version__.encode('utf8'))
+            loader = self.environment.loader
+            for name in sorted(loader.list_templates()):
+                source = loader.get_source(self.environment, name)[0]
+                digest.update(name.encode('utf8'))
+                digest.update(source.encode('utf8'))
+            self._templates_digest = digest.hexdigest()
+        return self._templates_digest
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        block_id = '{}:{}'.format(parser.name, lineno)
+        return nodes.CallBlock(
+            self.call_method(
+                '_render_cached', [nodes.Const(block_id), nodes.List(key_args)]
+            ),
+            [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, block_id, key_data, caller):
+        cache = self.environment.get_fragment_cache()
+        if cache is None:
+            return caller()
+        digest = hashlib.sha1(self.templates_digest().encode('utf8'))
+        digest.update(block_id.encode('utf8'))
+        digest.update(digest_key_data(key_data))
+        key = digest.hexdigest()
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
@@ -1,25 +1,244 @@
+from array import array
 from collections import OrderedDict, namedtuple
+import csv
+import os
 from pathlib import Path
+import pickle
+import tempfile
 from typing import Dict
 import yaml
 from . import create_logger
+from .archive import open_result_root
+from .utils import get_cache_dir, path_digest
+
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
 
 logger = create_logger(__name__)
 
 
 DataSource = namedtuple('DataSource', ['name', 'path', 'file_type', 'strand'])
+SourceRow = namedtuple('SourceRow', [
+    'condition', 'sample', 'source',
+    'condition_id', 'sample_id', 'source_id',
+    'condition_span', 'sample_span',
+])
 
+# Candidates of the analysis info file in the job folder, in priority
+ANALYSIS_INFO_FILENAMES = [
+    'analysis_info.yaml',
+    'analysis_info.tsv',
+    'analysis_info.csv',
+]
 
-class AnalysisInfo:
-    def __init__(self, job_dir):
-        self.result_root = Path(job_dir).resolve()
+# Columns of the sample sheet format
+SAMPLE_SHEET_COLUMNS = [
+    'condition', 'sample', 'source', 'path', 'type', 'strand',
+]
 
-        yaml_pth = self.result_root / 'analysis_info.yaml'
-        logger.debug(
-            'Reading analysis info from {:s}'.format(yaml_pth.as_posix())
+
+def read_sample_sheet(f, delimiter='\t'):
+    """Read the TSV/CSV sample sheet into the raw analysis info structure.
+
+    Each row is a data source with its condition and sample. Leading comment
+    lines of form ``#name=value`` are the parameters. The rows are streamed
+    so huge cohorts are read without an intermediate table.
+
+    Examples
+    --------
+
+        #pipeline=rna_seq
+        condition	sample	source	path	type	strand
+        control	sample	sample_R1.fastq	1/sample_R1.fastq	FASTQ	R1
+
+    """
+    parameters = OrderedDict()
+    conditions = OrderedDict()
+    data_sources = []
+    reader = csv.reader(f, delimiter=delimiter)
+    header = None
+    for row in reader:
+        if not row or not any(row):
+            continue
+        if row[0].startswith('#'):
+            param = delimiter.join(row)[1:]
+            if '=' in param:
+                name, value = param.split('=', 1)
+                parameters[name.strip()] = value.strip()
+            continue
+        if header is None:
+            header = row
+            if header != SAMPLE_SHEET_COLUMNS:
+                raise ValueError(
+                    'Sample sheet columns should be {}, not {}'
+                    .format(SAMPLE_SHEET_COLUMNS, header)
+                )
+            continue
+        if len(row) != len(SAMPLE_SHEET_COLUMNS):
+            raise ValueError(
+                'Sample sheet line {:d} has {:d} columns, expected {}: {}'
+                .format(
+                    reader.line_num, len(row), SAMPLE_SHEET_COLUMNS, row
+                )
+            )
+        condition, sample, source, path, file_type, strand = row
+        conditions.setdefault(condition, OrderedDict()) \
+            .setdefault(sample, []).append(source)
+        data_sources.append({source: {
+            'path': path, 'type': file_type, 'strand': strand,
+        }})
+    return {
+        'conditions': [
+            {condition: [
+                {sample: sources} for sample, sources in samples.items()
+            ]}
+            for condition, samples in conditions.items()
+        ],
+        'data_sources': data_sources,
+        'parameters': parameters,
+    }
+
+
+class SampleIndex:
+    """Array-backed index of the conditions, samples, and data sources.
+
+    Conditions, samples, and sources are given integer IDs by their order in
+    the analysis info. Samples are grouped by condition and sources by
+    sample, so members of a group have a contiguous range of IDs, stored
+    CSR-style as start offsets. The per-member parent IDs are int arrays
+    which can be wrapped by :py:func:`numpy.frombuffer` for vectorized
+    group-bys.
+
+    Examples
+    --------
+
+        >>> index = analysis_info.index
+        >>> cond_id = index.condition_id('test')
+        >>> [index.sample_names[i] for i in index.samples_of(cond_id)]
+        ['another', 'yet_another']
+        >>> index.sample_condition[index.sample_id('another')] == cond_id
+        True
+
+    """
+    __slots__ = (
+        'condition_names', 'sample_names', 'source_names',
+        'sample_condition', 'source_sample',
+        'condition_sample_start', 'sample_source_start',
+        '_condition_ids', '_sample_ids', '_source_ids',
+    )
+
+    def __init__(self, conditions: Dict[str, Dict]):
+        self.condition_names = []
+        self.sample_names = []
+        self.source_names = []
+        self.sample_condition = array('l')
+        self.source_sample = array('l')
+        self.condition_sample_start = array('l', [0])
+        self.sample_source_start = array('l', [0])
+        for condition_id, (condition, samples) in enumerate(
+            conditions.items()
+        ):
+            self.condition_names.append(condition)
+            for sample, sources in samples.items():
+                sample_id = len(self.sample_names)
+                self.sample_names.append(sample)
+                self.sample_condition.append(condition_id)
+                for source in sources:
+                    self.source_names.append(source)
+                    self.source_sample.append(sample_id)
+                self.sample_source_start.append(len(self.source_names))
+            self.condition_sample_start.append(len(self.sample_names))
+        self._condition_ids = {
+            name: i for i, name in enumerate(self.condition_names)
+        }
+        self._sample_ids = {
+            name: i for i, name in enumerate(self.sample_names)
+        }
+        self._source_ids = {
+            name: i for i, name in enumerate(self.source_names)
+        }
+
+    def condition_id(self, condition) -> int:
+        return self._condition_ids[condition]
+
+    def sample_id(self, sample) -> int:
+        return self._sample_ids[sample]
+
+    def source_id(self, source) -> int:
+        return self._source_ids[source]
+
+    def samples_of(self, condition_id) -> range:
+        return range(
+            self.condition_sample_start[condition_id],
+            self.condition_sample_start[condition_id + 1],
+        )
+
+    def sources_of(self, sample_id) -> range:
+        return range(
+            self.sample_source_start[sample_id],
+            self.sample_source_start[sample_id + 1],
+        )
+
+    def num_sources_of_condition(self, condition_id) -> int:
+        samples = self.samples_of(condition_id)
+        return (
+            self.sample_source_start[samples.stop] -
+            self.sample_source_start[samples.start]
         )
-        with yaml_pth.open() as f:
-            self._raw = yaml.load(f)
+
+    def source_rows(self, start=0, stop=None):
+        """Iterate the sources as table rows with their row spans.
+
+        The span is the number of rows the condition (or sample) cell should
+        cover at its first row, and 0 at the other rows. Given a range of
+        source IDs, only the sources in range are listed and the spans are
+        clipped to the range, as on a page of the full table.
+        """
+        num_sources = len(self.source_names)
+        stop = num_sources if stop is None else min(stop, num_sources)
+        for source_id in range(start, stop):
+            sample_id = self.source_sample[source_id]
+            condition_id = self.sample_condition[sample_id]
+            sample_sources = self.sources_of(sample_id)
+            condition_samples = self.samples_of(condition_id)
+            condition_sources = range(
+                self.sample_source_start[condition_samples.start],
+                self.sample_source_start[condition_samples.stop],
+            )
+            first_of_sample = source_id == max(sample_sources.start, start)
+            first_of_condition = (
+                source_id == max(condition_sources.start, start)
+            )
+            yield SourceRow(
+                condition=self.condition_names[condition_id],
+                sample=self.sample_names[sample_id],
+                source=self.source_names[source_id],
+                condition_id=condition_id,
+                sample_id=sample_id,
+                source_id=source_id,
+                condition_span=(
+                    min(condition_sources.stop, stop) - source_id
+                    if first_of_condition else 0
+                ),
+                sample_span=(
+                    min(sample_sources.stop, stop) - source_id
+                    if first_of_sample else 0
+                ),
+            )
+
+
+class AnalysisInfo:
+    """Analysis info of the job folder or the job archive.
+
+    The result root of an archived job reads the archive members in place,
+    see :py:func:`bc_report.archive.open_result_root`.
+    """
+
+    def __init__(self, job_dir):
+        self.result_root = open_result_root(job_dir)
+        self._raw = self.load_raw()
 
         self.data_sources = self.parse_data_sources()
         self.conditions = self.parse_conditions()
@@ -28,6 +247,78 @@ class AnalysisInfo:
         for condition_samples in self.conditions.values():
             samples.update(condition_samples)
         self.samples = samples
+        self.index = SampleIndex(self.conditions)
+
+    def locate_info_file(self) -> Path:
+        for filename in ANALYSIS_INFO_FILENAMES:
+            info_pth = self.result_root / filename
+            if info_pth.exists():
+                return info_pth
+        raise ValueError(
+            'No analysis info file ({}) found under {!s}'
+            .format(', '.join(ANALYSIS_INFO_FILENAMES), self.result_root)
+        )
+
+    def load_raw(self):
+        """Load the raw analysis info, reusing the cached snapshot if valid.
+
+        The snapshot is keyed by the name, mtime, and size of the analysis
+        info file. It is replaced atomically, and parsed again from the file
+        if it cannot be unpickled.
+        """
+        info_pth = self.locate_info_file()
+        info_stat = info_pth.stat()
+        cache_key = (info_pth.name, info_stat.st_mtime_ns, info_stat.st_size)
+        cache_pth = (
+            get_cache_dir(path_digest(self.result_root)) /
+            'analysis_info.pickle'
+        )
+        try:
+            with cache_pth.open('rb') as f:
+                cached_key, raw = pickle.load(f)
+            if cached_key == cache_key:
+                logger.debug(
+                    'Reading analysis info from cache {:s}'
+                    .format(cache_pth.as_posix())
+                )
+                return raw
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Truncated, corrupted, or written by an incompatible version
+            logger.warning(
+                'Cannot read analysis info cache {:s}, parse the analysis '
+                'info again: {!r}'.format(cache_pth.as_posix(), e)
+            )
+
+        logger.debug(
+            'Reading analysis info from {:s}'.format(info_pth.as_posix())
+        )
+        with info_pth.open() as f:
+            if info_pth.suffix == '.yaml':
+                raw = yaml.load(f, Loader=YAMLLoader)
+            else:
+                delimiter = ',' if info_pth.suffix == '.csv' else '\t'
+                raw = read_sample_sheet(f, delimiter=delimiter)
+
+        # Write aside and replace, so readers never see a partial snapshot
+        tmp_pth = None
+        try:
+            tmp_fd, tmp_pth = tempfile.mkstemp(
+                suffix='.tmp', prefix=cache_pth.name + '.',
+                dir=cache_pth.parent.as_posix(),
+            )
+            with os.fdopen(tmp_fd, 'wb') as f:
+                pickle.dump((cache_key, raw), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_pth, cache_pth.as_posix())
+        except OSError as e:
+            logger.warning(
+                'Cannot write analysis info cache {:s}: {!r}'
+                .format(cache_pth.as_posix(), e)
+            )
+            if tmp_pth is not None and os.path.exists(tmp_pth):
+                os.unlink(tmp_pth)
+        return raw
 
     def parse_data_sources(self) -> Dict[str, DataSource]:
         data_sources = OrderedDict()
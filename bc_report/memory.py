@@ -0,0 +1,171 @@
+"""Render report pages on request inside a long-running process.
+
+:py:class:`ReportCache` keeps the parsed reports of recently viewed jobs,
+so a page view renders from the parsed data without reading the job
+results again. Reports are evicted in least recently used order once their
+estimated data size exceeds the cache capacity.
+
+    >>> cache = ReportCache(max_size=256 * 1024 ** 2)
+    >>> files = cache.render(RNASeqReport, '/path/to/job', ['index.html'])
+    >>> html = files.read_bytes('index.html')
+
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from pathlib import Path
+import sys
+import threading
+from . import create_logger
+from .output import MemoryWriter
+from .utils import format_size
+
+logger = create_logger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ['report', 'lock', 'size'])
+
+
+def estimate_data_size(value, seen=None) -> int:
+    """Estimate the memory the parsed data take without copying them.
+
+    NumPy arrays and pandas objects count their buffers, containers their
+    items, and other objects their own size. Objects referred to more than
+    once are counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if hasattr(value, 'memory_usage'):
+        # pandas DataFrame, Series, and Index
+        usage = value.memory_usage(index=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if hasattr(value, 'nbytes') and hasattr(value, 'dtype'):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            estimate_data_size(k, seen) + estimate_data_size(v, seen)
+            for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_data_size(v, seen) for v in value)
+    return size
+
+
+def parsed_stages(report):
+    return {
+        name for name, data in report.data_info.items() if data is not None
+    }
+
+
+class ReportCache:
+    """LRU cache of parsed reports bounded by their total data size.
+
+    Reports are keyed by the report class, the job path, and the report
+    arguments. A report larger than the whole capacity is used but not
+    kept. Methods are thread-safe; pages of the same report are rendered
+    one at a time while different reports render concurrently.
+    """
+
+    def __init__(self, max_size=512 * 1024 ** 2):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Reports being created, by key, so each is created once
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(report_cls, job_dir, report_kwargs):
+        return (
+            report_cls, str(Path(job_dir).resolve()),
+            tuple(sorted(report_kwargs.items())),
+        )
+
+    @property
+    def total_size(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def _get_entry(self, key, report_cls, job_dir, report_kwargs):
+        """Cached entry of the key, creating its report if not cached.
+
+        The report is created outside the cache lock, so a slow job does not
+        block the requests of other jobs. Concurrent requests of the same job
+        wait for the same report.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            future = self._loading.get(key)
+            loading = future is None
+            if loading:
+                future = self._loading[key] = Future()
+        if not loading:
+            return future.result()
+
+        logger.info('Loading report of job {!s}'.format(job_dir))
+        try:
+            entry = CacheEntry(
+                report_cls(job_dir, **report_kwargs), threading.Lock(), 0
+            )
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = entry
+        future.set_result(entry)
+        return entry
+
+    def _grow(self, key, entry, added_size):
+        """Add to the size of the entry and evict the least recently used."""
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None or stored.lock is not entry.lock:
+                # Evicted or invalidated while rendering
+                return
+            self._entries[key] = stored._replace(
+                size=stored.size + added_size
+            )
+            while self._entries and self.total_size > self.max_size:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                logger.info('Evicting report of job {} ({})'.format(
+                    evicted_key[1], format_size(evicted.size)
+                ))
+
+    def render(
+        self, report_cls, job_dir, pages=None, **report_kwargs
+    ) -> MemoryWriter:
+        """Render the pages of the job report in memory.
+
+        See :py:meth:`bc_report.report.Report.render_in_memory`.
+        """
+        key = self.make_key(report_cls, job_dir, report_kwargs)
+        entry = self._get_entry(key, report_cls, job_dir, report_kwargs)
+        with entry.lock:
+            # The report need not stay in the cache to finish rendering
+            report = entry.report
+            parsed = parsed_stages(report)
+            files = report.render_in_memory(pages)
+            # Only the newly parsed stages are measured
+            new_stages = parsed_stages(report) - parsed
+            if new_stages:
+                self._grow(key, entry, sum(
+                    estimate_data_size(report.data_info[name])
+                    for name in new_stages
+                ))
+        return files
+
+    def invalidate(self, job_dir=None):
+        """Drop the reports of the job, or all the reports if not given."""
+        with self._lock:
+            if job_dir is None:
+                self._entries.clear()
+                return
+            job_root = str(Path(job_dir).resolve())
+            for key in [k for k in self._entries if k[1] == job_root]:
+                del self._entries[key]
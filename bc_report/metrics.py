@@ -0,0 +1,199 @@
+"""Warehouse of the QC metrics across report runs.
+
+Stages publish their per-sample QC metrics by :py:meth:`Stage.metrics
+<bc_report.report.Stage.metrics>`. :py:func:`ingest_report` stores them in
+a local SQLite database, one run per job, so the metrics of months of runs
+can be compared without parsing the old jobs again. A run is ingested again
+only if the input files of its metric stages have changed, replacing its
+previous metrics.
+"""
+from collections import namedtuple
+import hashlib
+from pathlib import Path
+import sqlite3
+import time
+from . import create_logger
+from .report import Stage
+from .utils import strify_path
+
+logger = create_logger(__name__)
+
+Metric = namedtuple('Metric', ['sample', 'name', 'value', 'status'])
+"""QC metric of a sample. The value is a number or ``None``, and the status
+is a text such as ``pass`` or ``None``."""
+
+TrendPoint = namedtuple(
+    'TrendPoint', ['job_path', 'run_time', 'num_samples', 'mean', 'min', 'max']
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    job_path TEXT NOT NULL UNIQUE,
+    report TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    stamp TEXT NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_run_time ON runs (run_time);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id);
+CREATE INDEX IF NOT EXISTS metrics_sample ON metrics (sample, metric);
+-- Covers the trend queries, which read no table rows
+CREATE INDEX IF NOT EXISTS metrics_metric
+    ON metrics (stage, metric, run_id, value);
+'''
+
+
+class MetricsStore:
+    """SQLite store of the QC metrics of all ingested runs."""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._conn = sqlite3.connect(strify_path(self.db_path))
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def run_stamp(self, job_path):
+        """Stamp of the ingested run of the job, or ``None``."""
+        row = self._conn.execute(
+            'SELECT stamp FROM runs WHERE job_path = ?', (job_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def replace_run(self, job_path, report, run_time, stamp, stage_metrics):
+        """Store the run's metrics, replacing the previous ones if any.
+
+        ``stage_metrics`` is an iterable of (stage name, :py:class:`Metric`).
+        The run is replaced in a single transaction.
+        """
+        with self._conn:
+            row = self._conn.execute(
+                'SELECT run_id FROM runs WHERE job_path = ?', (job_path,)
+            ).fetchone()
+            if row is None:
+                run_id = self._conn.execute(
+                    'INSERT INTO runs '
+                    '(job_path, report, run_time, stamp, ingested_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (job_path, report, run_time, stamp, time.time())
+                ).lastrowid
+            else:
+                run_id, = row
+                self._conn.execute(
+                    'DELETE FROM metrics WHERE run_id = ?', (run_id,)
+                )
+                self._conn.execute(
+                    'UPDATE runs SET report = ?, run_time = ?, stamp = ?, '
+                    'ingested_at = ? WHERE run_id = ?',
+                    (report, run_time, stamp, time.time(), run_id)
+                )
+            self._conn.executemany(
+                'INSERT INTO metrics '
+                '(run_id, stage, sample, metric, value, status) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (run_id, stage, m.sample, m.name, m.value, m.status)
+                    for stage, m in stage_metrics
+                )
+            )
+
+    def num_runs(self):
+        return self._conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def metric_names(self):
+        """List the (stage, metric) of all the numeric metrics stored."""
+        return self._conn.execute(
+            'SELECT DISTINCT stage, metric FROM metrics '
+            'WHERE value IS NOT NULL ORDER BY stage, metric'
+        ).fetchall()
+
+    def trend(self, stage, metric):
+        """Per-run summary of the metric over the samples, by run time."""
+        rows = self._conn.execute(
+            'SELECT r.job_path, r.run_time, COUNT(m.value), '
+            'AVG(m.value), MIN(m.value), MAX(m.value) '
+            'FROM metrics AS m JOIN runs AS r ON r.run_id = m.run_id '
+            'WHERE m.stage = ? AND m.metric = ? AND m.value IS NOT NULL '
+            'GROUP BY m.run_id ORDER BY r.run_time',
+            (stage, metric)
+        )
+        return [TrendPoint(*row) for row in rows]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def metric_stages(report):
+    """Tool stages of the report publishing metrics."""
+    return [
+        stage for stage in report.tool_stages
+        if type(stage).metrics is not Stage.metrics
+    ]
+
+
+def compute_run_stamp(report, stages):
+    """Digest of the analysis info and the input files of the stages."""
+    digest = hashlib.sha1()
+    pths = [report.analysis_info.locate_info_file()]
+    for stage in stages:
+        pths.extend(sorted(stage.input_paths()))
+    for pth in pths:
+        pth_stat = pth.stat()
+        digest.update('{!s}\0{}\0{}\n'.format(
+            pth, pth_stat.st_mtime_ns, pth_stat.st_size
+        ).encode('utf8'))
+    return digest.hexdigest()
+
+
+def ingest_report(report, store: MetricsStore, force=False) -> bool:
+    """Ingest the metrics of the report's job into the store.
+
+    Stages already parsed by the report are not parsed again, except in
+    low-memory mode where only their summaries are kept. The run is
+    skipped if it is unchanged since the last ingestion, unless
+    ``force`` is set.
+
+    Returns
+    -------
+    Whether the run has been ingested.
+    """
+    job_path = strify_path(report.analysis_info.result_root)
+    stages = metric_stages(report)
+    stamp = compute_run_stamp(report, stages)
+    if not force and store.run_stamp(job_path) == stamp:
+        logger.info('Metrics of job {} are up to date'.format(job_path))
+        return False
+
+    stage_metrics = []
+    for stage in stages:
+        data_info = report.data_info.get(stage.name)
+        if data_info is None or report.low_memory:
+            logger.info('Parsing stage {} for metrics'.format(stage.name))
+            data_info = stage.parse(report.analysis_info)
+        stage_metrics.extend(
+            (stage.name, metric) for metric in stage.metrics(data_info)
+        )
+    run_time = report.analysis_info.locate_info_file().stat().st_mtime
+    store.replace_run(
+        job_path, type(report).__name__, run_time, stamp, stage_metrics
+    )
+    logger.info('Ingested {} metrics of job {}'.format(
+        len(stage_metrics), job_path
+    ))
+    return True
@@ -0,0 +1,291 @@
+"""Writers of the report output.
+
+The report is written either to a folder or straight into a tar or zip
+archive, without an intermediate folder. Writers take the paths under the
+report root the stages compute, so stages never need to know the output
+type.
+"""
+from collections import OrderedDict
+import io
+from pathlib import Path
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from . import create_logger
+from .archive import is_local_path
+from .utils import as_path, strify_path
+
+logger = create_logger(__name__)
+
+ARCHIVE_SUFFIXES = ['.tar.gz', '.tgz', '.tar', '.zip']
+
+# Files stored in zip archives without recompressing
+COMPRESSED_SUFFIXES = [
+    '.gz', '.bz2', '.xz', '.zip', '.bam',
+    '.png', '.jpg', '.jpeg', '.gif',
+    '.woff', '.woff2',
+]
+
+
+class ReportWriter:
+    """Write the report files under the report root.
+
+    Subclasses implement :py:meth:`write_bytes` and :py:meth:`copy_file`.
+    Source files may be members of a job archive, see
+    :py:mod:`bc_report.archive`, which are streamed rather than copied by
+    path. Writers are context managers; the output is complete after
+    :py:meth:`close`.
+    """
+
+    def __init__(self, report_root):
+        self.report_root = Path(report_root)
+
+    def member_name(self, pth):
+        """Path of the file relative to the report root."""
+        return Path(pth).relative_to(self.report_root).as_posix()
+
+    def write_bytes(self, pth, content: bytes):
+        raise NotImplementedError
+
+    def write_text(self, pth, text: str):
+        self.write_bytes(pth, text.encode('utf8'))
+
+    def copy_file(self, src, pth):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DirectoryWriter(ReportWriter):
+    """Write the report files to the report folder."""
+
+    def _prepare(self, pth):
+        pth = Path(pth)
+        if not pth.parent.exists():
+            pth.parent.mkdir(parents=True, exist_ok=True)
+        return pth
+
+    def write_bytes(self, pth, content):
+        with self._prepare(pth).open('wb') as f:
+            f.write(content)
+
+    def copy_file(self, src, pth):
+        if is_local_path(src):
+            shutil.copy(strify_path(src), strify_path(self._prepare(pth)))
+            return
+        with src.open('rb') as src_f, self._prepare(pth).open('wb') as f:
+            shutil.copyfileobj(src_f, f)
+
+
+class MemoryWriter(ReportWriter):
+    """Keep the report files in memory, writing nothing to disk.
+
+    Written files, such as pages and chart data, are kept as bytes by their
+    paths relative to the report root. Copied files are only mapped to their
+    source files, which are read when requested.
+    """
+
+    def __init__(self, report_root='report'):
+        super().__init__(report_root)
+        self.files = OrderedDict()
+        self.static_files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write_bytes(self, pth, content):
+        with self._lock:
+            self.files[self.member_name(pth)] = content
+
+    def copy_file(self, src, pth):
+        with self._lock:
+            self.static_files[self.member_name(pth)] = src
+
+    def update(self, other: 'MemoryWriter'):
+        """Add the files of the other writer of the same report root."""
+        with self._lock:
+            self.files.update(other.files)
+            self.static_files.update(other.static_files)
+
+    def read_bytes(self, name):
+        """Content of the file by its path relative to the report root.
+
+        Raises :py:class:`KeyError` if the report has no such file.
+        """
+        if name in self.files:
+            return self.files[name]
+        return as_path(self.static_files[name]).read_bytes()
+
+    def pages(self):
+        """Iterate the (name, HTML) of the rendered pages."""
+        for name, content in self.files.items():
+            if name.endswith('.html'):
+                yield name, content.decode('utf8')
+
+
+class ArchiveWriter(ReportWriter):
+    """Stream the report files into an archive.
+
+    Members are placed under a top folder named after the report root, so
+    the archive extracts to the report folder.
+    """
+
+    def member_name(self, pth):
+        return Path(
+            self.report_root.name, super().member_name(pth)
+        ).as_posix()
+
+
+class TarWriter(ArchiveWriter):
+    """Stream the report files into a tar archive.
+
+    The archive is gzip compressed as a whole by the given level, or not
+    compressed if the level is ``None``.
+    """
+
+    def __init__(self, report_root, archive_pth, compress_level=6):
+        super().__init__(report_root)
+        if compress_level is None:
+            self._tar = tarfile.open(strify_path(archive_pth), 'w')
+        else:
+            self._tar = tarfile.open(
+                strify_path(archive_pth), 'w:gz', compresslevel=compress_level
+            )
+        self._lock = threading.Lock()
+
+    def write_bytes(self, pth, content):
+        info = tarfile.TarInfo(self.member_name(pth))
+        info.size = len(content)
+        info.mtime = time.time()
+        info.mode = 0o644
+        with self._lock:
+            self._tar.addfile(info, io.BytesIO(content))
+
+    def copy_file(self, src, pth):
+        if is_local_path(src):
+            with self._lock:
+                self._tar.add(
+                    strify_path(src), arcname=self.member_name(pth),
+                    recursive=False
+                )
+            return
+        src_stat = src.stat()
+        info = tarfile.TarInfo(self.member_name(pth))
+        info.size = src_stat.st_size
+        info.mtime = src_stat.st_mtime
+        info.mode = 0o644
+        with src.open('rb') as src_f, self._lock:
+            self._tar.addfile(info, src_f)
+
+    def close(self):
+        self._tar.close()
+
+
+class ZipWriter(ArchiveWriter):
+    """Stream the report files into a zip archive.
+
+    Files already compressed, such as images, fonts, and gzip files, are
+    stored as is; the others are deflated by the given level.
+    """
+
+    def __init__(self, report_root, archive_pth, compress_level=6):
+        super().__init__(report_root)
+        zip_kwargs = {}
+        if sys.version_info >= (3, 7):
+            zip_kwargs['compresslevel'] = compress_level
+        elif compress_level is not None:
+            logger.warning(
+                'Zip compression level requires Python 3.7+, '
+                'the default level is used'
+            )
+        self._zip = zipfile.ZipFile(
+            strify_path(archive_pth), 'w', zipfile.ZIP_DEFLATED,
+            **zip_kwargs
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def compress_type(pth):
+        if Path(pth).suffix.lower() in COMPRESSED_SUFFIXES:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def write_bytes(self, pth, content):
+        info = zipfile.ZipInfo(
+            self.member_name(pth), time.localtime(time.time())[:6]
+        )
+        info.compress_type = self.compress_type(pth)
+        info.external_attr = 0o644 << 16
+        with self._lock:
+            self._zip.writestr(info, content)
+
+    def copy_file(self, src, pth):
+        if is_local_path(src):
+            with self._lock:
+                self._zip.write(
+                    strify_path(src), self.member_name(pth),
+                    compress_type=self.compress_type(pth)
+                )
+            return
+        src_stat = src.stat()
+        info = zipfile.ZipInfo(
+            self.member_name(pth), time.localtime(src_stat.st_mtime)[:6]
+        )
+        info.compress_type = self.compress_type(pth)
+        info.external_attr = 0o644 << 16
+        # Known size lets zipfile decide on ZIP64 before streaming
+        info.file_size = src_stat.st_size
+        with src.open('rb') as src_f, self._lock, \
+                self._zip.open(info, 'w') as f:
+            shutil.copyfileobj(src_f, f)
+
+    def close(self):
+        self._zip.close()
+
+
+def archive_report_root(archive_pth):
+    """Report root of the archive, named after the archive without suffix.
+
+    Examples
+    --------
+
+        >>> archive_report_root(Path('out/report.tar.gz'))
+        PosixPath('report')
+
+    """
+    name = Path(archive_pth).name
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return Path(name[:-len(suffix)])
+    raise ValueError(
+        'Unknown archive type of {}, supported suffixes are {}'
+        .format(archive_pth, ARCHIVE_SUFFIXES)
+    )
+
+
+def open_archive_writer(
+    archive_pth, compress_level=6, dest_pth=None
+) -> ReportWriter:
+    """Open the tar or zip writer by the suffix of the archive path.
+
+    A ``.tar`` archive is not compressed regardless of the level. The
+    archive is written to ``dest_pth`` instead when given, such as a
+    temporary file to be moved over the archive path afterwards.
+    """
+    report_root = archive_report_root(archive_pth)
+    if dest_pth is None:
+        dest_pth = archive_pth
+    name = Path(archive_pth).name
+    if name.endswith('.zip'):
+        return ZipWriter(report_root, dest_pth, compress_level)
+    if name.endswith('.tar'):
+        compress_level = None
+    return TarWriter(report_root, dest_pth, compress_level)
@@ -0,0 +1,123 @@
+"""Preflight check of the stage inputs before generating a report.
+
+A missing or truncated input of a late sample used to surface only after
+the earlier stages had spent minutes parsing. Stages list the files they
+will read by :py:meth:`Stage.expected_inputs
+<bc_report.report.Stage.expected_inputs>`, and :py:func:`preflight` checks
+all of them at once, so every problem is reported before any output is
+written.
+
+The check reads metadata only: each stage locates its result folder, each
+folder of expected files is listed by a single :py:func:`os.scandir` call,
+and the zip files whose members are expected have their central directory
+read. All of them run concurrently across the stages.
+"""
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import zipfile
+from . import create_logger
+from .utils import scan_dir
+
+logger = create_logger(__name__)
+
+ExpectedInput = namedtuple('ExpectedInput', ['path', 'members'])
+"""Input file a stage reads, and the members the zip file must contain."""
+ExpectedInput.__new__.__defaults__ = ((),)
+
+InputProblem = namedtuple('InputProblem', ['stage', 'path', 'message'])
+"""Problem of an input of the stage. The path is ``None`` if the stage
+cannot locate its inputs at all."""
+
+
+def _stage_inputs(stage, analysis_info):
+    try:
+        return stage.expected_inputs(analysis_info), None
+    except (OSError, ValueError) as e:
+        return [], InputProblem(stage.name, None, str(e))
+
+
+def _missing_members(expected):
+    """Problem of the zip file of the expected members, or ``None``."""
+    try:
+        # Zip files inside a job archive are read from the member file
+        with expected.path.open('rb') as f, zipfile.ZipFile(f) as zipf:
+            names = set(zipf.namelist())
+    except (OSError, zipfile.BadZipFile) as e:
+        return 'is not a readable zip file: {}'.format(e)
+    missing = [m for m in expected.members if m not in names]
+    if missing:
+        return 'misses zip members {}'.format(', '.join(missing))
+    return None
+
+
+def _file_problems(stage, inputs, folder_stats):
+    """Problems of the stage's missing or empty input files, and the inputs
+    whose zip members remain to be checked."""
+    problems = []
+    zip_checks = []
+    for expected in inputs:
+        stat = folder_stats[expected.path.parent].get(expected.path.name)
+        if stat is None:
+            problems.append(
+                InputProblem(stage.name, expected.path, 'is missing')
+            )
+        elif not stat.st_size:
+            problems.append(
+                InputProblem(stage.name, expected.path, 'is empty')
+            )
+        elif expected.members:
+            zip_checks.append((stage, expected))
+    return problems, zip_checks
+
+
+def preflight(report, stages=None, workers=None) -> List[InputProblem]:
+    """Check the expected inputs of the tool stages, or of the given ones.
+
+    Inputs are checked by ``workers`` threads, the report's
+    :py:attr:`~bc_report.report.Report.io_workers` by default.
+
+    Returns
+    -------
+    List of :py:class:`InputProblem` in the stage order. Empty if all the
+    inputs are found.
+    """
+    stages = list(report.tool_stages if stages is None else stages)
+    analysis_info = report.analysis_info
+    problems = []
+    with ThreadPoolExecutor(workers or report.io_workers) as executor:
+        stage_inputs = list(executor.map(
+            lambda stage: _stage_inputs(stage, analysis_info), stages
+        ))
+
+        # List every folder of the expected files once
+        folders = OrderedDict()
+        for inputs, _ in stage_inputs:
+            for expected in inputs:
+                folders.setdefault(expected.path.parent, None)
+        folder_stats = dict(zip(folders, executor.map(scan_dir, folders)))
+
+        zip_checks = []
+        for stage, (inputs, stage_problem) in zip(stages, stage_inputs):
+            if stage_problem is not None:
+                problems.append(stage_problem)
+            file_problems, stage_zip_checks = _file_problems(
+                stage, inputs, folder_stats
+            )
+            problems.extend(file_problems)
+            zip_checks.extend(stage_zip_checks)
+        for (stage, expected), message in zip(zip_checks, executor.map(
+            lambda check: _missing_members(check[1]), zip_checks
+        )):
+            if message is not None:
+                problems.append(
+                    InputProblem(stage.name, expected.path, message)
+                )
+
+    # Keep the stage order, which the zip checks appended after the files
+    stage_order = {stage.name: i for i, stage in enumerate(stages)}
+    problems.sort(key=lambda p: stage_order[p.stage])
+    logger.info('Preflight checked {} stages, found {} problems'.format(
+        len(stages), len(problems)
+    ))
+    return problems
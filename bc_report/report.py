@@ -1,20 +1,34 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from typing import List
+import hashlib
+import heapq
+import pickle
 import re
+import threading
 import jinja2
 
 from . import create_logger
+from .assets import build_assets
+from .fragments import FragmentCache, FragmentCacheExtension
 from .info import AnalysisInfo
+from .output import DirectoryWriter, MemoryWriter, ReportWriter
 from .utils import (
-    merged_copytree,
+    merged_file_map,
     discover_file_by_patterns,
-    copy,
-    strify_path, humanfmt, tojson
+    get_cache_dir, pack_arrays, path_digest, prefetch, scan_dir,
+    strify_path, humanfmt, format_size, tojson
 )
 
 logger = create_logger(__name__)
 
 
+FileLink = namedtuple('FileLink', ['name', 'url', 'exists', 'size', 'mtime'])
+RawOutput = namedtuple('RawOutput', ['links', 'missing', 'extra'])
+
+
 class Stage:
 
     template_entrances = ['stage.html']
@@ -25,6 +39,24 @@ class Stage:
 
     result_folder_name = ''
 
+    input_patterns = []
+    """(List of str) Glob patterns of the input files in the result folder."""
+
+    depends_on = []
+    """(List of str) Names of the stages whose parsed data the stage uses."""
+
+    data_dirs = []
+    """(List of str) Report folders of the data files the stage writes
+    besides its pages, such as a search index fetched by every page."""
+
+    # Number of folders listed concurrently when collecting file links
+    SCAN_WORKERS = 8
+
+    # Report folder of the chart data files exported by export_data
+    DATA_EXPORT_DIR = 'data/charts'
+    # Pages of a stage may be rendered concurrently
+    _export_lock = threading.Lock()
+
     def __init__(self, report: 'Report'):
         self.report = report
         self._setup_jinja2()
@@ -39,15 +71,143 @@ class Stage:
             analysis_info=self.report.analysis_info,
         )
 
+    @staticmethod
+    def page_name(tpl_name):
+        # remove folder structure in template name
+        return tpl_name.rsplit('/', 1)[1]
+
+    def page_names(self) -> List[str]:
+        """File names of the pages the stage renders."""
+        return [self.page_name(tpl) for tpl in self.template_entrances]
+
+    def renders(self, name) -> bool:
+        """Whether the report file is one of the stage's pages or data."""
+        return name in self.page_names() or any(
+            name.startswith(data_dir + '/') for data_dir in self.data_dirs
+        )
+
+    def is_page_requested(self, name) -> bool:
+        """Whether the page is to be rendered, see
+        :py:attr:`Report.requested_pages`."""
+        requested = self.report.requested_pages
+        return requested is None or name in requested
+
     def render(self, data_info, report_root):
         for tpl_name in self.template_entrances:
+            if not self.is_page_requested(self.page_name(tpl_name)):
+                continue
             tpl = self._env.get_template(tpl_name)
             html = tpl.render(self.get_context_data(data_info))
-            # remove folder structure in template name
-            tpl_report_path = report_root / tpl_name.rsplit('/', 1)[1]
+            tpl_report_path = report_root / self.page_name(tpl_name)
             logger.debug('writing template to %s' % tpl_report_path.as_posix())
-            with tpl_report_path.open('w') as f:
-                f.write(html)
+            self.report.writer.write_text(tpl_report_path, html)
+
+    def write_report_file(self, report_root, rel_path, content):
+        """Write an extra file, such as chart data, under the report folder.
+
+        The content is either text or bytes.
+        """
+        report_pth = report_root / rel_path
+        logger.debug('writing report file to %s' % report_pth.as_posix())
+        if isinstance(content, bytes):
+            self.report.writer.write_bytes(report_pth, content)
+        else:
+            self.report.writer.write_text(report_pth, content)
+
+    def export_data(self, data, precision=None):
+        """Write the chart data to a JSON file and return its URL.
+
+        Pages fetch the file when the chart becomes visible instead of
+        parsing the data inline. Files are named by the digest of their
+        content, so the same data is written once and shared by all the
+        charts and pages referring to it. Floats are rounded to
+        ``precision`` decimal places if given.
+
+        If the report's ``binary_series`` is set, the numeric NumPy arrays
+        are written to a sidecar ``.bin`` file of the same name instead,
+        see :py:func:`bc_report.utils.pack_arrays`, and the JSON file is
+        ``{"$buffer": <file name>, "$data": <data>}``. Their precision is
+        then that of float32 rather than ``precision``. ``ChartData.fetch``
+        of ``chart_data.js`` loads both forms.
+        """
+        buffer = None
+        if self.report.binary_series:
+            data, buffer = pack_arrays(data)
+        content = tojson(data, precision=precision)
+        digest = hashlib.sha1(content.encode('utf8'))
+        if buffer:
+            digest.update(buffer)
+        digest = digest.hexdigest()[:16]
+        rel_path = '{}/{}.json'.format(self.DATA_EXPORT_DIR, digest)
+        with self._export_lock:
+            if rel_path in self.report.exported_data:
+                return rel_path
+            self.report.exported_data.add(rel_path)
+        if buffer:
+            buffer_name = '{}.bin'.format(digest)
+            content = tojson(
+                OrderedDict([('$buffer', buffer_name), ('$data', data)]),
+                precision=precision
+            )
+            self.write_report_file(
+                self.report.report_root,
+                '{}/{}'.format(self.DATA_EXPORT_DIR, buffer_name), buffer
+            )
+        self.write_report_file(self.report.report_root, rel_path, content)
+        return rel_path
+
+    def summarize(self, data_info):
+        """Data published to the summary stages in low-memory mode.
+
+        Once the stage is rendered, only its summary is kept in memory.
+        Return the full data, the default, to have it spilled to disk and
+        loaded back when a summary stage depending on it renders.
+        """
+        return data_info
+
+    def metrics(self, data_info):
+        """Per-sample QC metrics of the parsed data for the metrics store.
+
+        Returns an iterable of :py:class:`bc_report.metrics.Metric`. Stages
+        without metrics, the default, are not parsed for the store.
+        """
+        return []
+
+    def prefetch(self, items, load):
+        """Load the input items concurrently, yielding them in order.
+
+        The concurrency is set by :py:attr:`Report.io_workers`, see
+        :py:func:`bc_report.utils.prefetch`.
+        """
+        return prefetch(items, load, workers=self.report.io_workers)
+
+    def dependencies(self) -> List[str]:
+        """Names of the stages this stage depends on."""
+        return list(self.depends_on)
+
+    def input_paths(self) -> List[Path]:
+        """List the input files of the stage by its input patterns."""
+        if not self.input_patterns:
+            return []
+        return discover_file_by_patterns(
+            self._locate_result_folder(), self.input_patterns
+        )
+
+    def expected_inputs(self, analysis_info: AnalysisInfo) -> list:
+        """List the input files :py:meth:`parse` will read.
+
+        Returns a list of :py:class:`bc_report.preflight.ExpectedInput`,
+        checked by :py:func:`bc_report.preflight.preflight` before the
+        report is generated. Stages without expected inputs, the default,
+        are not checked.
+        """
+        return []
+
+    def changed_since(self, timestamp) -> bool:
+        """Whether any input file is modified after the POSIX timestamp."""
+        return any(
+            pth.stat().st_mtime > timestamp for pth in self.input_paths()
+        )
 
     def copy_static(self, report_root):
         result_dir = self._locate_result_folder()
@@ -69,14 +229,36 @@ class Stage:
         self._report_loader = jinja2.FileSystemLoader(_template_paths)
         self._env = jinja2.Environment(
             loader=self._report_loader,
-            extensions=['jinja2.ext.with_'],
+            extensions=['jinja2.ext.with_', FragmentCacheExtension],
         )
+        self._env.get_fragment_cache = lambda: self.report.fragment_cache
         self._env.globals['static'] = self._template_static_path
+        self._env.globals['static_bundle'] = self._template_static_bundle
         self._env.globals['humanfmt'] = humanfmt
+        self._env.globals['format_size'] = format_size
         self._env.filters['tojson'] = tojson
+        self._env.filters['data_url'] = self.export_data
 
     def _template_static_path(self, *path_parts):
-        return Path('static', *path_parts).as_posix()
+        rel_path = Path(*path_parts).as_posix()
+        rel_path = self.report.asset_manifest.get(rel_path, rel_path)
+        return Path('static', rel_path).as_posix()
+
+    def _template_static_bundle(self, bundle_name):
+        """List the script URLs of the bundle.
+
+        Production assets have the whole bundle in one file; otherwise the
+        scripts of the bundle are listed one by one.
+        """
+        if bundle_name in self.report.bundle_manifest:
+            return [
+                Path('static', self.report.bundle_manifest[bundle_name])
+                .as_posix()
+            ]
+        return [
+            self._template_static_path(rel_path)
+            for rel_path in self.report.asset_bundles[bundle_name]
+        ]
 
     def _locate_result_folder(self):
         if not self.result_folder_name:
@@ -103,20 +285,65 @@ class Stage:
             )
         return stage_result_path[0]
 
+    def collect_raw_output_links(self, filenames, subfolders=('',)):
+        """Link to the expected output files under the stage result folder.
+
+        Each subfolder is listed by a single :py:func:`os.scandir` call and
+        the subfolders are listed concurrently. So the files are checked
+        without a ``stat`` call per file, which is slow on network storage.
+
+        Returns
+        -------
+        OrderedDict of subfolder to :py:class:`RawOutput`, whose links
+        carry the existence, size, and modified time of each expected file.
+        Files found but not expected are listed as extra.
+        """
+        result_dir = self._locate_result_folder()
+        with ThreadPoolExecutor(self.SCAN_WORKERS) as executor:
+            folder_stats = executor.map(
+                scan_dir, [result_dir / subfolder for subfolder in subfolders]
+            )
+            raw_output = OrderedDict()
+            for subfolder, stats in zip(subfolders, folder_stats):
+                url_root = Path('..', 'result', result_dir.name, subfolder)
+                links = OrderedDict()
+                for filename in filenames:
+                    stat = stats.get(filename)
+                    links[filename] = FileLink(
+                        name=filename,
+                        url=(url_root / filename).as_posix(),
+                        exists=stat is not None,
+                        size=stat.st_size if stat else None,
+                        mtime=(
+                            datetime.fromtimestamp(stat.st_mtime)
+                            if stat else None
+                        ),
+                    )
+                raw_output[subfolder] = RawOutput(
+                    links=links,
+                    missing=[f for f in filenames if f not in stats],
+                    extra=sorted(f for f in stats if f not in links),
+                )
+        for subfolder, output in raw_output.items():
+            if output.missing:
+                logger.warning(
+                    'Stage {} misses output files {} under {!s}'
+                    .format(self.name, output.missing, result_dir / subfolder)
+                )
+        return raw_output
+
     def copy_static_joint(self, result_dir, report_root):
         for desc in self.embed_result_joint:
             src_root = result_dir / desc['src']
             dest_root = report_root / 'static' / desc['dest']
-            if not dest_root.exists():
-                dest_root.mkdir(parents=True)
 
             file_list = discover_file_by_patterns(src_root, desc['patterns'])
             for fp in file_list:
-                copy(fp, dest_root)
+                self.report.writer.copy_file(fp, dest_root / fp.name)
 
     @staticmethod
     def copy_static_grouped(
-        result_root, report_root,
+        writer: ReportWriter, result_root, report_root,
         src_rel_pth, dest_rel_pth, file_patterns, groups
     ):
         all_src_root = result_root / src_rel_pth
@@ -124,32 +351,32 @@ class Stage:
         for grp in groups:
             grp_src_root = all_src_root / grp
             grp_dest_root = all_dest_root / dest_rel_pth / grp
-            grp_dest_root.mkdir(parents=True)
 
             file_list = discover_file_by_patterns(grp_src_root, file_patterns)
             for fp in file_list:
-                copy(fp, grp_dest_root)
+                writer.copy_file(fp, grp_dest_root / fp.name)
 
     @staticmethod
     def batch_copy_static_grouped(
-        result_dir, report_root, desc_sources, groups=None
+        writer: ReportWriter, result_dir, report_root, desc_sources,
+        groups=None
     ):
         for desc in desc_sources:
             Stage.copy_static_grouped(
-                result_dir, report_root,
-                desc['src'], desc['dest'], groups
+                writer, result_dir, report_root,
+                desc['src'], desc['dest'], desc['patterns'], groups
             )
 
     def copy_static_per_condition(self, result_dir, report_root):
         self.batch_copy_static_grouped(
-            result_dir, report_root,
+            self.report.writer, result_dir, report_root,
             desc_sources=self.embed_result_per_condition,
             groups=self.report.analysis_info.conditions.keys()
         )
 
     def copy_static_per_sample(self, result_dir, report_root):
         self.batch_copy_static_grouped(
-            result_dir, report_root,
+            self.report.writer, result_dir, report_root,
             desc_sources=self.embed_result_per_sample,
             groups=self.report.analysis_info.samples.keys()
         )
@@ -157,6 +384,14 @@ class Stage:
 
 class SummaryStage(Stage):
 
+    depends_on = None
+    """Depend on all the tool stages unless the stage names are given."""
+
+    def dependencies(self):
+        if self.depends_on is None:
+            return [stage.name for stage in self.report.tool_stages]
+        return super().dependencies()
+
     def get_context_data(self, data_info):
         context = super().get_context_data(data_info)
         context['joint_data_info'] = context['data_info']
@@ -167,6 +402,27 @@ class SummaryStage(Stage):
         return self.report.analysis_info.result_root
 
 
+class SpilledStageData:
+    """Stage data pickled to disk in low-memory mode."""
+
+    __slots__ = ['path']
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @classmethod
+    def dump(cls, data, path: Path):
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+        with path.open('wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return cls(path)
+
+    def load(self):
+        with self.path.open('rb') as f:
+            return pickle.load(f)
+
+
 class Report:
 
     stage_classes = []
@@ -174,50 +430,414 @@ class Report:
 
     static_roots = []
 
-    def __init__(self, analysis_dir):
-        """Initiate a new report based on given job result."""
+    asset_bundles = OrderedDict([
+        ('base', [
+            'js/vendors/jquery.js',
+            'js/vendors/bootstrap.js',
+            'js/chart_data.js',
+        ]),
+        ('highcharts', [
+            'js/vendors/highcharts/highcharts.js',
+            'js/vendors/highcharts/canvas-tools.js',
+            'js/vendors/highcharts/exporting.js',
+            'js/vendors/highcharts/highcharts-export-clientside.js',
+        ]),
+    ])
+    """Scripts concatenated into one file in production asset mode."""
+
+    ASSET_MODES = ['development', 'production']
+
+    IO_WORKERS = 8
+    """Default number of input files stages read concurrently."""
+
+    MEMORY_REPORT_ROOT = Path('report')
+    """Report root of the files rendered by :py:meth:`render_in_memory`."""
+
+    FRAGMENT_CACHE_SIZE = 64 * 1024 ** 2
+    """Size limit in bytes of the rendered template fragments cached across
+    reports."""
+
+    def __init__(
+        self, analysis_dir, asset_mode='development', low_memory=False,
+        io_workers=None, binary_series=False, fragment_cache=False
+    ):
+        """Initiate a new report based on given job result.
+
+        In production asset mode, the static scripts and stylesheets are
+        bundled, minified, and renamed by their content hash. In low-memory
+        mode, each tool stage is rendered right after parsing and then only
+        its summary is kept, see :py:meth:`parse_and_render`. Stages read
+        their input files by ``io_workers`` threads, :py:attr:`IO_WORKERS`
+        by default. With ``binary_series``, numeric chart series are
+        exported as binary buffers, see :py:meth:`Stage.export_data`. With
+        ``fragment_cache``, rendered per-sample table rows are cached on
+        disk across reports, see :py:mod:`bc_report.fragments`.
+        """
         logger.debug(
             "New report {} object has been initiated"
             .format(type(self).__name__)
         )
-        self.analysis_info = AnalysisInfo(analysis_dir)
+        analysis_info = AnalysisInfo(analysis_dir)
+        self._setup(
+            analysis_info,
+            get_cache_dir(path_digest(analysis_info.result_root)),
+            asset_mode=asset_mode, low_memory=low_memory,
+            io_workers=io_workers, binary_series=binary_series,
+            fragment_cache=fragment_cache,
+        )
+
+    def _setup(
+        self, analysis_info, cache_root, asset_mode='development',
+        low_memory=False, io_workers=None, binary_series=False,
+        fragment_cache=False
+    ):
+        """Set the report state and initiate the stages.
+
+        Reports not of a single job, which do not call
+        :py:meth:`__init__`, set up their state by this method too.
+        """
+        if asset_mode not in self.ASSET_MODES:
+            raise ValueError(
+                "Unknown asset mode {}, choose from {}"
+                .format(asset_mode, self.ASSET_MODES)
+            )
+        self.analysis_info = analysis_info
+        self.cache_root = cache_root
         self.report_root = None
+        self.writer = None
+        self.asset_mode = asset_mode
+        self.low_memory = low_memory
+        self.io_workers = io_workers or self.IO_WORKERS
+        self.binary_series = binary_series
+        self.asset_manifest = {}
+        self.bundle_manifest = {}
+        self.exported_data = set()
+        # Pages rendered by render_in_memory, or None for all
+        self.requested_pages = None
+        self._memory_assets = None
+        self.fragment_cache = (
+            self.make_fragment_cache() if fragment_cache else None
+        )
         self._stages = self.initiate_stages()
         self.data_info = {
             stage.name: None
             for stage in self.tool_stages
         }
 
+    def make_fragment_cache(self):
+        """Fragment cache shared by the reports, see
+        :py:mod:`bc_report.fragments`."""
+        return FragmentCache(
+            get_cache_dir('fragments'), self.FRAGMENT_CACHE_SIZE
+        )
+
     def initiate_stages(self) -> List[Stage]:
         return [
             stage_cls(self)
             for stage_cls in self.stage_classes
         ]
 
-    def parse(self, analysis_info: AnalysisInfo):
+    def parse(self, analysis_info: AnalysisInfo, stages=None):
+        """Parse the tool stages, or only the given ones."""
         for stage in self.tool_stages:
+            if stages is not None and stage not in stages:
+                continue
             logger.info('Parsing stage %s' % stage.name)
             self.data_info[stage.name] = stage.parse(analysis_info)
 
-    def generate(self, report_dir: Path):
+    def stage_graph(self):
+        """Map each stage name to the names of the stages it depends on."""
+        names = [stage.name for stage in self.all_stages]
+        graph = OrderedDict()
+        for stage in self.all_stages:
+            deps = stage.dependencies()
+            unknown = [dep for dep in deps if dep not in names]
+            if unknown:
+                raise ValueError(
+                    'Stage {} depends on unknown stages {}'
+                    .format(stage.name, unknown)
+                )
+            graph[stage.name] = deps
+        return graph
+
+    def sorted_stages(self) -> List[Stage]:
+        """Sort the stages topologically by Kahn's algorithm.
+
+        Stages free to run are taken in their order in
+        :py:attr:`stage_classes`, so the order is stable.
+        """
+        graph = self.stage_graph()
+        order = {name: i for i, name in enumerate(graph)}
+        stages = {stage.name: stage for stage in self.all_stages}
+        num_deps = {name: len(set(deps)) for name, deps in graph.items()}
+        dependents = {name: [] for name in graph}
+        for name, deps in graph.items():
+            for dep in set(deps):
+                dependents[dep].append(name)
+
+        ready = [order[name] for name, n in num_deps.items() if n == 0]
+        heapq.heapify(ready)
+        names = list(graph)
+        sorted_names = []
+        while ready:
+            name = names[heapq.heappop(ready)]
+            sorted_names.append(name)
+            for dependent in dependents[name]:
+                num_deps[dependent] -= 1
+                if num_deps[dependent] == 0:
+                    heapq.heappush(ready, order[dependent])
+        if len(sorted_names) < len(names):
+            raise ValueError(
+                'Stages have circular dependencies: {}'.format(
+                    [name for name in names if name not in sorted_names]
+                )
+            )
+        return [stages[name] for name in sorted_names]
+
+    def select_stages(self, only=None, since=None):
+        """Select the stages to rebuild and the stages to parse.
+
+        Stages named by ``only`` or having input files modified after the
+        ``since`` POSIX timestamp are rebuilt together with all the stages
+        depending on them. Stages they depend on are parsed but not
+        rendered. All the stages are rebuilt if neither is given, or if the
+        analysis info has changed since.
+
+        Returns
+        -------
+        Tuple of the sets of stages to rebuild and to parse.
+        """
+        all_stages = set(self.all_stages)
+        if only is None and since is None:
+            return all_stages, all_stages
+        stages = {stage.name: stage for stage in self.all_stages}
+
+        if since is not None and (
+            self.analysis_info.locate_info_file().stat().st_mtime > since
+        ):
+            logger.info('Analysis info changed, rebuilding all stages')
+            return all_stages, all_stages
+
+        selected = set()
+        if only is not None:
+            unknown = [name for name in only if name not in stages]
+            if unknown:
+                raise ValueError(
+                    'Unknown stages {}, choose from {}'
+                    .format(unknown, list(stages))
+                )
+            selected.update(only)
+        if since is not None:
+            selected.update(
+                stage.name for stage in self.tool_stages
+                if stage.changed_since(since)
+            )
+
+        graph = self.stage_graph()
+        dependents = {name: set() for name in graph}
+        for name, deps in graph.items():
+            for dep in deps:
+                dependents[dep].add(name)
+        rebuild = self._graph_closure(selected, dependents)
+        parse = self._graph_closure(rebuild, graph)
+        logger.info('Rebuilding stages {}'.format(sorted(rebuild)))
+        return (
+            {stages[name] for name in rebuild},
+            {stages[name] for name in parse},
+        )
+
+    @staticmethod
+    def _graph_closure(names, edges):
+        """Names reachable from the given names along the edges."""
+        reached = set(names)
+        pending = list(names)
+        while pending:
+            for next_name in edges[pending.pop()]:
+                if next_name not in reached:
+                    reached.add(next_name)
+                    pending.append(next_name)
+        return reached
+
+    def generate(
+        self, report_dir: Path, writer: ReportWriter = None,
+        only=None, since=None
+    ):
+        """Generate the report under the report folder.
+
+        The report files are written by the given writer, such as one
+        streaming them into an archive, or to the folder by default.
+
+        Given ``only`` stage names or a ``since`` POSIX timestamp, only the
+        affected stages are rebuilt in the existing report folder, see
+        :py:meth:`select_stages`. Static files are copied on full builds.
+        """
         self.report_root = report_dir
-        logger.info('Parsing result')
-        self.parse(self.analysis_info)
-        logger.info('Rendering report')
-        self.render_report()
-        logger.info('Copying static files')
-        self.copy_static()
-
-    def render_report(self):
-        """Render and output the report"""
-        for stage in self.tool_stages:
-            stage.render(self.data_info[stage.name], self.report_root)
+        self.writer = writer or DirectoryWriter(report_dir)
+        rebuild, parse = self.select_stages(only, since)
+        if self.asset_mode == 'production':
+            logger.info('Building production assets')
+            self.build_assets()
+        if self.low_memory:
+            logger.info('Parsing and rendering report stage by stage')
+            self.parse_and_render(rebuild, parse)
+        else:
+            logger.info('Parsing result')
+            self.parse(self.analysis_info, stages=parse)
+            logger.info('Rendering report')
+            self.render_report(stages=rebuild)
+        if only is None and since is None:
+            logger.info('Copying static files')
+            self.copy_static()
+
+    def parse_and_render(self, rebuild, parse):
+        """Parse and render the stages one by one to bound the memory.
+
+        Each tool stage is rendered right after parsing. Its full data is
+        then replaced by its summary, see :py:meth:`Stage.summarize`, or
+        dropped if no other stage depends on it. Summary stages get the
+        data of their dependencies only, with spilled data loaded back
+        during their rendering.
+        """
+        graph = self.stage_graph()
+        has_dependents = {dep for deps in graph.values() for dep in deps}
+        for stage in self.sorted_stages():
+            if isinstance(stage, SummaryStage):
+                if stage in rebuild:
+                    stage.render(
+                        self.load_stage_data(graph[stage.name]),
+                        self.report_root
+                    )
+                continue
+            if stage not in parse:
+                continue
+            logger.info('Parsing stage %s' % stage.name)
+            data_info = stage.parse(self.analysis_info)
+            if stage in rebuild:
+                stage.render(data_info, self.report_root)
+            if stage.name not in has_dependents:
+                self.data_info[stage.name] = None
+                continue
+            summary = stage.summarize(data_info)
+            if summary is data_info:
+                logger.debug('Spilling data of stage %s' % stage.name)
+                summary = SpilledStageData.dump(
+                    data_info,
+                    self.cache_root / 'stage_data' /
+                    '{}.pickle'.format(stage.name)
+                )
+            self.data_info[stage.name] = summary
+
+    def load_stage_data(self, stage_names):
+        """Stage data dict with the given stages loaded, others None."""
+        data_info = dict.fromkeys(self.data_info)
+        for name in stage_names:
+            data = self.data_info.get(name)
+            if isinstance(data, SpilledStageData):
+                data = data.load()
+            data_info[name] = data
+        return data_info
 
-        for stage in self.summary_stages:
-            stage.render(self.data_info, self.report_root)
+    def render_report(self, stages=None):
+        """Render and output the report, or only the given stages"""
+        for stage in self.sorted_stages():
+            if stages is not None and stage not in stages:
+                continue
+            if isinstance(stage, SummaryStage):
+                stage.render(self.data_info, self.report_root)
+            else:
+                stage.render(self.data_info[stage.name], self.report_root)
+
+    def render_in_memory(self, pages=None) -> MemoryWriter:
+        """Render the report pages in memory, writing no report files.
+
+        Only the stages rendering the given page names, such as
+        ``['index.html']``, are rendered, or all stages if not given. Stages
+        are parsed when first needed and their data are kept for later
+        calls, so rendering a page of a parsed report takes no file I/O.
+        Parsing still fills the job's cache folder as the usual generation
+        does, such as the expression matrices, the sorted diff runs, the
+        progress caches, the analysis info snapshot and, in low-memory mode,
+        the spilled stage data.
+        The method changes the report state, so calls on the same report
+        must not run concurrently, see
+        :py:class:`bc_report.memory.ReportCache`.
+
+        Returns
+        -------
+        :py:class:`bc_report.output.MemoryWriter` holding the rendered pages
+        and chart data, and the static files mapped to their sources.
+        """
+        stages = self.stages_of_pages(pages)
+        needed = self._graph_closure(
+            {stage.name for stage in stages}, self.stage_graph()
+        )
+        self.parse(self.analysis_info, stages=[
+            stage for stage in self.tool_stages
+            if stage.name in needed and self.data_info[stage.name] is None
+        ])
+
+        writer = MemoryWriter(self.MEMORY_REPORT_ROOT)
+        self.report_root = writer.report_root
+        if self._memory_assets is None:
+            # Static files and production assets are collected once
+            self.writer = MemoryWriter(self.MEMORY_REPORT_ROOT)
+            if self.asset_mode == 'production':
+                self.build_assets()
+            self.copy_static()
+            self._memory_assets = self.writer
+        writer.update(self._memory_assets)
+        self.writer = writer
+        # Chart data are exported again into the new writer
+        self.exported_data = set()
+        self.requested_pages = None if pages is None else set(pages)
+        # The on-disk fragment cache is skipped when rendering in memory
+        fragment_cache, self.fragment_cache = self.fragment_cache, None
+        try:
+            self.render_report(stages=stages)
+        finally:
+            self.requested_pages = None
+            self.fragment_cache = fragment_cache
+        return writer
+
+    def stages_of_pages(self, pages=None) -> List[Stage]:
+        """Stages rendering any of the given pages or data files, or all
+        stages."""
+        if pages is None:
+            return list(self.all_stages)
+        stages = [
+            stage for stage in self.all_stages
+            if any(stage.renders(page) for page in pages)
+        ]
+        unknown = [
+            page for page in pages
+            if not any(stage.renders(page) for stage in stages)
+        ]
+        if unknown:
+            known_pages = {
+                page for stage in self.all_stages
+                for page in stage.page_names()
+            }
+            data_dirs = {
+                data_dir for stage in self.all_stages
+                for data_dir in stage.data_dirs
+            }
+            raise ValueError(
+                'Unknown pages {}, choose from {} or the files under {}'
+                .format(unknown, sorted(known_pages), sorted(data_dirs))
+            )
+        return stages
+
+    def build_assets(self):
+        """Build the production assets the templates will link to."""
+        self.asset_manifest, self.bundle_manifest = build_assets(
+            self.static_roots, self.report_root / 'static', self.asset_bundles,
+            self.writer
+        )
 
     def copy_static(self):
-        merged_copytree(self.static_roots, self.report_root / 'static')
+        static_root = self.report_root / 'static'
+        for rel_pth, src in merged_file_map(self.static_roots).items():
+            self.writer.copy_file(src, static_root / rel_pth)
         for stage in self.all_stages:
             stage.copy_static(self.report_root)
 
@@ -0,0 +1,308 @@
+"""HTTP server of the generated report and its job results.
+
+The report folder is served under ``/report/`` and the job folder or
+archive under ``/result/``, matching the ``../result/...`` links of the
+report pages.
+Clients are served concurrently by threads. Responses carry ETag and
+Cache-Control headers, text files are gzip compressed, and byte ranges of
+large result files, such as BAM files, are sent by
+:py:meth:`socket.socket.sendfile`.
+"""
+from email.utils import formatdate, parsedate_to_datetime
+import gzip
+import html
+from http import HTTPStatus
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+import posixpath
+import re
+from socketserver import ThreadingMixIn
+import urllib.parse
+from . import create_logger
+from .archive import is_local_path, open_result_root
+
+logger = create_logger(__name__)
+
+# Content types compressed on the fly if no .gz sibling exists
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/.*|application/(javascript|json|xml)|image/svg\+xml)$'
+)
+# Larger files are sent as is rather than compressed in memory
+MAX_COMPRESS_SIZE = 8 * 1024 * 1024
+# Static assets renamed by their content hash, such as site.62368a1a29.css
+HASHED_ASSET = re.compile(r'\.[0-9a-f]{10}\.(js|css)$')
+
+# Bytes read at a time from the files inside a job archive
+SEND_CHUNK_SIZE = 64 * 1024
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(range_header, size):
+    """Parse a single byte range of the Range header.
+
+    Returns
+    -------
+    Tuple of the first and the last byte position, ``None`` if the header is
+    not a single byte range, or ``False`` if the range is not satisfiable.
+
+    Examples
+    --------
+
+        >>> parse_range('bytes=0-99', 1000)
+        (0, 99)
+        >>> parse_range('bytes=-100', 1000)
+        (900, 999)
+        >>> parse_range('bytes=1000-', 1000)
+        False
+
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range of the last N bytes
+        suffix_len = int(last)
+        if suffix_len == 0:
+            return False
+        return max(size - suffix_len, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        return False
+    return first, last
+
+
+class ReportRequestHandler(SimpleHTTPRequestHandler):
+    """Serve the report and result folders.
+
+    The folders are set by :py:func:`make_server` on the ``roots`` class
+    attribute, a dict of URL prefix to folder.
+    """
+
+    server_version = 'BCReportHTTP/1.0'
+    protocol_version = 'HTTP/1.1'
+    roots = {}
+
+    def translate_path(self, path):
+        """Map the URL path to the file path, or ``None`` if out of roots."""
+        path = urllib.parse.unquote(path.split('?', 1)[0].split('#', 1)[0])
+        parts = [p for p in posixpath.normpath(path).split('/') if p]
+        if not parts or parts[0] not in self.roots or '..' in parts:
+            return None
+        return self.roots[parts[0]].joinpath(*parts[1:])
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body):
+        url_path = self.path.split('?', 1)[0]
+        if url_path == '/':
+            self.redirect('/report/index.html')
+            return
+        pth = self.translate_path(self.path)
+        if pth is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        if pth.is_dir():
+            if not url_path.endswith('/'):
+                self.redirect(url_path + '/')
+            elif (pth / 'index.html').is_file():
+                self.serve_file(pth / 'index.html', send_body)
+            else:
+                self.serve_listing(pth, send_body)
+            return
+        if not pth.is_file():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.serve_file(pth, send_body)
+
+    def redirect(self, location):
+        self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def serve_listing(self, pth, send_body):
+        """List the folder, which may be inside a job archive."""
+        try:
+            children = sorted(pth.iterdir(), key=lambda c: c.name.lower())
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'Cannot list directory')
+            return
+        title = 'Directory listing for {}'.format(
+            html.escape(urllib.parse.unquote(self.path), quote=False)
+        )
+        lines = [
+            '<!DOCTYPE html>',
+            '<html><head><meta charset="utf-8">',
+            '<title>{}</title></head>'.format(title),
+            '<body><h1>{}</h1><hr><ul>'.format(title),
+        ]
+        for child in children:
+            name = child.name + ('/' if child.is_dir() else '')
+            lines.append('<li><a href="{}">{}</a></li>'.format(
+                urllib.parse.quote(name), html.escape(name, quote=False)
+            ))
+        lines.append('</ul><hr></body></html>\n')
+        body = '\n'.join(lines).encode('utf8')
+        self.send_headers(HTTPStatus.OK, [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ])
+        if send_body:
+            self.wfile.write(body)
+
+    def accepts_gzip(self):
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def cache_control(self, pth):
+        if HASHED_ASSET.search(pth.name):
+            return 'public, max-age=31536000, immutable'
+        return 'no-cache'
+
+    def not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def serve_file(self, pth, send_body):
+        content_type = self.guess_type(str(pth))
+        compressible = COMPRESSIBLE_TYPES.match(content_type) is not None
+        gz_pth = pth.with_name(pth.name + '.gz')
+        use_gzip = 'Range' not in self.headers and self.accepts_gzip()
+        precompressed = use_gzip and gz_pth.is_file()
+        if precompressed:
+            # Sibling written in production asset mode
+            pth = gz_pth
+        stat = pth.stat()
+        compress = (
+            use_gzip and not precompressed and compressible
+            and stat.st_size <= MAX_COMPRESS_SIZE
+        )
+        etag = '"{:x}-{:x}{}"'.format(
+            stat.st_mtime_ns, stat.st_size,
+            '-gz' if precompressed or compress else ''
+        )
+
+        headers = [
+            ('Content-Type', content_type),
+            ('ETag', etag),
+            ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+            ('Cache-Control', self.cache_control(pth)),
+            ('Accept-Ranges', 'bytes'),
+        ]
+        if compressible or precompressed:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if self.not_modified(etag, stat.st_mtime):
+            self.send_not_modified(headers)
+        elif compress:
+            self.send_compressed(pth, headers, send_body)
+        else:
+            if precompressed:
+                headers.append(('Content-Encoding', 'gzip'))
+            self.send_file_range(pth, stat, etag, headers, send_body)
+
+    def send_headers(self, status, headers):
+        self.send_response(status)
+        for key, val in headers:
+            self.send_header(key, val)
+        self.end_headers()
+
+    def send_not_modified(self, headers):
+        self.send_headers(HTTPStatus.NOT_MODIFIED, headers)
+
+    def send_compressed(self, pth, headers, send_body):
+        """Send the file gzip compressed in memory."""
+        with pth.open('rb') as f:
+            body = gzip.compress(f.read())
+        self.send_headers(HTTPStatus.OK, headers + [
+            ('Content-Encoding', 'gzip'),
+            ('Content-Length', str(len(body))),
+        ])
+        if send_body:
+            self.wfile.write(body)
+
+    def send_file_range(self, pth, stat, etag, headers, send_body):
+        """Send the whole file, or the byte range requested by the client."""
+        first, last = 0, stat.st_size - 1
+        status = HTTPStatus.OK
+        if 'Range' in self.headers and self.range_applies(etag):
+            byte_range = parse_range(self.headers['Range'], stat.st_size)
+            if byte_range is False:
+                self.send_headers(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, [
+                    ('Content-Range', 'bytes */{}'.format(stat.st_size)),
+                    ('Content-Length', '0'),
+                ])
+                return
+            if byte_range is not None:
+                first, last = byte_range
+                status = HTTPStatus.PARTIAL_CONTENT
+                headers = headers + [('Content-Range', 'bytes {}-{}/{}'.format(
+                    first, last, stat.st_size
+                ))]
+        self.send_headers(
+            status, headers + [('Content-Length', str(last - first + 1))]
+        )
+        if send_body and stat.st_size:
+            self.send_body_range(pth, first, last - first + 1)
+
+    def send_body_range(self, pth, offset, count):
+        """Send the bytes of the file by sendfile, or by reading them if the
+        file is inside a job archive."""
+        self.wfile.flush()
+        with pth.open('rb') as f:
+            if is_local_path(pth):
+                self.connection.sendfile(f, offset, count)
+                return
+            f.seek(offset)
+            while count > 0:
+                chunk = f.read(min(count, SEND_CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                count -= len(chunk)
+
+    def range_applies(self, etag):
+        """Range applies unless If-Range names another file version."""
+        if_range = self.headers.get('If-Range')
+        return if_range is None or if_range.strip() == etag
+
+    def log_message(self, format, *args):
+        logger.info('{} - {}'.format(self.address_string(), format % args))
+
+
+class ThreadingReportServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(report_dir, job_dir, host='127.0.0.1', port=8000):
+    """Create the server of the report folder and the job folder or archive.
+
+    A job archive is served in place like the report generation reads it,
+    see :py:func:`bc_report.archive.open_result_root`. Call
+    ``serve_forever()`` on the returned server to start serving.
+    """
+    handler_cls = type('BoundReportRequestHandler', (ReportRequestHandler,), {
+        'roots': {
+            'report': Path(report_dir).resolve(),
+            'result': open_result_root(job_dir),
+        },
+    })
+    return ThreadingReportServer((host, port), handler_cls)
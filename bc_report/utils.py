@@ -1,4 +1,9 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time
 from decimal import Decimal
+import hashlib
+import itertools
 import json
 import os
 from pathlib import Path
@@ -7,10 +12,175 @@ from . import create_logger
 
 logger = create_logger(__name__)
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def tojson(a, *args, **kw):
-    """Convert the value to JSON"""
-    return json.dumps(a, *args, **kw)
+
+def round_floats(value, precision):
+    """Round the floats nested in lists, tuples, dicts, and NumPy arrays.
+
+    NumPy arrays are rounded in bulk and converted to lists.
+    """
+    if np is not None and isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        return round(value, precision)
+    if isinstance(value, dict):
+        return {k: round_floats(v, precision) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [round_floats(v, precision) for v in value]
+    if np is not None and isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            # Round in double precision, or float32 noise reappears in lists
+            value = value.astype(np.float64).round(precision)
+        return value.tolist()
+    return value
+
+
+class ReportJSONEncoder(json.JSONEncoder):
+    """JSON encoder of the report data.
+
+    Besides the built-in types, it encodes NumPy arrays and scalars,
+    :py:class:`~decimal.Decimal`, and the date and time objects, which are
+    written in ISO 8601 format. Floats are rounded to the given number of
+    decimal places if ``precision`` is set.
+    """
+
+    def __init__(self, *args, precision=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.precision = precision
+
+    def encode(self, o):
+        if self.precision is not None:
+            o = round_floats(o, self.precision)
+        return super().encode(o)
+
+    def default(self, o):
+        if np is not None:
+            if isinstance(o, np.ndarray):
+                return o.tolist()
+            if isinstance(o, np.generic):
+                return o.item()
+        if isinstance(o, Decimal):
+            return float(o)
+        if isinstance(o, (date, time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def tojson(value, precision=None, separators=(',', ':'), **kwargs):
+    """Convert the value to compact JSON.
+
+    Parameters
+    ----------
+    value :
+        Value to convert, which may contain the types supported by
+        :py:class:`ReportJSONEncoder`.
+    precision : int, optional
+        Round the floats to the given number of decimal places.
+    separators : tuple
+        Item and key separators passed to :py:func:`json.dumps`.
+
+    Examples
+    --------
+
+        >>> tojson({'data': np.array([0.12345, 2.5]), 'n': np.int64(3)},
+        ...        precision=2)
+        '{"data":[0.12,2.5],"n":3}'
+
+    """
+    return json.dumps(
+        value, cls=ReportJSONEncoder, precision=precision,
+        separators=separators, **kwargs
+    )
+
+
+BINARY_DTYPES = OrderedDict([
+    ('float32', '<f4'),
+    ('int32', '<i4'),
+    ('float64', '<f8'),
+])
+"""Little-endian types of the arrays packed by :py:func:`pack_arrays`, by
+the names of their JavaScript typed arrays without the ``Array`` suffix."""
+
+_INT32_INFO = np.iinfo(np.int32) if np is not None else None
+
+
+def binary_dtype_name(arr) -> str:
+    """Name of the binary type of the NumPy array, or ``None`` if it is not
+    numeric.
+
+    Floats are packed in single precision and integers as int32, or in
+    double precision if they overflow int32.
+    """
+    if arr.dtype.kind == 'f':
+        return 'float32'
+    if arr.dtype.kind in 'iub':
+        if not arr.size or (
+            arr.min() >= _INT32_INFO.min and arr.max() <= _INT32_INFO.max
+        ):
+            return 'int32'
+        return 'float64'
+    return None
+
+
+def pack_arrays(value):
+    """Move the numeric NumPy arrays of the value into a binary buffer.
+
+    The arrays nested in dicts, lists, and tuples are replaced by
+    descriptors ``{"$array": <type>, "offset": <bytes>, "shape": [...]}``
+    of their C-ordered values in the buffer, see :py:data:`BINARY_DTYPES`.
+    Offsets are aligned to 8 bytes so the browser can view the buffer as
+    typed arrays without copying.
+
+    Returns
+    -------
+    The value with the arrays replaced, and the buffer as bytes.
+
+    Examples
+    --------
+
+        >>> pack_arrays({'data': np.array([1.5, 2.5]), 'n': 3})
+        ({'data': {'$array': 'float32', 'offset': 0, 'shape': [2]}, 'n': 3},
+         b'\x00\x00\xc0?\x00\x00 @')
+
+    """
+    chunks = []
+    offset = 0
+
+    def pack(value):
+        nonlocal offset
+        if isinstance(value, dict):
+            return {k: pack(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [pack(v) for v in value]
+        if np is None or not isinstance(value, np.ndarray):
+            return value
+        dtype_name = binary_dtype_name(value)
+        if dtype_name is None:
+            return value
+        content = np.ascontiguousarray(
+            value, dtype=BINARY_DTYPES[dtype_name]
+        ).tobytes()
+        padding = -offset % 8
+        if padding:
+            chunks.append(bytes(padding))
+            offset += padding
+        descriptor = {
+            '$array': dtype_name,
+            'offset': offset,
+            'shape': list(value.shape),
+        }
+        chunks.append(content)
+        offset += len(content)
+        return descriptor
+
+    packed = pack(value)
+    return packed, b''.join(chunks)
 
 
 def humanfmt(
@@ -80,6 +250,28 @@ def humanfmt(
     return ''.join(reversed(result))
 
 
+def format_size(num_bytes, places=1):
+    """Format the file size in bytes by the closest binary unit.
+
+    Examples
+    --------
+
+        >>> format_size(123)
+        '123 B'
+        >>> format_size(123456789)
+        '117.7 MB'
+
+    """
+    size = Decimal(num_bytes)
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024 or unit == 'TB':
+            break
+        size /= 1024
+    return '{} {}'.format(
+        humanfmt(size, places=0 if unit == 'B' else places), unit
+    )
+
+
 def open(path_like, *args, **kwargs):
     """Custom open() that accepts :py:class:`pathlib.Path` object.
 
@@ -124,7 +316,8 @@ def discover_file_by_patterns(path_like, file_patterns="*"):
     """Discover files under certain path based on given patterns.
 
     Support both ``**`` and ``*`` globbing syntax.
-    Call :py:func:`pathlib.Path.glob` internally.
+    Call :py:func:`pathlib.Path.glob` internally, or the ``glob`` method of
+    the path inside a job archive.
 
     Parameters
     ----------
@@ -153,11 +346,12 @@ def discover_file_by_patterns(path_like, file_patterns="*"):
     """
     # if input is str
     if isinstance(file_patterns, str):
-        found_file_list = list(Path(path_like).glob(file_patterns))
+        found_file_list = list(as_path(path_like).glob(file_patterns))
         logger.info(
             "{2} file matching single pattern {1} under {0!s}"
             .format(path_like, file_patterns, len(found_file_list))
         )
+        return found_file_list
 
     # if input is iterable
     try:
@@ -167,7 +361,7 @@ def discover_file_by_patterns(path_like, file_patterns="*"):
                 raise TypeError(
                     "File pattern should be str, not {}".format(file_patterns)
                 )
-            file_list = list(Path(path_like).glob(pattern))
+            file_list = list(as_path(path_like).glob(pattern))
             logger.debug(
                 "... {} file found by {}"
                 .format(len(file_list), pattern)
@@ -186,6 +380,115 @@ def discover_file_by_patterns(path_like, file_patterns="*"):
         ) from te
 
 
+def read_bytes(path_like):
+    """Read the whole file as bytes."""
+    with as_path(path_like).open('rb') as f:
+        return f.read()
+
+
+def prefetch(items, load, workers=8, max_pending=None):
+    """Load the items concurrently and yield the results in order.
+
+    Up to ``max_pending`` items, twice the workers by default, are loaded
+    ahead of the item being consumed. So on high-latency storage, such as
+    NFS, the reads of many small files overlap rather than wait a round
+    trip each, while the memory of the loaded results stays bounded.
+
+    Parameters
+    ----------
+    items : iterable
+        Items to load, such as file paths.
+    load : callable
+        Function loading an item, run in the worker threads.
+    workers : int
+        Number of concurrent loads.
+    max_pending : int, optional
+        Number of items loaded ahead.
+
+    Yields
+    ------
+    Tuple of the item and its loaded result, in the order of the items.
+
+    Examples
+    --------
+
+        >>> for pth, content in prefetch(paths, read_bytes, workers=4):
+        ...     parse(content)
+
+    """
+    if max_pending is None:
+        max_pending = 2 * workers
+    items = iter(items)
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque(
+            (item, executor.submit(load, item))
+            for item in itertools.islice(items, max_pending)
+        )
+        while pending:
+            item, future = pending.popleft()
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, executor.submit(load, next_item)))
+            yield item, future.result()
+
+
+def prefetch_files(paths, workers=8, max_pending=None):
+    """Read the files concurrently and yield their contents in order.
+
+    See :py:func:`prefetch`.
+    """
+    return prefetch(paths, read_bytes, workers, max_pending)
+
+
+def scan_dir(path_like):
+    """Stat all the files of a folder by a single :py:func:`os.scandir` call.
+
+    Returns
+    -------
+    Dict of file name to its :py:class:`os.stat_result`. Empty if the
+    folder does not exist.
+    """
+    stats = {}
+    try:
+        if not isinstance(path_like, (str, Path)):
+            # Folder inside a job archive, listed from its member table
+            for pth in path_like.iterdir():
+                if pth.is_file():
+                    stats[pth.name] = pth.stat()
+            return stats
+        for entry in os.scandir(strify_path(path_like)):
+            if entry.is_file():
+                stats[entry.name] = entry.stat()
+    except FileNotFoundError:
+        logger.debug('Folder {!s} does not exist'.format(path_like))
+    return stats
+
+
+def merged_file_map(src_list):
+    """Map the relative paths of the merged folders to their source files.
+
+    Like :py:func:`merged_copytree`, a file of the later folder overrides
+    the file of the same relative path in the former folders.
+
+    Returns
+    -------
+    OrderedDict of the relative :py:class:`pathlib.Path` to the source file.
+    """
+    file_map = OrderedDict()
+    for src in src_list:
+        src_p = Path(src)
+        for current_root, dirs, files in os.walk(strify_path(src)):
+            current_p = Path(current_root)
+            for f in files:
+                rel_pth = current_p.relative_to(src_p) / f
+                if rel_pth in file_map:
+                    logger.warning(
+                        "File {} existed, overwritten by {}"
+                        .format(file_map[rel_pth], current_p / f)
+                    )
+                file_map[rel_pth] = current_p / f
+    return file_map
+
+
 def merged_copytree(src_list, dst):
     dst_p = Path(dst)
     if not dst_p.exists():
@@ -237,7 +540,7 @@ def strify_path(path_like):
         "ngcloud/hi.py"
 
     """
-    if isinstance(path_like, Path):
+    if isinstance(path_like, Path) or hasattr(path_like, 'as_posix'):
         return path_like.as_posix()
     elif isinstance(path_like, str):
         return path_like
@@ -247,6 +550,48 @@ def strify_path(path_like):
         )
 
 
+def as_path(path_like):
+    """Path object of the path-like object.
+
+    Paths inside job archives, see :py:mod:`bc_report.archive`, are returned
+    as is.
+    """
+    if isinstance(path_like, str):
+        return Path(path_like)
+    return path_like
+
+
+def get_cache_dir(*path_parts):
+    """Get the folder for caching parsed results across report generations.
+
+    The cache root defaults to ``~/.cache/bc_report`` and can be changed by
+    the environment variable ``BC_REPORT_CACHE_DIR``. The folder will be
+    created if it does not exist.
+
+    Examples
+    --------
+
+        >>> get_cache_dir('some_job', 'star')
+        PosixPath('/home/user/.cache/bc_report/some_job/star')
+
+    """
+    cache_root = os.environ.get(
+        'BC_REPORT_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'bc_report')
+    )
+    cache_dir = Path(cache_root, *path_parts)
+    if not cache_dir.exists():
+        cache_dir.mkdir(parents=True)
+    return cache_dir
+
+
+def path_digest(path_like, length=16):
+    """Short hex digest of the path, used to name its cache folder."""
+    return hashlib.sha1(
+        strify_path(path_like).encode('utf8')
+    ).hexdigest()[:length]
+
+
 def is_pathlike(path_like):
     """Helper function to determine is pathlike object."""
     if isinstance(path_like, Path) or isinstance(path_like, str):
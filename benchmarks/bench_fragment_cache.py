@@ -0,0 +1,125 @@
+"""Benchmark the fragment cache on the FastQC QC info table.
+
+Render a page of the per-source QC info rows, mimicking
+``base/fastqc_page.html``, without the ``{% cache %}`` block, and with it
+on a cold and a warm :py:class:`bc_report.fragments.FragmentCache`. A cold
+cache renders and writes every row, and a warm one reads every row back.
+
+Usage, with bc_report installed or on the ``PYTHONPATH``::
+
+    python benchmarks/bench_fragment_cache.py [--sources 100] [--repeat 5]
+
+"""
+import argparse
+from collections import OrderedDict
+import shutil
+import tempfile
+import timeit
+import jinja2
+from bc_report.fragments import FragmentCache, FragmentCacheExtension
+
+MODULES = [
+    'Basic Statistics', 'Per base sequence quality',
+    'Per tile sequence quality', 'Per sequence quality scores',
+    'Per sequence GC content', 'Per base N content',
+    'Sequence Length Distribution', 'Sequence Duplication Levels',
+    'Overrepresented sequences', 'Adapter Content', 'Kmer Content',
+]
+STATUS_TO_ICON_CLASS = {
+    'pass': 'fa-check',
+    'fail': 'fa-times',
+    'warn': 'fa-exclamation',
+}
+
+ROW_TEMPLATE = '''
+<td><a href="{{ link }}">{{ source }}</a></td>
+{% for module in MODULES %}
+    <td>
+        {% if module in qc_info %}
+            <i class="fa {{ STATUS_TO_ICON_CLASS[qc_info[module]] }}"></i>
+        {% else %}
+            NA
+        {% endif %}
+        <span class="sr-only">{{ qc_info.get(module, 'NA') }}</span>
+    </td>
+{% endfor %}
+'''
+
+PAGE_TEMPLATE = '''
+{% for source, qc_info in sources.items() %}
+    {% set link = 'result/' + source + '_fastqc.html' %}
+    <tr>
+    {% if cached %}
+        {% cache source, link, qc_info, MODULES, STATUS_TO_ICON_CLASS %}
+        {% include 'row.html' %}
+        {% endcache %}
+    {% else %}
+        {% include 'row.html' %}
+    {% endif %}
+    </tr>
+{% endfor %}
+'''
+
+
+def make_sources(num_sources):
+    statuses = ['pass', 'warn', 'fail']
+    return OrderedDict(
+        (
+            'source_{}'.format(i),
+            OrderedDict(
+                (module, statuses[(i + j) % 3])
+                for j, module in enumerate(MODULES)
+            ),
+        )
+        for i in range(num_sources)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sources', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    env = jinja2.Environment(
+        loader=jinja2.DictLoader({
+            'page.html': PAGE_TEMPLATE, 'row.html': ROW_TEMPLATE,
+        }),
+        extensions=[FragmentCacheExtension],
+    )
+    tpl = env.get_template('page.html')
+    context = {
+        'sources': make_sources(args.sources),
+        'MODULES': MODULES,
+        'STATUS_TO_ICON_CLASS': STATUS_TO_ICON_CLASS,
+    }
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = FragmentCache(cache_dir)
+        env.get_fragment_cache = lambda: cache
+
+        def render_cold():
+            shutil.rmtree(cache_dir)
+            cache.__init__(cache_dir)
+            return tpl.render(context, cached=True)
+
+        cases = [
+            ('uncached', lambda: tpl.render(context, cached=False)),
+            ('cold cache', render_cold),
+            ('warm cache', lambda: tpl.render(context, cached=True)),
+        ]
+        print('{} sources, best of {} runs'.format(
+            args.sources, args.repeat
+        ))
+        for name, func in cases:
+            func()
+            best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print('{:<12s} {:8.2f} ms {:8.1f} us/row'.format(
+                name, best * 1000, best * 1e6 / args.sources
+            ))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
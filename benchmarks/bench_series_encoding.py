@@ -0,0 +1,184 @@
+"""Benchmark the binary encoding of chart series against JSON.
+
+Compare the chart data files :py:meth:`bc_report.report.Stage.export_data`
+writes for cohort-sized FastQC per base quality and STAR progress series,
+either as JSON number arrays or as JSON with the arrays packed into a
+float32/int32 sidecar buffer, see :py:func:`bc_report.utils.pack_arrays`.
+Reported are the payload sizes, raw, gzipped, and as base64 had the buffer
+been inlined, and the Python encoding time. If Node.js is found, the parse
+time is measured too, by ``JSON.parse`` against ``ChartData.unpack`` of the
+report's ``chart_data.js``, which is what the browser runs.
+
+Usage, with bc_report installed or on the ``PYTHONPATH``::
+
+    python benchmarks/bench_series_encoding.py [--sources 500] [--repeat 5]
+
+"""
+import argparse
+import base64
+import gzip
+import json
+from pathlib import Path
+import shutil
+import subprocess
+import tempfile
+import timeit
+import numpy as np
+from bc_report.utils import pack_arrays, tojson
+
+CHART_DATA_JS = (
+    Path(__file__).resolve().parents[1] /
+    'bc_pipelines/base/static/js/chart_data.js'
+)
+
+NODE_SCRIPT = '''
+var fs = require('fs'), vm = require('vm');
+var dir = process.argv[1], repeat = parseInt(process.argv[2], 10);
+var context = {jQuery: {}};
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(process.argv[3], 'utf8'), context);
+
+function best(func) {
+    var result = Infinity;
+    for (var i = 0; i < repeat; i++) {
+        var start = process.hrtime();
+        func();
+        var elapsed = process.hrtime(start);
+        result = Math.min(result, elapsed[0] * 1e3 + elapsed[1] / 1e6);
+    }
+    return result;
+}
+
+var jsonText = fs.readFileSync(dir + '/series.json', 'utf8');
+var binaryText = fs.readFileSync(dir + '/binary.json', 'utf8');
+var bin = fs.readFileSync(dir + '/binary.bin');
+var buffer = bin.buffer.slice(bin.byteOffset, bin.byteOffset + bin.length);
+console.log(JSON.stringify({
+    json: best(function () { JSON.parse(jsonText); }),
+    binary: best(function () {
+        context.ChartData.unpack(JSON.parse(binaryText).$data, buffer);
+    })
+}));
+'''
+
+
+def make_cohort(num_sources, num_positions=150, num_progress=200, seed=0):
+    """Mimic the FastQC per base quality and STAR progress series."""
+    rng = np.random.RandomState(seed)
+    per_base_quality = [
+        {
+            'name': 'source_{}'.format(i),
+            'data': rng.uniform(20, 40, num_positions),
+            'pointStart': 1,
+        }
+        for i in range(num_sources)
+    ]
+    progress = [
+        {
+            'name': 'sample_{}'.format(i),
+            'data': np.column_stack([
+                np.round(np.linspace(0, 10, num_progress), 3),
+                np.round(rng.uniform(0, 100, num_progress), 2),
+            ]),
+        }
+        for i in range(num_sources)
+    ]
+    num_read = [
+        {
+            'name': 'metric_{}'.format(i),
+            'data': rng.randint(0, 50000000, num_sources),
+        }
+        for i in range(8)
+    ]
+    return {
+        'per_base_quality': per_base_quality,
+        'progress': progress,
+        'num_read': num_read,
+    }
+
+
+def encode_binary(series, precision=None):
+    packed, buffer = pack_arrays(series)
+    content = tojson(
+        {'$buffer': 'binary.bin', '$data': packed}, precision=precision
+    )
+    return content, buffer
+
+
+def parse_times(json_content, binary_content, buffer, repeat):
+    """Best parse times in ms in Node.js, or ``None`` if not installed."""
+    node = shutil.which('node') or shutil.which('nodejs')
+    if node is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        (tmp_dir / 'series.json').write_text(json_content)
+        (tmp_dir / 'binary.json').write_text(binary_content)
+        (tmp_dir / 'binary.bin').write_bytes(buffer)
+        output = subprocess.check_output([
+            node, '-e', NODE_SCRIPT,
+            str(tmp_dir), str(repeat), str(CHART_DATA_JS),
+        ])
+    return json.loads(output.decode('utf8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sources', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cohort = make_cohort(args.sources)
+    # Precision as the stages export them
+    cases = [
+        ('per_base_quality', 2),
+        ('progress', None),
+        ('num_read', None),
+    ]
+    print('{} sources, best of {} runs'.format(args.sources, args.repeat))
+    print('{:<17s}{:<8s}{:>12s}{:>12s}{:>12s}{:>10s}{:>10s}'.format(
+        'series', 'format', 'bytes', 'gzipped', 'base64', 'encode', 'parse'
+    ))
+    for name, precision in cases:
+        series = cohort[name]
+        json_content = tojson(series, precision=precision)
+        binary_content, buffer = encode_binary(series, precision)
+        encode_json = min(timeit.repeat(
+            lambda: tojson(series, precision=precision),
+            number=1, repeat=args.repeat
+        ))
+        encode_bin = min(timeit.repeat(
+            lambda: encode_binary(series, precision),
+            number=1, repeat=args.repeat
+        ))
+        parsing = parse_times(
+            json_content, binary_content, buffer, args.repeat
+        ) or {}
+        binary_bytes = binary_content.encode('utf8')
+        rows = [
+            (
+                'json', len(json_content.encode('utf8')),
+                len(gzip.compress(json_content.encode('utf8'))), '',
+                encode_json, parsing.get('json'),
+            ),
+            (
+                'binary', len(binary_bytes) + len(buffer),
+                len(gzip.compress(binary_bytes)) +
+                len(gzip.compress(buffer)),
+                len(binary_bytes) + len(base64.b64encode(buffer)),
+                encode_bin, parsing.get('binary'),
+            ),
+        ]
+        for fmt, size, gz_size, b64_size, encode, parse in rows:
+            print(
+                '{:<17s}{:<8s}{:>12,d}{:>12,d}{:>12}{:>8.1f}ms{:>10}'.format(
+                    name, fmt, size, gz_size,
+                    '{:,d}'.format(b64_size) if b64_size else '-',
+                    encode * 1000,
+                    '{:.1f}ms'.format(parse) if parse is not None else '-',
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
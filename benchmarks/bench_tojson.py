@@ -0,0 +1,103 @@
+"""Benchmark the tojson filter on cohort-sized chart series.
+
+Compare the previous path, which passed lists of NumPy scalars to
+:py:func:`json.dumps`, against :py:func:`bc_report.utils.tojson` encoding
+the NumPy arrays in bulk with fixed precision and compact separators.
+
+Usage, with bc_report installed or on the ``PYTHONPATH``::
+
+    python benchmarks/bench_tojson.py [--sources 500] [--repeat 5]
+
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import timeit
+import numpy as np
+from bc_report.utils import tojson
+
+
+def make_cohort(num_sources, num_positions=150, num_progress=200, seed=0):
+    """Mimic the FastQC per base quality and STAR progress series."""
+    rng = np.random.RandomState(seed)
+    per_base_quality = [
+        {
+            'name': 'source_{}'.format(i),
+            'data': rng.uniform(20, 40, num_positions),
+            'pointStart': 1,
+        }
+        for i in range(num_sources)
+    ]
+    start = datetime(2016, 1, 1)
+    progress = [
+        {
+            'name': 'sample_{}'.format(i),
+            'data': np.column_stack([
+                np.linspace(0, 10, num_progress),
+                rng.uniform(0, 100, num_progress),
+            ]),
+            'finished': start + timedelta(hours=i),
+        }
+        for i in range(num_sources)
+    ]
+    return {'per_base_quality': per_base_quality, 'progress': progress}
+
+
+def previous_path(cohort, precision=None):
+    """Convert to built-in types first, as the stages used to do."""
+    def to_list(values):
+        if precision is None:
+            return list(values)
+        return [round(float(v), precision) for v in values]
+
+    return json.dumps({
+        'per_base_quality': [
+            dict(series, data=to_list(series['data']))
+            for series in cohort['per_base_quality']
+        ],
+        'progress': [
+            dict(
+                series,
+                data=[to_list(row) for row in series['data']],
+                finished=series['finished'].isoformat(),
+            )
+            for series in cohort['progress']
+        ],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sources', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cohort = make_cohort(args.sources)
+    cases = [
+        (
+            'full precision',
+            lambda: previous_path(cohort),
+            lambda: tojson(cohort),
+        ),
+        (
+            'precision=2',
+            lambda: previous_path(cohort, precision=2),
+            lambda: tojson(cohort, precision=2),
+        ),
+    ]
+    print('{} sources, best of {} runs'.format(args.sources, args.repeat))
+    for name, previous, current in cases:
+        timings = []
+        for func in [previous, current]:
+            size = len(func())
+            best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            timings.append(best)
+            print('{:<16s} {:<10s} {:8.1f} ms {:10,d} bytes'.format(
+                name, 'previous' if func is previous else 'tojson',
+                best * 1000, size
+            ))
+        print('{:<16s} speedup {:.2f}x'.format(name, timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
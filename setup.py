@@ -53,8 +53,10 @@ if sys.platform.startswith("win32"):
 else:
     color_dep = ['colorlog']
 
+assets_dep = ['rjsmin', 'rcssmin']
+
 all_dep = []
-for deps in [color_dep]:
+for deps in [color_dep, assets_dep]:
     all_dep.extend(deps)
 
 setup(
@@ -85,6 +87,7 @@ setup(
     extras_require={
         ':python_version=="3.3"': ['pathlib'],
         'color': color_dep,
+        'assets': assets_dep,
         'all': all_dep,
     },
 
@@ -104,6 +107,8 @@ setup(
     entry_points={
         'console_scripts': [
             'bc_report = bc_report.cli:generate_report_cli',
+            'bc_report_serve = bc_report.cli:serve_report_cli',
+            'bc_report_metrics = bc_report.cli:metrics_cli',
         ],
     },
 